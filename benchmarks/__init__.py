@@ -0,0 +1,2 @@
+""" Offline benchmarks of the dataset readers, with synthetic input files.
+ Not installed with setup.py, run from the repository folder """
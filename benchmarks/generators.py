@@ -0,0 +1,280 @@
+""" Synthetic data file generators for the reader benchmarks
+
+ Each generator writes n records, in the format of the source dataset
+ files, to the given file, and returns the file name.
+ Records are made up, but include the attributes the readers
+ and the xml tuners process.
+"""
+from __future__ import print_function
+
+import gzip
+import json
+import random
+import zipfile
+
+AMINOACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+
+def uniprot_xml(outfile, n, seed=1):
+    rnd = random.Random(seed)
+    with gzip.open(outfile, 'wt') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<uniprot xmlns="http://uniprot.org/uniprot">\n')
+        for i in range(n):
+            length = rnd.randint(50, 800)
+            seq = ''.join(rnd.choice(AMINOACIDS) for _ in range(length))
+            f.write(
+                '<entry dataset="Swiss-Prot" created="2000-05-30"'
+                ' modified="2020-02-26" version="%d">\n'
+                '<accession>P%05d</accession><accession>Q%05d</accession>\n'
+                '<name>PROT%d_HUMAN</name>\n'
+                '<protein><recommendedName><fullName>Protein %d</fullName>'
+                '<ecNumber>1.1.1.%d</ecNumber></recommendedName>'
+                '<alternativeName><fullName>Alt protein %d</fullName>'
+                '</alternativeName></protein>\n'
+                '<gene><name type="primary">G%d</name>'
+                '<name type="synonym">S%d</name></gene>\n'
+                '<organism><name type="scientific">Homo sapiens</name>'
+                '<dbReference type="NCBI Taxonomy" id="9606"/>'
+                '<lineage><taxon>Eukaryota</taxon><taxon>Metazoa</taxon>'
+                '</lineage></organism>\n'
+                % (rnd.randint(1, 200), i, i, i, i, i % 300, i, i, i))
+            for j in range(rnd.randint(1, 5)):
+                f.write('<reference key="%d"><citation type="journal article"'
+                        ' date="%d-%02d" name="Nature" volume="1">'
+                        '<title>Title of article %d</title>'
+                        '<dbReference type="PubMed" id="%d"/></citation>'
+                        '<scope>NUCLEOTIDE SEQUENCE</scope>'
+                        '<source><tissue>Brain</tissue></source>'
+                        '</reference>\n'
+                        % (j + 1, rnd.randint(1980, 2020),
+                           rnd.randint(1, 12), j, rnd.randint(1, 10**7)))
+            f.write('<comment type="function"><text evidence="1">'
+                    'Function of protein %d</text></comment>\n'
+                    '<comment type="subcellular location">'
+                    '<subcellularLocation><location>Cytoplasm</location>'
+                    '</subcellularLocation></comment>\n'
+                    '<dbReference type="GO" id="GO:%07d">'
+                    '<property type="term" value="C:cytoplasm"/>'
+                    '</dbReference>\n'
+                    '<keyword id="KW-0181">Complete proteome</keyword>\n'
+                    '<feature type="chain" id="PRO_%010d"'
+                    ' description="Protein %d"><location>'
+                    '<begin position="1"/><end position="%d"/>'
+                    '</location></feature>\n'
+                    '<feature type="site" description="Cleavage"><location>'
+                    '<position position="%d"/></location></feature>\n'
+                    '<evidence type="ECO:0000269" key="1"/>\n'
+                    '<sequence length="%d" mass="%d" checksum="%016X"'
+                    ' modified="2000-05-30" version="1">%s</sequence>\n'
+                    '</entry>\n'
+                    % (i, rnd.randint(1, 10**6), i, i, length,
+                       rnd.randint(1, length), length, length * 110,
+                       rnd.getrandbits(64), seq))
+        f.write('<copyright>Synthetic data</copyright>\n</uniprot>\n')
+    return outfile
+
+
+def clinvar_xml(outfile, n, seed=1):
+    rnd = random.Random(seed)
+    with gzip.open(outfile, 'wt') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<ClinVarVariationRelease ReleaseDate="2020-01-01">\n')
+        for i in range(n):
+            f.write(
+                '<VariationArchive VariationID="%d" VariationName="v%d"'
+                ' VariationType="single nucleotide variant"'
+                ' DateCreated="2015-01-01" RecordType="interpreted">\n'
+                '<InterpretedRecord>\n'
+                '<SimpleAllele AlleleID="%d" VariationID="%d">'
+                '<GeneList><Gene Symbol="G%d" GeneID="%d"/></GeneList>'
+                '<Name>NM_%06d.1:c.%dA&gt;G</Name>'
+                '<OtherNameList><Name>p.Lys%dGlu</Name></OtherNameList>'
+                '<MolecularConsequenceList><MolecularConsequence'
+                ' Type="missense variant" DB="SO" ID="SO:0001583"/>'
+                '</MolecularConsequenceList></SimpleAllele>\n'
+                '<RCVList><RCVAccession Title="v%d AND disease"'
+                ' Accession="RCV%09d"><InterpretedConditionList>'
+                '<InterpretedCondition DB="MedGen" ID="C%07d">Disease %d'
+                '</InterpretedCondition></InterpretedConditionList>'
+                '</RCVAccession></RCVList>\n'
+                '<ClinicalAssertionList>\n'
+                % (i, i, i + 10**6, i, i % 500, i % 500, i, i, i, i, i,
+                   rnd.randint(1, 10**6), i % 1000))
+            for j in range(rnd.randint(1, 4)):
+                f.write(
+                    '<ClinicalAssertion ID="%d" DateCreated="2016-01-01">'
+                    '<Interpretation DateLastEvaluated="2017-06-01T00:00:00">'
+                    '<Description>Pathogenic</Description>'
+                    '<Comment>Comment %d</Comment></Interpretation>'
+                    '<ObservedInList><ObservedIn><Sample>'
+                    '<Origin>germline</Origin>'
+                    '<Species TaxonomyId="9606">human</Species>'
+                    '<AffectedStatus>yes</AffectedStatus></Sample>'
+                    '<Method><MethodType>clinical testing</MethodType>'
+                    '</Method><ObservedData><Attribute Type="Description">'
+                    'not provided</Attribute></ObservedData>'
+                    '</ObservedIn></ObservedInList>'
+                    '<SimpleAllele><GeneList><Gene Symbol="G%d"/></GeneList>'
+                    '</SimpleAllele></ClinicalAssertion>\n'
+                    % (i * 10 + j, j, i % 500))
+            f.write('</ClinicalAssertionList>\n</InterpretedRecord>\n'
+                    '</VariationArchive>\n')
+        f.write('</ClinVarVariationRelease>\n')
+    return outfile
+
+
+def metanetx_compounds(propfile, xreffile, n, seed=1):
+    rnd = random.Random(seed)
+    libs = ['chebi', 'kegg.compound', 'hmdb', 'bigg.metabolite', 'seed']
+    with open(propfile, 'w') as f:
+        f.write('#MNX_ID\tDescription\tFormula\tCharge\tMass\tInChI\tSMILES'
+                '\tSource\tInChIKey\n')
+        for i in range(n):
+            f.write('MNXM%d\tcompound %d\tC%dH%dO%d\t%d\t%.5f\tInChI=1S/C%d'
+                    '\tC%s\tchebi:%d\t%014X-UHFFFAOYSA-N\n'
+                    % (i, i, i % 30, i % 60, i % 9, rnd.randint(-2, 2),
+                       rnd.uniform(10, 1000), i % 30, 'C' * (i % 20), i,
+                       rnd.getrandbits(56)))
+    with open(xreffile, 'w') as f:
+        f.write('#XREF\tMNX_ID\tEvidence\tDescription\n')
+        for i in range(n):
+            for lib in libs[:rnd.randint(1, len(libs))]:
+                f.write('%s:%d\tMNXM%d\tidentity\tcompound %d\n'
+                        % (lib, rnd.randint(1, 10**6), i, i))
+    return propfile, xreffile
+
+
+def metanetx_reactions(propfile, xreffile, n, ncompounds=10000, seed=1):
+    rnd = random.Random(seed)
+    libs = ['rhea', 'kegg.reaction', 'bigg.reaction', 'seed']
+
+    def side():
+        return ' + '.join('%d MNXM%d@MNXD1' % (rnd.randint(1, 3),
+                                               rnd.randint(0, ncompounds - 1))
+                          for _ in range(rnd.randint(1, 4)))
+    with open(propfile, 'w') as f:
+        f.write('#MNX_ID\tEquation\tDescription\tBalance\tEC\tSource\n')
+        for i in range(n):
+            f.write('MNXR%d\t%s = %s\treaction %d\ttrue\t1.1.1.%d\trhea:%d\n'
+                    % (i, side(), side(), i, i % 300, i))
+    with open(xreffile, 'w') as f:
+        f.write('#XREF\tMNX_ID\n')
+        for i in range(n):
+            for lib in libs[:rnd.randint(1, len(libs))]:
+                f.write('%s:R%d\tMNXR%d\n' % (lib, rnd.randint(1, 10**6), i))
+    return propfile, xreffile
+
+
+def modelseed_compounds(outfile, n, seed=1):
+    rnd = random.Random(seed)
+    cols = ['id', 'abbreviation', 'name', 'formula', 'mass', 'source',
+            'inchikey', 'structure', 'charge', 'is_core', 'is_obsolete',
+            'linked_compound', 'is_cofactor', 'deltag', 'deltagerr', 'pka',
+            'pkb', 'abstract_compound', 'comprised_of', 'aliases']
+    with open(outfile, 'w') as f:
+        f.write('\t'.join(cols) + '\n')
+        for i in range(n):
+            f.write('cpd%05d\tc%d\tcompound %d\tC%dH%d\t%.3f\tPrimary'
+                    '\t%014X\tnull\t%d\t1\t0\tnull\t0\t%.2f\t%.2f\tnull'
+                    '\tnull\tnull\tnull\tName: compound %d;KEGG: C%05d\n'
+                    % (i, i, i, i % 30, i % 60, rnd.uniform(10, 1000),
+                       rnd.getrandbits(56), rnd.randint(-2, 2),
+                       rnd.uniform(-100, 100), rnd.uniform(0, 10), i, i))
+    return outfile
+
+
+def modelseed_reactions(outfile, n, seed=1):
+    rnd = random.Random(seed)
+    cols = ['id', 'abbreviation', 'name', 'code', 'stoichiometry',
+            'is_transport', 'equation', 'definition', 'reversibility',
+            'direction', 'abstract_reaction', 'pathways', 'aliases',
+            'ec_numbers', 'deltag', 'deltagerr', 'compound_ids', 'status',
+            'is_obsolete', 'linked_reaction']
+    with open(outfile, 'w') as f:
+        f.write('\t'.join(cols) + '\n')
+        for i in range(n):
+            a, b = rnd.randint(0, 9999), rnd.randint(0, 9999)
+            f.write('rxn%05d\tR%d\treaction %d\t(1) cpd%05d[0] <=> (1)'
+                    ' cpd%05d[0]\t-1:cpd%05d:0:0:"c %d";1:cpd%05d:0:0:"c %d"'
+                    '\t0\t(1) cpd%05d[0] <=> (1) cpd%05d[0]\t(1) c%d[0] <=>'
+                    ' (1) c%d[0]\t=\t=\tnull\tnull\tKEGG: R%05d\t1.1.1.%d'
+                    '\t%.2f\t%.2f\tcpd%05d;cpd%05d\tOK\t0\tnull\n'
+                    % (i, i, i, a, b, a, a, b, b, a, b, a, b, i, i % 300,
+                       rnd.uniform(-100, 100), rnd.uniform(0, 10), a, b))
+    return outfile
+
+
+def pubtator_gene2pub(outfile, n, seed=1):
+    rnd = random.Random(seed)
+    with open(outfile, 'w') as f:
+        f.write('PMID\tNCBI_Gene\tMentions\tResource\n')
+        for i in range(n):
+            f.write('%d\t%d;%d\tgene %d|G%d\tgene2pubmed|GNormPlus\n'
+                    % (rnd.randint(1, 3 * 10**7), rnd.randint(1, 10**5),
+                       rnd.randint(1, 10**5), i, i))
+    return outfile
+
+
+# PSI-MI TAB rows, with confidence scores and extra columns as in HIPPIE
+def mitab(outfile, n, seed=1):
+    rnd = random.Random(seed)
+    with open(outfile, 'w') as f:
+        f.write('#ID(s) interactor A\tID(s) interactor B\t...\n')
+        for i in range(n):
+            a, b = rnd.randint(1, 10**5), rnd.randint(1, 10**5)
+            f.write('uniprotkb:P%05d\tuniprotkb:P%05d\tintact:EBI-%d'
+                    '\tintact:EBI-%d\tpsi-mi:p%d_human(display_long)'
+                    '\tpsi-mi:p%d_human(display_long)'
+                    '\tpsi-mi:"MI:0018"(two hybrid)\tAuthor et al. (2010)'
+                    '\tpubmed:%d\ttaxid:9606(human)\ttaxid:9606(human)'
+                    '\tpsi-mi:"MI:0915"(physical association)'
+                    '\tpsi-mi:"MI:0469"(IntAct)\tintact:EBI-%d'
+                    '\t%.2f\t-\n'
+                    % (a, b, a, b, a, b, rnd.randint(1, 3 * 10**7), i,
+                       rnd.random()))
+    return outfile
+
+
+def faers_zip(outfile, n, seed=1):
+    rnd = random.Random(seed)
+    reports = []
+    for i in range(n):
+        reports.append({
+            "safetyreportid": str(10**7 + i),
+            "receivedate": "2019%02d%02d" % (rnd.randint(1, 12),
+                                             rnd.randint(1, 28)),
+            "receivedateformat": "102",
+            "receiptdate": "201903%02d" % rnd.randint(1, 28),
+            "receiptdateformat": "102",
+            "serious": str(rnd.randint(1, 2)),
+            "patient": {
+                "patientonsetage": str(rnd.randint(1, 90)),
+                "reaction": [{"reactionmeddrapt": "Reaction %d" %
+                              rnd.randint(1, 500)}
+                             for _ in range(rnd.randint(1, 4))],
+                "drug": [{"medicinalproduct": "DRUG%d" % rnd.randint(1, 800),
+                          "drugindication": "Indication %d" %
+                                            rnd.randint(1, 300),
+                          "drugstartdate": "2018%02d" % rnd.randint(1, 12),
+                          "drugstartdateformat": "610",
+                          "openfda": {"generic_name": ["GENERIC"]}}
+                         for _ in range(rnd.randint(1, 5))]
+            }
+        })
+    with zipfile.ZipFile(outfile, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr(outfile.split('/')[-1][:-4],
+                   json.dumps({"meta": {}, "results": reports}))
+    return outfile
+
+
+def rnacentral_mappings(outfile, n, seed=1):
+    rnd = random.Random(seed)
+    dbs = ['ENA', 'RefSeq', 'GtRNAdb', 'Rfam', 'miRBase']
+    with open(outfile, 'w') as f:
+        for i in range(n):
+            for _ in range(rnd.randint(1, 12)):
+                f.write('URS%010X\t%s\tX%d.1:1..200:rRNA\t%d\trRNA\tg%d\n'
+                        % (i, rnd.choice(dbs), rnd.randint(1, 10**6),
+                           rnd.choice([9606, 10090, 77133]), i % 1000))
+    return outfile
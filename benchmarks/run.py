@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+""" Offline throughput benchmarks for the dataset readers
+
+ Synthetic data files are generated in a temporary folder, then each
+ reader is run in a fresh worker process, reporting records/s and peak
+ RSS of the process. No database server is needed.
+ Results are saved as json files, which can be compared with the results
+ of earlier versions with the --compare option.
+"""
+from __future__ import print_function
+
+import argparse
+import gzip
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+from functools import partial
+from multiprocessing import Pool
+
+import xmltodict
+
+from benchmarks import generators
+from geneinfo.rnacentral_idmappings import mappingreader
+from nosqlbiosets.fda.faers import read_faers_file
+from nosqlbiosets.metanetx.index import getcompoundrecord, \
+    getcompoundxrefrecord, getreactionrecord, getreactionxrefrecord, \
+    getxrefs, read_metanetx_mappings
+from nosqlbiosets.modelseed.index import read_modelseed_datafile, \
+    updatecompoundrecord, updatereactionrecord
+from nosqlbiosets.pubtator.index import parse_pub2gene_lines
+from nosqlbiosets.uniprot.index import Indexer as UniProtIndexer, \
+    FORCE_LIST as UNIPROT_FORCE_LIST
+from nosqlbiosets.uniprot.index_mitab import read_mitab_datafile, \
+    updatemitabrecord
+from nosqlbiosets.variation.clinvar import Indexer as ClinVarIndexer, \
+    FORCE_LIST as CLINVAR_FORCE_LIST
+from nosqlbiosets.xmlutils import lxml_parse
+
+REGRESSION_THRESHOLD = 0.1  # Slowdowns reported by --compare
+
+
+def _collect(items, _, item):
+    items.append(item)
+    return True
+
+
+def _count(records):
+    n = 0
+    for _ in records:
+        n += 1
+    return n
+
+
+# Each benchmark has a setup function, which generates its data files
+# in given folder, and a run function, which is called with the return
+# value of the setup function, and returns number of records read
+
+def setup_modelseed_compounds(d, n):
+    f = os.path.join(d, 'modelseed_compounds.tsv')
+    if not os.path.exists(f):
+        generators.modelseed_compounds(f, n)
+    return f, updatecompoundrecord
+
+
+def setup_modelseed_reactions(d, n):
+    f = os.path.join(d, 'modelseed_reactions.tsv')
+    if not os.path.exists(f):
+        generators.modelseed_reactions(f, n)
+    return f, updatereactionrecord
+
+
+def run_modelseed(args):
+    return _count(read_modelseed_datafile(*args))
+
+
+def setup_rnacentral(d, n):
+    f = os.path.join(d, 'rnacentral_mappings.tsv')
+    if not os.path.exists(f):
+        generators.rnacentral_mappings(f, n)
+    return f
+
+
+def run_rnacentral(infile):
+    return _count(mappingreader(infile))
+
+
+def setup_pubtator(d, n):
+    f = os.path.join(d, 'gene2pubtator')
+    if not os.path.exists(f):
+        generators.pubtator_gene2pub(f, n)
+    return f
+
+
+def run_pubtator(infile):
+    with open(infile) as f:
+        return _count(parse_pub2gene_lines(f, 0, 'gene2pub'))
+
+
+def setup_metanetx_compounds(d, n):
+    f = os.path.join(d, 'chem_prop.tsv'), os.path.join(d, 'chem_xref.tsv')
+    if not os.path.exists(f[0]):
+        generators.metanetx_compounds(f[0], f[1], n)
+    return f + (getcompoundrecord, getcompoundxrefrecord)
+
+
+def setup_metanetx_reactions(d, n):
+    f = os.path.join(d, 'reac_prop.tsv'), os.path.join(d, 'reac_xref.tsv')
+    if not os.path.exists(f[0]):
+        generators.metanetx_reactions(f[0], f[1], n, ncompounds=n)
+    return f + (getreactionrecord, getreactionxrefrecord)
+
+
+def run_metanetx(args):
+    propfile, xreffile, parser, xrefparser = args
+    xrefsmap = getxrefs(xreffile, xrefparser)
+    return _count(read_metanetx_mappings(propfile, parser, xrefsmap))
+
+
+def setup_mitab(d, n):
+    f = os.path.join(d, 'interactions.mitab')
+    if not os.path.exists(f):
+        generators.mitab(f, n)
+    return f
+
+
+def run_mitab(infile):
+    return _count(read_mitab_datafile(infile, updatemitabrecord))
+
+
+def setup_faers(d, n):
+    fd = os.path.join(d, '2019q1')
+    f = os.path.join(fd, 'drug-event-0001-of-0001.json.zip')
+    if not os.path.exists(f):
+        os.makedirs(fd)
+        generators.faers_zip(f, n)
+    return f
+
+
+def run_faers(infile):
+    return _count(read_faers_file('2019q1', infile))
+
+
+def setup_uniprot(d, n):
+    f = os.path.join(d, 'uniprot.xml.gz')
+    if not os.path.exists(f):
+        generators.uniprot_xml(f, n)
+    return f
+
+
+def run_uniprot_xmltodict(infile):
+    entries = []
+    with gzip.open(infile) as inf:
+        xmltodict.parse(inf, item_depth=2, attr_prefix='',
+                        force_list=UNIPROT_FORCE_LIST,
+                        item_callback=partial(_collect, entries))
+    return len(entries) - 1  # copyright notice
+
+
+def run_uniprot_lxml(infile):
+    entries = []
+    with gzip.open(infile) as inf:
+        lxml_parse(inf, 2, partial(_collect, entries), 'entry',
+                   attr_prefix='', force_list=UNIPROT_FORCE_LIST)
+    return len(entries)
+
+
+def setup_uniprot_tuner(d, n):
+    infile = setup_uniprot(d, n)
+    entries = []
+    with gzip.open(infile) as inf:
+        xmltodict.parse(inf, item_depth=2, attr_prefix='',
+                        force_list=UNIPROT_FORCE_LIST,
+                        item_callback=partial(_collect, entries))
+    return entries[:-1]
+
+
+def run_uniprot_tuner(entries):
+    for e in entries:
+        UniProtIndexer.update_entry(e)
+    return len(entries)
+
+
+def setup_clinvar(d, n):
+    f = os.path.join(d, 'clinvar.xml.gz')
+    if not os.path.exists(f):
+        generators.clinvar_xml(f, n)
+    return f
+
+
+def run_clinvar_xmltodict(infile):
+    entries = []
+    with gzip.open(infile) as inf:
+        xmltodict.parse(inf, item_depth=2, attr_prefix='', xml_attribs=True,
+                        force_list=CLINVAR_FORCE_LIST,
+                        item_callback=partial(_collect, entries))
+    return len(entries)
+
+
+def setup_clinvar_tuner(d, n):
+    entries = []
+    with gzip.open(setup_clinvar(d, n)) as inf:
+        xmltodict.parse(inf, item_depth=2, attr_prefix='', xml_attribs=True,
+                        force_list=CLINVAR_FORCE_LIST,
+                        item_callback=partial(_collect, entries))
+    return entries
+
+
+def run_clinvar_tuner(entries):
+    for e in entries:
+        ClinVarIndexer.update_entry(e)
+    return len(entries)
+
+
+BENCHMARKS = {
+    'modelseed.compounds': (setup_modelseed_compounds, run_modelseed),
+    'modelseed.reactions': (setup_modelseed_reactions, run_modelseed),
+    'rnacentral.mappingreader': (setup_rnacentral, run_rnacentral),
+    'pubtator.parse_pub2gene_lines': (setup_pubtator, run_pubtator),
+    'metanetx.compounds': (setup_metanetx_compounds, run_metanetx),
+    'metanetx.reactions': (setup_metanetx_reactions, run_metanetx),
+    'mitab.read_mitab_datafile': (setup_mitab, run_mitab),
+    'faers.read_reports': (setup_faers, run_faers),
+    'uniprot.xmltodict': (setup_uniprot, run_uniprot_xmltodict),
+    'uniprot.lxml_parse': (setup_uniprot, run_uniprot_lxml),
+    'uniprot.update_entry': (setup_uniprot_tuner, run_uniprot_tuner),
+    'clinvar.xmltodict': (setup_clinvar, run_clinvar_xmltodict),
+    'clinvar.update_entry': (setup_clinvar_tuner, run_clinvar_tuner),
+}
+
+
+def maxrss():
+    """ Peak RSS of the current process, in KB """
+    r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return r // 1024 if platform.system() == 'Darwin' else r
+
+
+# Run given benchmark, in a worker process
+def runbenchmark(name, datadir, size, repeat):
+    setup, run = BENCHMARKS[name]
+    best = None
+    for _ in range(repeat):
+        args = setup(datadir, size)
+        rss0 = maxrss()
+        t = time.time()
+        n = run(args)
+        t = time.time() - t
+        if best is None or t < best['seconds']:
+            best = {'records': n, 'seconds': round(t, 4),
+                    'records/s': round(n / t, 1) if t > 0 else None}
+        best['peak_rss_kb'] = maxrss()
+        best['rss_increase_kb'] = maxrss() - rss0
+    return best
+
+
+def gitversion():
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(size, names=None, datadir=None, repeat=1, outfile=None):
+    names = sorted(BENCHMARKS) if not names else names
+    tmpd = None
+    if datadir is None:
+        datadir = tmpd = tempfile.mkdtemp(prefix='nosqlbiosets-benchmarks')
+    results = {}
+    try:
+        for name in names:
+            pool = Pool(1)  # fresh process for each benchmark, for peak RSS
+            try:
+                r = pool.apply(runbenchmark, (name, datadir, size, repeat))
+            finally:
+                pool.terminate()
+            results[name] = r
+            print("%-32s %8d records %9.3fs %10.1f records/s %8d KB peak RSS"
+                  % (name, r['records'], r['seconds'], r['records/s'] or 0,
+                     r['peak_rss_kb']))
+    finally:
+        if tmpd is not None:
+            shutil.rmtree(tmpd)
+    report = {
+        'version': gitversion(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'size': size,
+        'results': results
+    }
+    if outfile is not None:
+        with open(outfile, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print("Results saved to %s" % outfile)
+    return report
+
+
+# Compare records/s of two benchmark results
+def compare(old, new, threshold=REGRESSION_THRESHOLD):
+    print("\nComparison with %s (%s)" % (old.get('version'), old.get('date')))
+    nregressions = 0
+    for name in sorted(new['results']):
+        if name not in old['results']:
+            continue
+        a = old['results'][name]['records/s']
+        b = new['results'][name]['records/s']
+        if not a or not b:
+            continue
+        ratio = b / a
+        flag = ''
+        if ratio < 1 - threshold:
+            flag = 'REGRESSION'
+            nregressions += 1
+        print("%-32s %10.1f -> %10.1f records/s  x%.2f %s"
+              % (name, a, b, ratio, flag))
+    return nregressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Offline throughput benchmarks of the dataset readers,'
+                    ' with synthetic data files')
+    parser.add_argument('--size', type=int, default=10000,
+                        help='Number of records generated for each reader')
+    parser.add_argument('--benchmarks', nargs='*',
+                        choices=sorted(BENCHMARKS),
+                        help='Benchmarks to run, by default all')
+    parser.add_argument('--datadir',
+                        help='Folder for the generated data files,'
+                             ' files already in the folder are reused;'
+                             ' by default a temporary folder is used')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Number of runs for each benchmark,'
+                             ' best time is reported')
+    parser.add_argument('--outfile',
+                        help='Save results to given json file')
+    parser.add_argument('--compare',
+                        help='Compare results with earlier results file')
+    args = parser.parse_args()
+    report = main(args.size, args.benchmarks, args.datadir, args.repeat,
+                  args.outfile)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
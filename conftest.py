@@ -0,0 +1,6 @@
+""" pytest configuration, repository folder is added to sys.path so that
+ tests can import the benchmarks package which is not installed """
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
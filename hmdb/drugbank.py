@@ -6,6 +6,7 @@ from __future__ import print_function
 
 import argparse
 import os
+from functools import partial
 from pprint import pprint
 from zipfile import ZipFile
 
@@ -16,6 +17,9 @@ from pymongo import IndexModel
 
 from nosqlbiosets.dbutils import DBconnection
 from nosqlbiosets.objutils import *
+from nosqlbiosets.xmlutils import ListChildren, lxml_parse, \
+    parse_xmlrecords
+from nosqlbiosets.xrefs import XrefWriter
 
 SOURCE_URL = "https://www.drugbank.ca/releases/latest"
 DOCTYPE = 'drugbank'  # MongoDB default collection name
@@ -25,6 +29,9 @@ LIST_ATTRS = ["transporters", "drug-interactions", "food-interactions",
               "carriers", "groups", "salts", "products",
               'pathways', 'go-classifiers', 'external-links',
               'external-identifiers']
+# Objects of the list attributes, always read as lists by the xml parsers
+FORCE_LIST = ListChildren([(a, a[:-1]) for a in LIST_ATTRS] +
+                          [('categories', 'category'), ('drugs', 'drug')])
 
 
 # Update DrugBank entry for better database representation
@@ -70,25 +77,41 @@ def update_entry_forindexing(e, slim=True):
 
 
 # Read DrugBank xml files, index using the function indexf
-def parse_drugbank_xmlfile(infile, indexf):
+# If processes is set entries are parsed, and updated with the tuner function,
+# in worker processes. If uselxml is set entries are parsed with lxml
+def parse_drugbank_xmlfile(infile, indexf, processes=None, tuner=None,
+                           uselxml=False):
     infile = str(infile)
     print("Reading/indexing %s " % infile)
     if infile.endswith(".zip"):
         with ZipFile(infile) as zipf:
             for fname in zipf.namelist():
                 with zipf.open(fname) as inf:
-                    xmltodict.parse(inf, item_depth=2, attr_prefix='',
-                                    item_callback=indexf)
+                    parse_drugbank_xml(inf, indexf, processes, tuner, uselxml)
     else:
         with open(infile, 'rb', buffering=1000) as inf:
-            xmltodict.parse(inf, item_depth=2, attr_prefix='',
-                            item_callback=indexf)
+            parse_drugbank_xml(inf, indexf, processes, tuner, uselxml)
     print("\nCompleted")
 
 
+def parse_drugbank_xml(inf, indexf, processes=None, tuner=None,
+                       uselxml=False):
+    if processes is None and uselxml:
+        lxml_parse(inf, 2, indexf, 'drug', attr_prefix='',
+                   force_list=FORCE_LIST)
+    elif processes is None:
+        xmltodict.parse(inf, item_depth=2, attr_prefix='',
+                        item_callback=indexf, force_list=FORCE_LIST)
+    else:
+        parse_xmlrecords(inf, indexf, 'drug', processes, tuner=tuner,
+                         uselxml=uselxml, attr_prefix='',
+                         force_list=FORCE_LIST)
+
+
 class Indexer(DBconnection):
 
-    def __init__(self, db, index, host, port, doctype, slim=True):
+    def __init__(self, db, index, host, port, doctype, slim=True,
+                 xrefs=False):
         self.doctype = doctype
         self.index = index
         self.slim = slim
@@ -96,14 +119,22 @@ class Indexer(DBconnection):
                                       mdbcollection=doctype, recreateindex=True)
         if db == "MongoDB":
             self.mcl = self.mdbi[doctype]
+        if db in ("MongoDB", "Elasticsearch", "File"):
+            self.writer = self.bulkwriter(collection=doctype, doctype='_doc',
+                                          upsert=False)
+        # external identifiers are saved in the xref lookup table
+        self.xrefwriter = XrefWriter(
+            self, index if db == "Elasticsearch" else doctype) \
+            if xrefs else None
 
     # Index DrugBank entry with MongoDB
-    def mongodb_index_entry(self, _, entry):
+    def mongodb_index_entry(self, _, entry, tuned=False):
         try:
-            update_entry_forindexing(entry, slim=self.slim)
+            if not tuned:
+                update_entry_forindexing(entry, slim=self.slim)
             docid = self.getdrugid(entry)
-            entry["_id"] = docid
-            self.mcl.insert_one(entry)
+            self.writer.add(entry, docid=docid)
+            self.addxrefs(entry, docid)
             self.reportprogress()
             r = True
         except Exception as e:
@@ -112,13 +143,14 @@ class Indexer(DBconnection):
         return r
 
     # Index DrugBank entry with Elasticsearch
-    def es_index_entry(self, _, entry):
+    def es_index_entry(self, _, entry, tuned=False):
         try:
-            update_entry_forindexing(entry)
+            if not tuned:
+                update_entry_forindexing(entry)
             docid = self.getdrugid(entry)
             entry['drugbank-id'] = docid
-            self.es.index(index=self.index, doc_type='_doc',
-                          id=docid, body=entry)
+            self.writer.add(entry, docid=docid)
+            self.addxrefs(entry, docid)
             self.reportprogress()
             r = True
         except Exception as e:
@@ -126,6 +158,12 @@ class Indexer(DBconnection):
             r = False
         return r
 
+    def addxrefs(self, e, docid):
+        if self.xrefwriter is not None:
+            for xref in e.get('external-identifiers', []):
+                self.xrefwriter.add(xref['resource'], xref['identifier'],
+                                    docid)
+
     def getdrugid(self, e):
         if isinstance(e['drugbank-id'], list):
             eid = e['drugbank-id'][0]['#text']
@@ -188,16 +226,34 @@ def mongodb_indices(mdb):
         mdb.create_index(field)
 
 
-def main(infile, db, index, doctype=DOCTYPE, host=None, port=None, slim=True):
-    indxr = Indexer(db, index, host, port, doctype, slim)
-    if db == 'MongoDB':
-        parse_drugbank_xmlfile(infile, indxr.mongodb_index_entry)
-        mongodb_indices(indxr.mdbi[doctype])
-    elif db == 'Elasticsearch':
-        parse_drugbank_xmlfile(infile, indxr.es_index_entry)
-        indxr.es.indices.refresh(index=index)
+def main(infile, db, index, doctype=DOCTYPE, host=None, port=None, slim=True,
+         processes=None, uselxml=False, xrefs=False):
+    indxr = Indexer(db, index, host, port, doctype, slim,
+                    xrefs and db in ('MongoDB', 'Elasticsearch'))
+    tuned = processes is not None
+    if db in ('MongoDB', 'File') and not indxr.esformat():
+        parse_drugbank_xmlfile(infile,
+                               partial(indxr.mongodb_index_entry, tuned=tuned),
+                               processes,
+                               partial(update_entry_forindexing, slim=slim),
+                               uselxml)
+        indxr.writer.close()
+        if db == 'MongoDB':
+            mongodb_indices(indxr.mdbi[doctype])
+        if indxr.xrefwriter is not None:
+            indxr.xrefwriter.close()
+    elif db in ('Elasticsearch', 'File'):
+        parse_drugbank_xmlfile(infile,
+                               partial(indxr.es_index_entry, tuned=tuned),
+                               processes, update_entry_forindexing, uselxml)
+        indxr.writer.close()
+        if db == 'Elasticsearch':
+            indxr.es.indices.refresh(index=index)
+        if indxr.xrefwriter is not None:
+            indxr.xrefwriter.close()
     else:
-        parse_drugbank_xmlfile(infile, indxr.saveinteractions)
+        parse_drugbank_xmlfile(infile, indxr.saveinteractions, processes,
+                               uselxml=uselxml)
         indxr.saveasgraph()
 
 
@@ -223,6 +279,7 @@ if __name__ == '__main__':
                         help="MongoDB or Elasticsearch server port number")
     parser.add_argument('--db', default='Elasticsearch',
                         help="Database: 'MongoDB' or 'Elasticsearch',"
+                             " or 'File' for writing to NDJSON files,"
                              " if not set drug-drug interaction"
                              " network is saved to a graph file specified with"
                              " the '--graphfile' option")
@@ -234,6 +291,17 @@ if __name__ == '__main__':
                         help="By default sequence fields"
                              " and the patents field is not indexed."
                              " Select this option to index all fields")
+    parser.add_argument('--processes', type=int,
+                        help='Number of processes for parsing DrugBank'
+                             ' entries, by default entries are parsed'
+                             ' in the main process')
+    parser.add_argument('--lxml', action='store_true',
+                        help='Parse DrugBank entries with lxml,'
+                             ' faster than the default xmltodict parser')
+    parser.add_argument('--xrefs', action='store_true',
+                        help='Save external identifiers of the drugs in'
+                             ' the xref lookup table')
     args = parser.parse_args()
     main(args.infile, args.db, args.index, args.mdbcollection,
-         args.host, args.port, not args.allfields)
+         args.host, args.port, not args.allfields, args.processes, args.lxml,
+         args.xrefs)
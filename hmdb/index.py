@@ -6,6 +6,7 @@ from __future__ import print_function
 
 import argparse
 import os
+from functools import partial
 from gzip import GzipFile
 from zipfile import ZipFile
 
@@ -14,30 +15,49 @@ from pymongo import IndexModel
 
 from nosqlbiosets.dbutils import DBconnection
 from nosqlbiosets.objutils import unifylistattributes
+from nosqlbiosets.xmlutils import ListChildren, lxml_parse, \
+    parse_xmlrecords
 
 DOCTYPE_METABOLITE = 'hmdbmetabolite'
 DOCTYPE_PROTEIN = 'hmdbprotein'
+# Objects of the list attributes, always read as lists by the xml parsers
+FORCE_LIST = ListChildren([(a, a[:-1]) for a in [
+    'synonyms', 'pathways', 'alternative_parents', 'substituents',
+    'external_descriptors']])
 
 
 # Read HMDB Metabolites/Proteins files, index using the function indexf
-def parse_hmdb_xmlfile(infile, indexf):
+# If processes is set entries are parsed, and updated with the tuner function,
+# in worker processes. If uselxml is set entries are parsed with lxml
+def parse_hmdb_xmlfile(infile, indexf, processes=None, tuner=None,
+                       uselxml=False):
     infile = str(infile)
     print("Reading/indexing %s " % infile)
     if infile.endswith(".gz"):
         with GzipFile(infile) as inf:
-            xmltodict.parse(inf, item_depth=2, item_callback=indexf)
+            parse_hmdb_xml(inf, indexf, processes, tuner, uselxml)
     elif infile.endswith(".zip"):
         with ZipFile(infile) as zipf:
             for fname in zipf.namelist():
                 with zipf.open(fname) as inf:
-                    xmltodict.parse(inf, item_depth=2,
-                                    item_callback=indexf)
+                    parse_hmdb_xml(inf, indexf, processes, tuner, uselxml)
     else:
         with open(infile, 'rb', buffering=1000) as inf:
-            xmltodict.parse(inf, item_depth=2, item_callback=indexf)
+            parse_hmdb_xml(inf, indexf, processes, tuner, uselxml)
     print("\nCompleted")
 
 
+def parse_hmdb_xml(inf, indexf, processes=None, tuner=None, uselxml=False):
+    if processes is None and uselxml:
+        lxml_parse(inf, 2, indexf, force_list=FORCE_LIST)
+    elif processes is None:
+        xmltodict.parse(inf, item_depth=2, item_callback=indexf,
+                        force_list=FORCE_LIST)
+    else:
+        parse_xmlrecords(inf, indexf, processes=processes, tuner=tuner,
+                         uselxml=uselxml, force_list=FORCE_LIST)
+
+
 class Indexer(DBconnection):
 
     def __init__(self, db, index, host, port, doctype):
@@ -47,9 +67,13 @@ class Indexer(DBconnection):
         if db == "MongoDB":
             self.mcl = self.mdbi[doctype]
             self.mcl.drop()
+        elif db == "File":
+            self.removefiles(doctype)
+        self.writer = self.bulkwriter(collection=doctype, doctype=doctype)
 
     # Tune entries for better data representation
-    def tune(self, entry):
+    @staticmethod
+    def tune(entry):
         list_attrs = ["synonyms", "pathways"]
         unifylistattributes(entry, list_attrs)
         if "taxonomy" in entry:
@@ -58,17 +82,17 @@ class Indexer(DBconnection):
             unifylistattributes(entry["taxonomy"], list_attrs)
 
     # Index HMDB Metabolites/Proteins entry with Elasticsearch
-    def es_index_hmdb_entry(self, _, entry):
+    def es_index_hmdb_entry(self, _, entry, tuned=False):
         docid = entry['accession']
-        self.tune(entry)
+        if not tuned:
+            self.tune(entry)
         if "taxonomy" in entry and entry['taxonomy'] is not None and\
                 'molecular_framework' in entry['taxonomy']:
             del entry['taxonomy']['molecular_framework']
         if "cs_description" in entry:
             del entry['cs_description']
         try:
-            self.es.index(index=self.index, doc_type=self.doctype,
-                          id=docid, body=entry)
+            self.writer.add(entry, docid=docid)
             self.reportprogress()
             r = True
         except Exception as e:
@@ -77,13 +101,12 @@ class Indexer(DBconnection):
         return r
 
     # Index HMDB Metabolites/Proteins entry with MongoDB
-    def mongodb_index_hmdb_entry(self, _, entry):
+    def mongodb_index_hmdb_entry(self, _, entry, tuned=False):
         docid = entry['accession']
-        self.tune(entry)
-        spec = {"_id": docid}
+        if not tuned:
+            self.tune(entry)
         try:
-            self.mcl.update(spec, entry, upsert=True)
-            # TODO: replace update with insert
+            self.writer.add(entry, docid=docid)
             self.reportprogress()
             r = True
         except Exception as e:
@@ -111,18 +134,26 @@ def mongodb_indices(mdb, doctype):
     return
 
 
-def main(infile, index, doctype, db, host=None, port=None):
+def main(infile, index, doctype, db, host=None, port=None, processes=None,
+         uselxml=False):
     if doctype is None:
         if 'protein' in infile:
             doctype = DOCTYPE_PROTEIN
         else:
             doctype = DOCTYPE_METABOLITE
     indxr = Indexer(db, index, host, port, doctype)
+    if indxr.esformat():
+        indexf = indxr.es_index_hmdb_entry
+    else:
+        indexf = indxr.mongodb_index_hmdb_entry
+    if processes is not None:
+        indexf = partial(indexf, tuned=True)
+    parse_hmdb_xmlfile(infile, indexf, processes, tuner=Indexer.tune,
+                       uselxml=uselxml)
+    indxr.writer.close()
     if db == 'Elasticsearch':
-        parse_hmdb_xmlfile(infile, indxr.es_index_hmdb_entry)
         indxr.es.indices.refresh(index=index)
-    else:
-        parse_hmdb_xmlfile(infile, indxr.mongodb_index_hmdb_entry)
+    elif db == 'MongoDB':
         mongodb_indices(indxr.mcl, doctype)
 
 
@@ -144,6 +175,15 @@ if __name__ == '__main__':
     parser.add_argument('--port',
                         help="Elasticsearch or MongoDB server port number")
     parser.add_argument('--db', default='Elasticsearch',
-                        help="Database: 'Elasticsearch' or 'MongoDB'")
+                        help="Database: 'Elasticsearch' or 'MongoDB',"
+                             " or 'File' for writing to NDJSON files")
+    parser.add_argument('--processes', type=int,
+                        help='Number of processes for parsing HMDB entries,'
+                             ' by default entries are parsed in the main'
+                             ' process')
+    parser.add_argument('--lxml', action='store_true',
+                        help='Parse HMDB entries with lxml,'
+                             ' faster than the default xmltodict parser')
     args = parser.parse_args()
-    main(args.infile, args.index, args.doctype, args.db, args.host, args.port)
+    main(args.infile, args.index, args.doctype, args.db, args.host, args.port,
+         args.processes, args.lxml)
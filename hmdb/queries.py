@@ -71,11 +71,11 @@ class QueryDrugBank(Query):
         :return: Drugbank target id
         """
 
+        # MongoDB client of the connection is shared with this object
         qryuniprot = QueryUniProt("MongoDB", mdbdb, uniprotcollection)
         qc = {"dbReference.id": keggtid}
         key = 'name'
-        uniprotid = qryuniprot.dbc.mdbi[uniprotcollection].distinct(key,
-                                                                    filter=qc)
+        uniprotid = qryuniprot.distinct(key, qc)
         assert len(uniprotid) == 1
         qc = {
             etype+".polypeptide.external-identifiers.identifier": uniprotid[0]}
@@ -97,6 +97,10 @@ class QueryDrugBank(Query):
         :param keggdid: KEGG drug id
         :return: Drugbank drug id
         """
+        r = self.resolve_xrefs([keggdid], "KEGG Drug")
+        if r is not None:  # xref rows were saved
+            assert 1 == len(r.get(keggdid, []))
+            return r[keggdid][0]
         project = {"external-identifiers": 1}
         qc = {"external-identifiers.identifier": keggdid}
         r = list(self.query(qc, projection=project))
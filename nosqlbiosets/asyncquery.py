@@ -0,0 +1,133 @@
+""" Asynchronous (asyncio) connections and queries
+
+ AsyncQuery has the query(), count(), distinct(), aggregate_query() and
+ esquery() methods of the Query class as coroutines, so that queries
+ with different datasets can run concurrently, with asyncio.gather().
+ Elasticsearch queries are made with AsyncElasticsearch, which requires
+ aiohttp package, MongoDB queries are made with Motor; queries with
+ SQLite database files are run in worker threads. Motor clients and
+ SQLite databases are shared, see dbutils.getclient().
+ Methods of the synchronous query classes, such as QueryMetaNetX,
+ can be run concurrently with the coroutines with tothread().
+ runall() runs coroutines concurrently from synchronous code.
+"""
+import asyncio
+import json
+import logging
+import os
+from functools import partial
+
+from nosqlbiosets.dbutils import dbconfig, getclient
+
+logger = logging.getLogger(__name__)
+
+
+async def tothread(func, *args, **kwargs):
+    """ Run func(*args, **kwargs) in a worker thread of the event loop """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, partial(func, *args, **kwargs))
+
+
+def runall(*coroutines):
+    """ Run the coroutines concurrently in a new event loop,
+        return their results in a list """
+    async def gather():
+        return await asyncio.gather(*coroutines)
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(gather())
+    finally:
+        loop.close()
+
+
+class AsyncDBconnection(object):
+    """ Asynchronous connection to Elasticsearch, MongoDB or SQLite """
+
+    def __init__(self, db, index, host=None, port=None, mdbcollection=None):
+        assert index is not None
+        self.index = index
+        self.db = db
+        self.mdbcollection = mdbcollection
+        conf = dbconfig()
+        if db == 'Elasticsearch':
+            from elasticsearch import AsyncElasticsearch
+            if host is None:
+                host = conf['es_host']
+            if port is None:
+                port = conf['es_port'] if 'es_port' in conf else 9200
+            self.es = AsyncElasticsearch(hosts=[{"host": host, "port": port}],
+                                         timeout=220)
+            logger.info("New async Elasticsearch connection to host '%s'"
+                        % host)
+        elif db == "MongoDB":
+            if host is None:
+                host = conf['mongodb_host']
+            if port is None and 'mongodb_port' in conf:
+                port = conf['mongodb_port']
+            mc = getclient('AsyncMongoDB', host, port, conf=conf)
+            logger.info("Async MongoDB connection: '%s:%s'" % (host, port))
+            self.mdbi = mc[index]
+        elif db == "SQLite":
+            dbfile = os.path.abspath(os.path.join(
+                conf.get('sqlite_folder', '.'), index + '.sqlite'))
+            self.mdbi = getclient(db, dbfile, None, conf=conf)
+        else:
+            raise ValueError("Async queries are not supported with %s" % db)
+
+    # MongoDB and SQLite clients are shared with the other connections
+    # of the process, they are closed with dbutils.closeclients()
+    async def close(self):
+        if self.db == 'Elasticsearch':
+            await self.es.close()
+
+
+class AsyncQuery(object):
+    """ Query class with the methods of the Query class as coroutines """
+
+    def __init__(self, dbtype, index, mdbcollection, **kwargs):
+        self.index = index
+        self.mdbcollection = mdbcollection
+        self.dbc = AsyncDBconnection(dbtype, self.index, **kwargs)
+
+    async def query(self, qc, projection=None, limit=0):
+        if self.dbc.db == 'Elasticsearch':
+            return await self.dbc.es.search(index=self.index, body=qc,
+                                            size=limit)
+        c = self.dbc.mdbi[self.mdbcollection]
+        if self.dbc.db == 'MongoDB':
+            return await c.find(qc, projection=projection,
+                                limit=limit).to_list(None)
+        return await tothread(lambda: list(c.find(qc, projection,
+                                                 limit=limit)))
+
+    async def count(self, qc, **kwargs):
+        if self.dbc.db == 'Elasticsearch':
+            r = await self.dbc.es.count(index=self.index, body=qc)
+            return r['count']
+        c = self.dbc.mdbi[self.mdbcollection]
+        if self.dbc.db == 'MongoDB':
+            return await c.count_documents(qc, **kwargs)
+        return await tothread(c.count, qc)
+
+    async def distinct(self, key, qc=None):
+        c = self.dbc.mdbi[self.mdbcollection]
+        if self.dbc.db == 'MongoDB':
+            return await c.distinct(key, filter=qc)
+        return await tothread(c.distinct, key, qc)
+
+    async def aggregate_query(self, agpl, **kwargs):
+        c = self.dbc.mdbi[self.mdbcollection]
+        if self.dbc.db == 'MongoDB':
+            return await c.aggregate(agpl, **kwargs).to_list(None)
+        return await tothread(lambda: list(c.aggregate(agpl, **kwargs)))
+
+    async def esquery(self, index, qc, size=10):
+        print("Querying '%s': %s" % (index, json.dumps(qc, indent=4)))
+        assert self.dbc.db == 'Elasticsearch'
+        r = await self.dbc.es.search(index=index, body=qc, size=size)
+        nhits = r['hits']['total']
+        aggs = r["aggregations"] if "aggregations" in r else None
+        return r['hits']['hits'], nhits, aggs
+
+    async def close(self):
+        await self.dbc.close()
@@ -0,0 +1,97 @@
+""" Checkpoint journal for resuming interrupted indexing jobs
+
+ Progress of indexing jobs is saved in a local SQLite database:
+ for each input file, number of records committed to the database
+ and whether the file has been processed completely.
+ Indexers started with the --resume option skip the files
+ already completed, and the records already committed
+ in partially processed files. Offsets are committed only if no
+ documents failed to be written since the last commit.
+"""
+import os
+import sqlite3
+import time
+
+CHECKPOINT_DB = 'nosqlbiosets-checkpoints.sqlite'
+CHECKPOINT_INTERVAL = 10000  # Number of records between checkpoints
+
+
+class CheckpointError(Exception):
+    """ Raised when the offset can't be committed, after failed writes """
+
+
+class Checkpoint(object):
+    """ Progress journal of an indexing job
+
+    Jobs are identified by their names, such as 'uniprot:MongoDB:biosets',
+    files are identified by their absolute paths, archive members can be
+    journaled with names such as 'archive.tar.gz/member.xml'.
+    If resume is False earlier progress records of the job are deleted.
+    """
+
+    def __init__(self, job, dbfile=CHECKPOINT_DB, resume=False):
+        self.job = job
+        self.dbfile = dbfile
+        self.conn = sqlite3.connect(dbfile)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS progress ("
+                          " job TEXT, file TEXT, offset INTEGER,"
+                          " completed INTEGER, updated REAL,"
+                          " PRIMARY KEY (job, file))")
+        self.nfailed = 0  # failures of the job, at the last commit
+        if not resume:
+            self.clear()
+
+    @staticmethod
+    def key(fname):
+        return os.path.abspath(str(fname))
+
+    def _get(self, fname):
+        return self.conn.execute(
+            "SELECT offset, completed FROM progress"
+            " WHERE job = ? AND file = ?",
+            (self.job, self.key(fname))).fetchone()
+
+    def offset(self, fname):
+        """ Number of records of the file committed to the database """
+        r = self._get(fname)
+        return 0 if r is None else r[0]
+
+    def completed(self, fname):
+        r = self._get(fname)
+        return r is not None and r[1] == 1
+
+    def save(self, fname, offset, completed=False):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO progress VALUES (?, ?, ?, ?, ?)",
+                (self.job, self.key(fname), offset, int(completed),
+                 time.time()))
+
+    def commit(self, fname, offset, nfailed, completed=False):
+        """ Save the offset if there were no new failures since the last
+            commit, nfailed is the number of failed documents (or index calls)
+            of the job so far; otherwise raise CheckpointError, the records
+            after the last committed offset are read again when resumed """
+        if nfailed > self.nfailed:
+            raise CheckpointError(
+                "%d documents failed to be indexed, progress of '%s' is not"
+                " saved after the offset %d" % (nfailed - self.nfailed, fname,
+                                                self.offset(fname)))
+        self.save(fname, offset, completed)
+
+    def clear(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM progress WHERE job = ?",
+                              (self.job,))
+
+    def close(self):
+        self.conn.close()
+
+
+def checkpointargs(argp):
+    """ Given ArgumentParser object, argp, add checkpoint arguments """
+    argp.add_argument('--resume', default=False, action='store_true',
+                      help='Resume an interrupted indexing job, skip the'
+                           ' files and records indexed in the earlier run')
+    argp.add_argument('--checkpointdb', default=CHECKPOINT_DB,
+                      help='SQLite file the indexing progress is saved')
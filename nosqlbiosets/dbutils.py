@@ -1,19 +1,145 @@
 from __future__ import print_function
 
+import datetime
+import glob
+import gzip
 import json
 import logging
 import os
 import sys
+import threading
+import time
+from functools import partial
+from multiprocessing.pool import ThreadPool
 
 from elasticsearch import Elasticsearch
-from elasticsearch.exceptions import ElasticsearchException
-from pymongo import MongoClient
+from elasticsearch.exceptions import ElasticsearchException, \
+    NotFoundError
+from elasticsearch.helpers import bulk
+from pymongo import MongoClient, InsertOne, ReplaceOne
+from pymongo.errors import BulkWriteError
+
+from nosqlbiosets.metrics import Metrics
+from nosqlbiosets.sqlitedb import SQLiteDatabase
 
 logger = logging.getLogger(__name__)
 ch = logging.StreamHandler()
 ch.setLevel(logging.INFO)
 logger.addHandler(ch)
 
+BULK_CHUNK_SIZE = 500  # Default number of documents per bulk request
+BULK_MAX_BYTES = 16 * 1024 * 1024  # Default (approximate) bytes per request
+# Json size of every BULK_SIZE_SAMPLE'th document is measured for
+# estimating the bytes per request
+BULK_SIZE_SAMPLE = 64
+FILE_SHARD_SIZE = 1000000  # Default number of documents per NDJSON file
+# Name of the index or collection that dataset version stamps are saved,
+# read by the query caches to detect datasets reindexed
+DATASET_VERSIONS = 'datasetversions'
+HEALTH_CHECK_INTERVAL = 60  # Seconds between the checks of shared clients
+ES_MAXSIZE = 80  # Default number of connections per Elasticsearch node
+MONGODB_MAXPOOLSIZE = 100  # Default number of connections to MongoDB
+
+_configs = {}  # config file -> (modification time, settings)
+# (pid, db, host, port, user, password, database) -> [client, last check]
+_clients = {}
+_clientslock = threading.Lock()
+
+
+def dbconfig():
+    """ Read database servers configuration file, dbservers.json,
+        settings are read again only if the file is modified """
+    # TODO: option to specify config file
+    cfgfile = "./dbservers.json"
+    if not os.path.exists(cfgfile):
+        if os.path.exists("./conf/dbservers.json"):
+            cfgfile = "./conf/dbservers.json"
+        elif os.path.exists("../conf/dbservers.json"):
+            cfgfile = "../conf/dbservers.json"
+        else:
+            cfgfile = "../../conf/dbservers.json"
+    try:
+        cfgfile = os.path.abspath(cfgfile)
+        mtime = os.path.getmtime(cfgfile)
+        if cfgfile not in _configs or _configs[cfgfile][0] != mtime:
+            logger.info("Servers configuration file: %s" % cfgfile)
+            with open(cfgfile, "r") as cfgf:
+                _configs[cfgfile] = mtime, json.load(cfgf)
+        conf = dict(_configs[cfgfile][1])
+    except (IOError, OSError):
+        conf = {"es_host": "localhost", "es_port": 9200,
+                "mongodb_host": "localhost", "mongodb_port": 27017}
+    return conf
+
+
+def _newclient(db, host, port, user, password, database, conf):
+    if db == 'SQLite':  # host is the path of the database file
+        return SQLiteDatabase(host)
+    if db == 'Elasticsearch':
+        return Elasticsearch(host=host, port=port, timeout=220,
+                             maxsize=conf.get('es_maxsize', ES_MAXSIZE))
+    if db == 'MongoDB':
+        # connections are made when the first query is sent
+        return MongoClient(host, port, connect=False, maxPoolSize=conf.get(
+            'mongodb_maxpoolsize', MONGODB_MAXPOOLSIZE))
+    if db == 'AsyncMongoDB':  # Motor client of the asyncio connections
+        from motor.motor_asyncio import AsyncIOMotorClient
+        return AsyncIOMotorClient(host, port, maxPoolSize=conf.get(
+            'mongodb_maxpoolsize', MONGODB_MAXPOOLSIZE))
+    if db == 'Neo4j':
+        from neo4j import GraphDatabase, basic_auth
+        return GraphDatabase.driver("bolt://{}:{}".format(host, port),
+                                    auth=basic_auth(user, password))
+    # Assume PostgreSQL
+    from sqlalchemy import create_engine
+    url = 'postgresql://{}:{}@{}:{}/{}'.format(user, password, host, port,
+                                               database)
+    return create_engine(url, client_encoding='utf8', echo=False)
+
+
+def getclient(db, host, port, user=None, password=None, database=None,
+              conf=None):
+    """ Return client of the database server shared by the DBconnection
+        objects of the process, a new client is created for the first call
+
+    Elasticsearch clients are checked with ping requests when they are
+    created and in HEALTH_CHECK_INTERVAL seconds, None is returned
+    if the server is unreachable. Pool sizes are read from the
+    configuration file, `es_maxsize` and `mongodb_maxpoolsize` settings.
+    With SQLite, host is the path of the database file, SQLiteDatabase
+    objects of the files are shared. Motor clients of the asyncio
+    connections are shared with db 'AsyncMongoDB'
+    """
+    conf = dbconfig() if conf is None else conf
+    key = (os.getpid(), db, host, port, user, password, database)
+    with _clientslock:
+        entry = _clients.get(key)
+        if entry is None:
+            entry = [_newclient(db, host, port, user, password, database,
+                                conf), 0]
+            _clients[key] = entry
+    t = time.time()
+    if db == 'Elasticsearch' and t - entry[1] > HEALTH_CHECK_INTERVAL:
+        if not entry[0].ping():
+            with _clientslock:
+                _clients.pop(key, None)
+            return None
+        entry[1] = t
+    return entry[0]
+
+
+def closeclients():
+    """ Close the shared clients of the process """
+    with _clientslock:
+        for key, (client, _) in list(_clients.items()):
+            if key[1] == 'Elasticsearch':
+                client.transport.close()
+            elif key[1] in ('MongoDB', 'AsyncMongoDB', 'Neo4j', 'SQLite'):
+                client.close()
+            else:
+                client.dispose()
+        _clients.clear()
+
 
 class DBconnection(object):
     i = 0  # counter for the number of objects indexed
@@ -24,40 +150,24 @@ class DBconnection(object):
         assert index is not None
         self.index = index
         self.db = db
+        self.metrics = Metrics("%s:%s" % (db, index))
         if port is not None and not isinstance(port, int):
             port = int(port)
-        try:
-            # TODO: option to specify config file
-            cfgfile = "./dbservers.json"
-            if not os.path.exists(cfgfile):
-                if os.path.exists("./conf/dbservers.json"):
-                    cfgfile = "./conf/dbservers.json"
-                elif os.path.exists("../conf/dbservers.json"):
-                    cfgfile = "../conf/dbservers.json"
-                else:
-                    cfgfile = "../../conf/dbservers.json"
-            logger.info("Servers configuration file: %s" % cfgfile)
-            with open(cfgfile, "r") as cfgf:
-                conf = json.load(cfgf)
-        except IOError:
-            conf = {"es_host": "localhost", "es_port": 9200,
-                    "mongodb_host": "localhost", "mongodb_port": 27017}
+        conf = dbconfig()
         if db == 'Elasticsearch':
             if host is None:
                 host = conf['es_host']
             if port is None:
                 port = conf['es_port'] if 'es_port' in conf else 9200
             # TODO: should ES index default be * ?
-            self.es = Elasticsearch(host=host, port=port, timeout=220,
-                                    maxsize=80)
-            if not self.es.ping():
+            self.es = getclient(db, host, port, conf=conf)
+            if self.es is None:
                 print('Elasticsearch server looks unreachable')
                 exit()
-            logger.info("New Elasticsearch connection to host '%s'" % host)
+            logger.info("Elasticsearch connection to host '%s'" % host)
             self.check_elasticsearch_index(recreateindex, es_indexsettings,
                                            es_indexmappings)
         elif db == 'Neo4j':
-            from neo4j import GraphDatabase, basic_auth
             if host is None:
                 host = conf['neo4j_host']
             if port is None:
@@ -66,32 +176,57 @@ class DBconnection(object):
                 user = conf['neo4j_user']
             if password is None:
                 password = conf['neo4j_password']
-            self.driver = GraphDatabase.driver("bolt://{}:{}".
-                                               format(host, port),
-                                               auth=basic_auth(user, password))
-            logger.info("New Neo4j connection to host '%s'" % host)
+            self.driver = getclient(db, host, port, user, password,
+                                    conf=conf)
+            logger.info("Neo4j connection to host '%s'" % host)
             self.neo4jc = self.driver.session()
+        elif db == "File":
+            # Documents are written to compressed NDJSON files,
+            # in the folder named with the index name
+            self.folder = os.path.join(conf.get('file_folder', '.'), index)
+            self.fileformat = conf.get('file_format', 'MongoDB')
+            self.shardsize = conf.get('file_shard_size', FILE_SHARD_SIZE)
+            if not os.path.exists(self.folder):
+                os.makedirs(self.folder)
+            logger.info("NDJSON files folder: '%s'" % self.folder)
+            if mdbcollection is not None:
+                self.mdbcollection = mdbcollection
+                if recreateindex:
+                    self.removefiles(mdbcollection)
+        elif db == "SQLite":
+            # Documents are saved in a SQLite database file named with
+            # the index name, collections have the same methods that
+            # the query classes use with MongoDB collections
+            folder = conf.get('sqlite_folder', '.')
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            dbfile = os.path.abspath(os.path.join(folder, index + '.sqlite'))
+            logger.info("SQLite database file: '%s'" % dbfile)
+            self.mdbi = getclient(db, dbfile, None, conf=conf)
+            if mdbcollection is not None:
+                self.mdbcollection = mdbcollection
+                if recreateindex:
+                    self.mdbi.drop_collection(mdbcollection)
         elif db == "MongoDB":
             if host is None:
                 host = conf['mongodb_host']
             if port is None and 'mongodb_port' in conf:
                 port = conf['mongodb_port']
-            mc = MongoClient(host, port)
-            logger.info("New MongoDB connection: '%s:%d'" % (host, port))
+            mc = getclient(db, host, port, conf=conf)
+            logger.info("MongoDB connection: '%s:%s'" % (host, port))
             self.mdbi = mc[index]
             if mdbcollection is not None:
                 self.mdbcollection = mdbcollection
                 if recreateindex :
                     self.mdbi.drop_collection(mdbcollection)
         else:  # Assume PostgreSQL
-            from sqlalchemy import create_engine
             if port is None:
                 port = 5432
             if host is None:
                 host = 'localhost'
-            url = 'postgresql://{}:{}@{}:{}/{}'
-            url = url.format(user, password, host, port, index)
-            self.sqlc = create_engine(url, client_encoding='utf8', echo=False)
+            self.sqlc = getclient(db, host, port, user, password, index,
+                                  conf)
+        self.host, self.port = host, port
 
     def check_elasticsearch_index(self, recreate, settings, indexmappings):
         if self.db == 'Elasticsearch':
@@ -120,13 +255,64 @@ class DBconnection(object):
                         logger.error(r['error']['reason'])
                         raise ElasticsearchException(r['error']['reason'])
 
+    def dbid(self):
+        """ Identifier of the database, for the keys of the caches shared
+            by the connections: path of the SQLite database file, or path of
+            the File folder, or the host, port and database name """
+        if self.db == 'SQLite':
+            return os.path.abspath(self.mdbi.dbfile)
+        elif self.db == 'File':
+            return os.path.abspath(self.folder)
+        return "%s:%s:%s/%s" % (self.db, self.host, self.port, self.index)
+
+    def esformat(self):
+        """ Whether documents are written for Elasticsearch, to the server
+            or to NDJSON files in Elasticsearch format, with the File option """
+        return self.db == 'Elasticsearch' or \
+            (self.db == 'File' and self.fileformat == 'Elasticsearch')
+
+    def removefiles(self, name):
+        """ Remove NDJSON files of given collection, with the File option """
+        for f in glob.glob(os.path.join(self.folder, name + '-*.ndjson.gz')):
+            os.remove(f)
+
+    def setversion(self, name, version=None):
+        """ Save version stamp of the dataset in given index or collection,
+            by default current time """
+        doc = {"version": time.time() if version is None else version,
+               "updated": datetime.datetime.utcnow()}
+        if self.db == 'Elasticsearch':
+            self.es.index(index=DATASET_VERSIONS, id=name, body=doc)
+        elif self.db in ('MongoDB', 'SQLite'):
+            self.mdbi[DATASET_VERSIONS].replace_one({"_id": name}, doc,
+                                                    upsert=True)
+
+    def getversion(self, name):
+        """ Version stamp of the dataset, None if it was not saved """
+        if self.db == 'Elasticsearch':
+            try:
+                r = self.es.get(index=DATASET_VERSIONS, id=name)
+            except NotFoundError:
+                return None
+            return r['_source']['version']
+        elif self.db in ('MongoDB', 'SQLite'):
+            r = self.mdbi[DATASET_VERSIONS].find_one({"_id": name})
+            return None if r is None else r['version']
+        return None
+
     def close(self):
         if self.db == 'Elasticsearch':
             self.es.indices.refresh(index=self.index)
 
+    def bulkwriter(self, **kwargs):
+        """ Return a BulkWriter for this connection,
+            see BulkWriter for the keyword arguments """
+        return BulkWriter(self, **kwargs)
+
     # Prints '.' to stdout as indication of progress after 'n' entries indexed
     def reportprogress(self, n=160):
         self.i += 1
+        self.metrics.record()
         if self.i % n == 0:
             print(".", end='')
             sys.stdout.flush()
@@ -134,6 +320,269 @@ class DBconnection(object):
                 print("{}".format(self.i))
 
 
+class BulkWriter(object):
+    """ Buffers documents and writes them to the database in bulk requests
+
+    Buffered documents are flushed when the number of documents reaches
+    `chunksize`, or when their approximate json size reaches `maxbytes`;
+    sizes are estimated with the json size of sampled documents, size
+    estimates are skipped if `maxbytes` is None.
+    Flushes are made by `threads` parallel threads, with at most
+    `threads` chunks waiting in memory for their flushes to complete.
+    Documents of the failed threaded flushes are counted in `nerrors`,
+    exception of the first failed flush is re-raised by sync() and close().
+
+    Document ids are read from the '_id' attribute of documents,
+    or can be set with the `docid` argument of the add() method.
+
+    Elasticsearch: documents are written with the `_bulk` API, to the
+      `index` if specified, otherwise to the index of the connection;
+      `optype` is either 'index' or 'create'; with 'create'
+      already existing documents are ignored
+    MongoDB: unordered `bulk_write` calls, with `ReplaceOne(upsert=True)`
+      operations if `upsert` is True, `InsertOne` operations otherwise
+    PostgreSQL: documents are inserted to the SQLAlchemy `table`
+    SQLite: documents are saved as json text, replacing the documents
+      with the same ids if `upsert` is True, otherwise already existing
+      documents are ignored
+    File: documents are written to gzip compressed NDJSON files, named
+      '<collection>-<shard>.ndjson.gz', with at most `shardsize`
+      documents per file; in mongoimport format if the connection's
+      `fileformat` is 'MongoDB', in Elasticsearch `_bulk` format with
+      action lines if it is 'Elasticsearch'
+    """
+
+    def __init__(self, dbc, collection=None, table=None, doctype=None,
+                 chunksize=BULK_CHUNK_SIZE, maxbytes=BULK_MAX_BYTES,
+                 threads=1, optype='index', upsert=True, index=None):
+        self.dbc = dbc
+        self.doctype = doctype
+        self.index = dbc.index if index is None else index
+        self.chunksize = chunksize
+        self.maxbytes = maxbytes
+        self.optype = optype
+        self.upsert = upsert
+        if dbc.db in ("MongoDB", "SQLite"):
+            if collection is None:
+                collection = getattr(dbc, 'mdbcollection', None)
+            self.mcl = dbc.mdbi[collection]
+            self.collection = collection
+        elif dbc.db == "File":
+            if collection is None:
+                collection = getattr(dbc, 'mdbcollection', None) or \
+                    doctype or os.path.basename(self.index)
+            self.filename = os.path.join(dbc.folder, collection)
+            # new files are numbered after the existing ones,
+            # for resumed jobs
+            self.shard = len(glob.glob(self.filename + '-*.ndjson.gz'))
+            self.file = None
+            self.nfiledocs = 0  # documents written to the current file
+            self.filelock = threading.Lock()
+        elif dbc.db not in ("Elasticsearch", "Neo4j"):  # PostgreSQL
+            assert table is not None
+            self.table = getattr(table, '__table__', table)
+        self.buffer = []
+        self.nbytes = 0
+        self.ndocs = 0      # number of documents added
+        self.docsize = 0    # json size of the last sampled document
+        self.nwritten = 0   # number of documents written successfully
+        self.nerrors = 0    # number of documents failed
+        self.error = None   # exception of the first failed threaded flush
+        self.lock = threading.Lock()
+        self.threads = threads
+        self.pool = ThreadPool(threads) if threads > 1 else None
+        self.slots = threading.BoundedSemaphore(threads)
+
+    def add(self, doc, docid=None):
+        """ Add document to the buffer, flush the buffer if it is full """
+        if docid is not None:
+            doc['_id'] = docid
+        with self.lock:
+            self.buffer.append(doc)
+            if self.maxbytes is not None:
+                if self.ndocs % BULK_SIZE_SAMPLE == 0:
+                    self.docsize = len(json.dumps(doc, default=str))
+                self.nbytes += self.docsize
+            self.ndocs += 1
+            if len(self.buffer) < self.chunksize and \
+                    (self.maxbytes is None or self.nbytes < self.maxbytes):
+                return
+            docs, self.buffer, self.nbytes = self.buffer, [], 0
+        self.submit(docs)
+
+    def flush(self):
+        with self.lock:
+            docs, self.buffer, self.nbytes = self.buffer, [], 0
+        if len(docs) > 0:
+            self.submit(docs)
+
+    def submit(self, docs):
+        if self.pool is None:
+            self.write(docs)
+        else:
+            self.slots.acquire()
+            self.pool.apply_async(self.write, (docs,),
+                                  callback=self._release,
+                                  error_callback=partial(self._failed,
+                                                         len(docs)))
+
+    def _release(self, _):
+        self.slots.release()
+
+    def _failed(self, ndocs, e):
+        logger.error("Bulk write of %d documents failed: %s" % (ndocs, e))
+        with self.lock:
+            self.nerrors += ndocs
+            if self.error is None:
+                self.error = e
+        self.slots.release()
+
+    def raise_error(self):
+        """ Re-raise exception of the first failed threaded flush, if any """
+        if self.error is not None:
+            e, self.error = self.error, None
+            raise e
+
+    def write(self, docs):
+        t = time.time()
+        if self.dbc.db == "Elasticsearch":
+            n = self.es_write(docs)
+        elif self.dbc.db == "MongoDB":
+            n = self.mongodb_write(docs)
+        elif self.dbc.db == "File":
+            n = self.file_write(docs)
+        elif self.dbc.db == "SQLite":
+            n = self.mcl.insert_many(docs, replace=self.upsert)
+        else:  # Assume PostgreSQL
+            with self.dbc.sqlc.begin() as conn:
+                conn.execute(self.table.insert(), docs)
+            n = len(docs)
+        self.dbc.metrics.batch(time.time() - t, n, len(docs) - n)
+        with self.lock:
+            self.nwritten += n
+            self.nerrors += len(docs) - n
+        return n
+
+    def es_write(self, docs):
+        if self.optype != 'index':
+            for doc in docs:
+                doc['_op_type'] = self.optype
+        kwargs = {} if self.doctype is None else {'doc_type': self.doctype}
+        n, errors = bulk(self.dbc.es, docs, index=self.index,
+                         chunk_size=len(docs), max_chunk_bytes=sys.maxsize,
+                         raise_on_error=False, **kwargs)
+        for e in errors:
+            action, result = e.popitem()
+            if action == 'create' and result.get('status') == 409:
+                n += 1  # document was indexed before
+                continue
+            print('Failed to %s document %s: %r'
+                  % (action, result.get('_id'), result.get('error')))
+        return n
+
+    def mongodb_write(self, docs):
+        if self.upsert:
+            requests = [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True)
+                        for doc in docs]
+        else:
+            requests = [InsertOne(doc) for doc in docs]
+        try:
+            r = self.mcl.bulk_write(requests, ordered=False,
+                                    bypass_document_validation=True)
+            n = r.upserted_count + r.matched_count + r.inserted_count
+        except BulkWriteError as bwe:
+            for e in bwe.details['writeErrors'][:10]:
+                logger.error("Bulk write error: %s" % e.get('errmsg'))
+            n = len(docs) - len(bwe.details['writeErrors'])
+        return n
+
+    def file_write(self, docs):
+        if self.dbc.fileformat == 'Elasticsearch':
+            lines = []
+            for doc in docs:
+                # index name is not included, it is set when the files
+                # are loaded with the '/<index>/_bulk' API
+                meta = {'_id': doc.pop('_id')} if '_id' in doc else {}
+                lines.append(json.dumps({self.optype: meta}) + '\n' +
+                             json.dumps(doc, default=_esjson) + '\n')
+        else:  # mongoimport format
+            lines = [json.dumps(doc, default=_mongojson) + '\n'
+                     for doc in docs]
+        with self.filelock:
+            for line in lines:
+                if self.file is None:
+                    self.file = gzip.open('%s-%05d.ndjson.gz'
+                                          % (self.filename, self.shard), 'wt')
+                self.file.write(line)
+                self.nfiledocs += 1
+                if self.nfiledocs >= self.dbc.shardsize:
+                    self.closefile()
+        return len(docs)
+
+    def closefile(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.shard += 1
+            self.nfiledocs = 0
+
+    def sync(self):
+        """ Flush buffered documents, wait for the pending writes,
+            raise exception of the failed writes, if any """
+        self.flush()
+        if self.pool is not None:
+            for _ in range(self.threads):
+                self.slots.acquire()
+            for _ in range(self.threads):
+                self.slots.release()
+        self.raise_error()
+
+    def close(self, raise_error=True):
+        """ Flush remaining documents, wait for the pending writes,
+            save new version stamp of the dataset if documents were written,
+            then raise exception of the failed writes, if any """
+        self.flush()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.dbc.db == "File":
+            self.closefile()
+        elif self.nwritten > 0:
+            if self.dbc.db == "Elasticsearch":
+                self.dbc.setversion(self.index)
+            elif self.dbc.db in ("MongoDB", "SQLite"):
+                self.dbc.setversion(self.collection)
+        if raise_error:
+            self.raise_error()
+        return self.nwritten
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *_):
+        # exceptions of the failed writes don't replace the exception
+        # raised in the with block, they were logged when they were raised
+        self.close(raise_error=exc_type is None)
+
+
+# json.dumps default function for the File option with Elasticsearch format
+def _esjson(o):
+    if isinstance(o, (datetime.datetime, datetime.date)):
+        return o.isoformat()
+    return str(o)
+
+
+# json.dumps default function for the File option with mongoimport format,
+# dates are written in MongoDB Extended JSON format
+def _mongojson(o):
+    if isinstance(o, datetime.datetime):
+        return {"$date": o.isoformat() + ('Z' if o.tzinfo is None else '')}
+    if isinstance(o, datetime.date):
+        return {"$date": o.isoformat() + 'T00:00:00Z'}
+    return str(o)
+
+
 def dbargs(argp, mdbdb='biosets', mdbcollection=None, esindex=None,
            multipleindices=False):
     """ Given ArgumentParser object, argp, add database arguments """
@@ -155,7 +604,9 @@ def dbargs(argp, mdbdb='biosets', mdbcollection=None, esindex=None,
     argp.add_argument('--port', type=int,
                       help="Elasticsearch or MongoDB server port number")
     argp.add_argument('--dbtype', default='Elasticsearch',
-                      help="Database: 'Elasticsearch' or 'MongoDB'")
+                      help="Database: 'Elasticsearch' or 'MongoDB', or"
+                           " 'File' for writing to compressed NDJSON files,"
+                           " or 'SQLite' for local database files")
     argp.add_argument('--user',
                       help="Database user name, "
                            "supported with PostgreSQL option only")
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+""" Export tabular datasets to Parquet files, with the dataset readers
+ used by the index scripts
+
+ Records are converted to Arrow tables in batches, string columns are
+ dictionary encoded, and each batch is written as a Parquet file,
+ or as one file for each partition if partition columns are specified.
+ Arrow schema of the dataset is unified across the batches: attributes
+ first seen in later batches are added as new columns, null columns take
+ the type of the values seen later, integer columns with floating point
+ values are promoted to float64, other type conflicts are resolved as
+ string columns. Files written before the schema was changed are
+ rewritten with the final schema, so all files have the same schema.
+ Columns with only null values in all batches are saved with null type.
+"""
+from __future__ import print_function
+
+import argparse
+import fnmatch
+import gzip
+import json
+import os
+import time
+
+BATCH_SIZE = 100000  # Number of records per Arrow table/Parquet file
+
+
+def metanetx_compounds(infile, xreffile=None):
+    from nosqlbiosets.metanetx.index import getcompoundrecord, \
+        getcompoundxrefrecord, getxrefs, read_metanetx_mappings, \
+        _mergecompoundxrefs
+    xrefsmap = {}
+    if xreffile is not None:
+        xrefsmap = getxrefs(xreffile, getcompoundxrefrecord,
+                            _mergecompoundxrefs)
+    return read_metanetx_mappings(infile, getcompoundrecord, xrefsmap)
+
+
+def metanetx_reactions(infile, xreffile=None):
+    from nosqlbiosets.metanetx.index import getreactionrecord, \
+        getreactionxrefrecord, getxrefs, read_metanetx_mappings
+    xrefsmap = {}
+    if xreffile is not None:
+        xrefsmap = getxrefs(xreffile, getreactionxrefrecord)
+    return read_metanetx_mappings(infile, getreactionrecord, xrefsmap)
+
+
+def modelseed_compounds(infile, _=None):
+    from nosqlbiosets.modelseed.index import read_modelseed_datafile, \
+        updatecompoundrecord
+    return read_modelseed_datafile(infile, updatecompoundrecord)
+
+
+def modelseed_reactions(infile, _=None):
+    from nosqlbiosets.modelseed.index import read_modelseed_datafile, \
+        updatereactionrecord
+    return read_modelseed_datafile(infile, updatereactionrecord)
+
+
+def mitab(infile, _=None):
+    from nosqlbiosets.uniprot.index_mitab import read_mitab_datafile, \
+        updatemitabrecord
+    return read_mitab_datafile(infile, updatemitabrecord)
+
+
+def rnacentral(infile, _=None):
+    from geneinfo.rnacentral_idmappings import mappingreader
+    return mappingreader(infile)
+
+
+def hgnc(infile, _=None):
+    from geneinfo.hgnc_geneinfo import read_genes
+    with (gzip.open(infile, 'rt') if infile.endswith(".gz")
+          else open(infile)) as f:
+        genesinfo = json.load(f)
+    return read_genes(genesinfo["response"])
+
+
+def _pubtator(infile, doctype):
+    from nosqlbiosets.pubtator.index import parse_pub2gene_lines
+    with (gzip.open(infile, 'rt') if infile.endswith(".gz")
+          else open(infile)) as f:
+        for r in parse_pub2gene_lines(f, 0, doctype):
+            yield r
+
+
+def pubtator_gene2pub(infile, _=None):
+    return _pubtator(infile, 'gene2pub')
+
+
+def pubtator_disease2pub(infile, _=None):
+    return _pubtator(infile, 'disease2pub')
+
+
+DATASETS = {
+    'metanetx_compounds': metanetx_compounds,
+    'metanetx_reactions': metanetx_reactions,
+    'modelseed_compounds': modelseed_compounds,
+    'modelseed_reactions': modelseed_reactions,
+    'mitab': mitab,
+    'rnacentral': rnacentral,
+    'hgnc': hgnc,
+    'pubtator_gene2pub': pubtator_gene2pub,
+    'pubtator_disease2pub': pubtator_disease2pub
+}
+
+
+def arrowschema(schema):
+    """ Given Arrow schema inferred from a batch, return the schema
+        with string columns dictionary encoded """
+    import pyarrow as pa
+    fields = []
+    for field in schema:
+        if pa.types.is_string(field.type):
+            field = field.with_type(pa.dictionary(pa.int32(), pa.string()))
+        fields.append(field)
+    return pa.schema(fields)
+
+
+def promote(t1, t2):
+    """ Common type of two Arrow types, see the module docstring """
+    import pyarrow as pa
+    if t1 == t2 or pa.types.is_null(t2):
+        return t1
+    if pa.types.is_null(t1):
+        return t2
+    if (pa.types.is_integer(t1) or pa.types.is_floating(t1)) and \
+            (pa.types.is_integer(t2) or pa.types.is_floating(t2)):
+        return pa.float64()
+    if pa.types.is_list(t1) and pa.types.is_list(t2):
+        return pa.list_(promote(t1.value_type, t2.value_type))
+    if pa.types.is_struct(t1) and pa.types.is_struct(t2):
+        return pa.struct(unify_schemas(pa.schema(list(t1)),
+                                       pa.schema(list(t2))))
+    return pa.dictionary(pa.int32(), pa.string())
+
+
+def unify_schemas(schema, other):
+    """ Add the fields of the other schema to the schema,
+        types of the common fields are promoted """
+    import pyarrow as pa
+    fields = [f.with_type(promote(f.type, other.field(f.name).type))
+              if f.name in other.names else f for f in schema]
+    fields += [f for f in other if f.name not in schema.names]
+    return pa.schema(fields)
+
+
+def conform(column, type_):
+    """ Cast Arrow array to the type, promoted by unify_schemas() """
+    import pyarrow as pa
+    if isinstance(column, pa.ChunkedArray):
+        return pa.chunked_array([conform(c, type_) for c in column.chunks],
+                                type=type_)
+    if column.type == type_:
+        return column
+    if pa.types.is_dictionary(type_):
+        if pa.types.is_dictionary(column.type):
+            column = column.dictionary_decode()
+        return column.cast(type_.value_type).dictionary_encode()
+    if pa.types.is_struct(type_) and pa.types.is_struct(column.type):
+        names = [f.name for f in column.type]
+        children = [conform(column.field(f.name), f.type) if f.name in names
+                    else pa.nulls(len(column), f.type) for f in type_]
+        return pa.StructArray.from_arrays(children, fields=list(type_),
+                                          mask=column.is_null())
+    return column.cast(type_)
+
+
+def conform_table(table, schema):
+    """ Table with the columns of the schema, missing columns are nulls """
+    import pyarrow as pa
+    columns = [conform(table.column(f.name), f.type)
+               if f.name in table.column_names
+               else pa.nulls(table.num_rows, f.type) for f in schema]
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def batchfiles(outfolder, n):
+    """ Files of the n'th batch, including the partition folders """
+    pattern = 'part-%05d-*.parquet' % n
+    return [os.path.join(folder, f) for folder, _, files in os.walk(outfolder)
+            for f in fnmatch.filter(files, pattern)]
+
+
+def write_batch(batch, outfolder, schema, partitioncols, n):
+    """ Write the batch, return the schema unified with the batch """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    names, seen = [], set()  # attributes of the records, in seen order
+    for r in batch:
+        for k in r:
+            if k not in seen:
+                seen.add(k)
+                names.append(k)
+    table = pa.table([pa.array([r.get(k) for r in batch]) for k in names],
+                     names=names)
+    tschema = arrowschema(table.schema)
+    schema = tschema if schema is None else unify_schemas(schema, tschema)
+    table = conform_table(table, schema)
+    pq.write_to_dataset(table, outfolder, partition_cols=partitioncols,
+                        basename_template='part-%05d-{i}.parquet' % n)
+    return schema
+
+
+def rewrite_batches(outfolder, schemas, schema, partitioncols):
+    """ Rewrite the files of the batches written with the schemas other
+        than the final schema of the dataset """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    partitioncols = partitioncols or []
+    fschema = pa.schema([f for f in schema if f.name not in partitioncols])
+    for n, bschema in enumerate(schemas):
+        if bschema == schema:
+            continue
+        for f in batchfiles(outfolder, n):
+            table = conform_table(pq.read_table(f), fschema)
+            pq.write_table(table, f)
+
+
+def write_parquet(records, outfolder, partitioncols=None,
+                  batchsize=BATCH_SIZE):
+    """ Write records to Parquet files in outfolder,
+        return number of records written """
+    schema = None
+    schemas = []  # schemas the batches were written with
+    batch = []
+    nrecords = 0
+    for r in records:
+        r.pop('_type', None)  # Elasticsearch document type
+        batch.append(r)
+        if len(batch) == batchsize:
+            schema = write_batch(batch, outfolder, schema, partitioncols,
+                                 len(schemas))
+            schemas.append(schema)
+            nrecords += len(batch)
+            batch = []
+    if len(batch) > 0:
+        schema = write_batch(batch, outfolder, schema, partitioncols,
+                             len(schemas))
+        schemas.append(schema)
+        nrecords += len(batch)
+    rewrite_batches(outfolder, schemas, schema, partitioncols)
+    return nrecords
+
+
+def main(dataset, infile, outfolder, xreffile=None, partitioncols=None,
+         batchsize=BATCH_SIZE):
+    t1 = time.time()
+    records = DATASETS[dataset](infile, xreffile)
+    n = write_parquet(records, outfolder, partitioncols, batchsize)
+    t2 = time.time()
+    print("-- Exported %d records to %s, in %d sec"
+          % (n, outfolder, (t2 - t1)))
+    return n
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Export tabular datasets to Parquet files')
+    parser.add_argument('--dataset', required=True,
+                        choices=sorted(DATASETS),
+                        help='Type of the input file')
+    parser.add_argument('--infile', required=True,
+                        help='Input file, such as MetaNetX chem_prop.tsv')
+    parser.add_argument('--xreffile',
+                        help='MetaNetX xrefs file, chem_xref.tsv or'
+                             ' reac_xref.tsv, for including the xrefs')
+    parser.add_argument('--outfolder', required=True,
+                        help='Folder for the Parquet files')
+    parser.add_argument('--partitionby', nargs='*',
+                        help='Columns to partition the Parquet files')
+    parser.add_argument('--batchsize', type=int, default=BATCH_SIZE,
+                        help='Number of records per Parquet file')
+    args = parser.parse_args()
+    main(args.dataset, args.infile, args.outfolder, args.xreffile,
+         args.partitionby, args.batchsize)
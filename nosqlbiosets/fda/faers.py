@@ -1,47 +1,139 @@
 #!/usr/bin/env python
 # Index FDA Adverse Event Reporting System records
 import argparse
-import json
+import multiprocessing
 import os
 import zipfile
-from pprint import pprint
 
-from elasticsearch.helpers import streaming_bulk
 from pymongo import IndexModel
-from pymongo.errors import BulkWriteError
+from six.moves.queue import Empty
 
 from nosqlbiosets.dbutils import DBconnection, dbargs
 
 CHUNKSIZE = 64
 SOURCEURL = "https://download.open.fda.gov/drug/event/"
-
-
-# Read FAERS report files, index using the index function specified
-def read_and_index_faers_records(infolder, dbc, indexfunc):
-    if os.path.isdir(infolder):
-        for child in os.listdir(infolder):
-            c = os.path.join(infolder, child)
-            if os.path.isdir(c):
-                print("Processing %s" % c)
-                read_and_index_faers_records(c, dbc, indexfunc)
-            else:
-                if child.endswith(".json.zip") or os.path.isdir(c):
-                    print("Processing %s" % c)
-                    read_and_index_faers_records_(
-                        os.path.basename(infolder), c, dbc, indexfunc)
-
-
-def read_and_index_faers_records_(rfolder, infile, dbc, indexfunc):
+QUEUESIZE = 4  # Max number of report chunks waiting per worker process
+QUEUE_TIMEOUT = 5  # Seconds between checks of the worker results
+
+
+# Return (folder name, file path) pairs for the FAERS report files
+# in given folder, and in its subfolders
+def faers_files(infolder):
+    if not os.path.isdir(infolder):
+        yield os.path.basename(os.path.dirname(os.path.abspath(infolder))), \
+            infolder
+        return
+    for child in sorted(os.listdir(infolder)):
+        c = os.path.join(infolder, child)
+        if os.path.isdir(c):
+            for r in faers_files(c):
+                yield r
+        elif child.endswith(".json.zip"):
+            yield os.path.basename(infolder), c
+
+
+# Read FAERS report files, index using the bulk writer specified
+# If workers is set files are read in a pool of worker processes
+def read_and_index_faers_records(infolder, writer, workers=None):
+    files = list(faers_files(infolder))
+    if workers is None:
+        for rfolder, infile in files:
+            print("Processing %s" % infile)
+            for r in read_faers_file(rfolder, infile):
+                writer.add(r)
+    else:
+        read_and_index_faers_files(files, writer, workers)
+    return len(files)
+
+
+# Read FAERS files in worker processes, workers send the reports
+# in chunks to the main process through a bounded queue; the queue is
+# polled with a timeout, so that failures of the workers which did not
+# complete their files are raised instead of waiting for the files.
+# Tasks of the workers killed while reading a file, e.g. by the OOM killer,
+# never complete, such workers are detected by their exit codes
+def read_and_index_faers_files(files, writer, workers):
+    queue = multiprocessing.Queue(QUEUESIZE * workers)
+    pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                initargs=(queue,))
+    try:
+        procs = list(pool._pool)
+        result = pool.map_async(_read_faers_file, files, chunksize=1)
+        pool.close()
+        ndone = 0
+        while ndone < len(files):
+            try:
+                chunk = queue.get(timeout=QUEUE_TIMEOUT)
+            except Empty:
+                if result.ready() and not result.successful():
+                    result.get()  # raises the exception of the worker
+                if not result.ready() and _failedworkers(pool, procs):
+                    raise RuntimeError("FAERS worker process exited while"
+                                       " reading the report files")
+                continue
+            if chunk is None:  # a worker completed reading a file
+                ndone += 1
+                continue
+            for r in chunk:
+                writer.add(r)
+        result.get()  # raises the exception if a worker failed
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+# Return worker processes of the pool that exited with errors, procs is
+# updated with the workers started by the pool to replace exited workers
+def _failedworkers(pool, procs):
+    for p in list(pool._pool):
+        if p not in procs:
+            procs.append(p)
+    return [p for p in procs if p.exitcode not in (None, 0)]
+
+
+_queue = None
+
+
+def _init_worker(queue):
+    global _queue
+    _queue = queue
+
+
+def _read_faers_file(args):
+    rfolder, infile = args
+    print("Processing %s" % infile)
+    chunk = []
+    try:
+        for r in read_faers_file(rfolder, infile):
+            chunk.append(r)
+            if len(chunk) == CHUNKSIZE:
+                _queue.put(chunk)
+                chunk = []
+        if chunk:
+            _queue.put(chunk)
+    finally:
+        _queue.put(None)
+
+
+# Read reports of given FAERS file, the results array is streamed
+# from the file without loading the whole file to memory
+def read_faers_file(rfolder, infile):
+    import ijson
+    rfile = os.path.basename(infile)
     if infile.endswith(".zip"):
         zipf = zipfile.ZipFile(infile, 'r')
-        rfile = zipf.namelist()[0]
-        f = zipf.open(rfile)
+        f = zipf.open(zipf.namelist()[0])
     else:
-        f = open(infile, 'r')
-    rfile = os.path.basename(infile)
-    print("Processing %s" % rfile)
-    reportsinfo = json.load(f)
-    indexfunc(dbc, reportsinfo, rfile, rfolder)
+        zipf = None
+        f = open(infile, 'rb')
+    try:
+        reports = ijson.items(f, 'results.item', use_float=True)
+        for r in read_reports(reports, rfile, rfolder):
+            yield r
+    finally:
+        f.close()
+        if zipf is not None:
+            zipf.close()
 
 
 def update_date(r, date):
@@ -58,7 +150,7 @@ def update_date(r, date):
 
 
 def read_reports(reports, rfile, rfolder):
-    for i, r in enumerate(reports["results"]):
+    for i, r in enumerate(reports):
         r["_id"] = "%s-%s-%d" % (rfolder, rfile[:-17], i)
         for date in ["receive", "transmission", "receipt"]:
             update_date(r, date)
@@ -68,37 +160,6 @@ def read_reports(reports, rfile, rfolder):
         yield r
 
 
-def es_index_reports(dbc, reports, rfile, rfolder):
-    r = 0
-    for ok, result in streaming_bulk(
-            dbc.es,
-            read_reports(reports, rfile, rfolder),
-            index=dbc.index, doc_type='_doc', chunk_size=CHUNKSIZE
-    ):
-        action, result = result.popitem()
-        doc_id = '/%s/commits/%s' % (dbc.index, result['_id'])
-        if not ok:
-            print('Failed to %s document %s: %r' % (action, doc_id, result))
-        else:
-            r += 1
-    return r
-
-
-def mongodb_index_reports(mdbc, reports, rfile, rfolder):
-    entries = list()
-    try:
-        for entry in read_reports(reports, rfile, rfolder):
-            entries.append(entry)
-            if len(entries) == CHUNKSIZE:
-                mdbc.insert_many(entries)
-                entries = list()
-        if len(entries) > 0:
-            mdbc.insert_many(entries)
-    except BulkWriteError as bwe:
-        pprint(bwe.details)
-    return
-
-
 def mongodb_indices(mdb):
     print("\nProcessing text and field indices")
     index = IndexModel([
@@ -116,18 +177,23 @@ def mongodb_indices(mdb):
 
 
 def main(db, infile, mdbdb, mdbcollection, esindex,
-         user=None, password=None, host=None, port=None, recreateindex=False):
+         user=None, password=None, host=None, port=None, recreateindex=False,
+         workers=None):
     if db == "Elasticsearch":
         dbc = DBconnection(db, esindex, host=host, port=port,
                            recreateindex=recreateindex)
-        read_and_index_faers_records(infile, dbc, es_index_reports)
-        dbc.es.indices.refresh(index=esindex)
-    elif db == "MongoDB":
+        writer = dbc.bulkwriter(doctype='_doc', chunksize=CHUNKSIZE)
+    else:
         dbc = DBconnection(db, mdbdb, mdbcollection=mdbcollection,
                            host=host, port=port, user=user, password=password,
                            recreateindex=recreateindex)
-        read_and_index_faers_records(infile, dbc.mdbi[mdbcollection],
-                                     mongodb_index_reports)
+        writer = dbc.bulkwriter(collection=mdbcollection, chunksize=CHUNKSIZE)
+    read_and_index_faers_records(infile, writer, workers)
+    writer.close()
+    print("%d reports indexed" % writer.nwritten)
+    if db == "Elasticsearch":
+        dbc.es.indices.refresh(index=esindex)
+    elif db == "MongoDB":
         mongodb_indices(dbc.mdbi[mdbcollection])
 
 
@@ -139,8 +205,13 @@ if __name__ == '__main__':
                       required=True,
                       help='drug-event .json or .json.zip files or'
                            'folder that includes the .json.zip files')
+    args.add_argument('--workers', type=int,
+                      help='Number of worker processes reading the report'
+                           ' files, by default files are read in the'
+                           ' main process')
     dbargs(args)
     args = args.parse_args()
     main(args.dbtype, args.infile, args.mdbdb, args.mdbcollection,
          args.esindex,
-         args.user, args.password, args.host, args.port, args.recreateindex)
+         args.user, args.password, args.host, args.port, args.recreateindex,
+         args.workers)
@@ -11,6 +11,7 @@ from six import string_types
 
 from nosqlbiosets.dbutils import DBconnection
 from nosqlbiosets.objutils import *
+from nosqlbiosets.xmlutils import parse_xmlrecords
 
 DOCTYPE = 'intenz'     # Default document-type or collection name
 
@@ -25,6 +26,9 @@ class Indexer(DBconnection):
                                       mdbcollection=doctype, recreateindex=True)
         if db == "MongoDB":
             self.mcl = self.mdbi[doctype]
+        if db in ("MongoDB", "Elasticsearch"):
+            self.writer = self.bulkwriter(collection=doctype, optype='create',
+                                          upsert=False)
         elif db == "Neo4j":
             self.reactions = dict()
             self.reactants = set()
@@ -32,7 +36,8 @@ class Indexer(DBconnection):
             self.edges = set()
 
     # Parse IntEnz xml file, call index function after each entry is parsed
-    def parse_intenz_xmlfiles(self, infile):
+    # If processes is set entries are parsed in worker processes
+    def parse_intenz_xmlfiles(self, infile, processes=None):
         infile = str(infile)
         print("Reading/indexing %s " % infile)
         if not infile.endswith(".xml"):
@@ -43,14 +48,21 @@ class Indexer(DBconnection):
                     'http://www.xml-cml.org/schema/cml2/react': None,
                     'http://www.ebi.ac.uk/intenz': None
                 }
-                xmltodict.parse(inf, item_depth=5,
-                                item_callback=self.index_intenz_entry,
-                                process_namespaces=True,
-                                namespaces=namespaces,
-                                attr_prefix='')
+                if processes is None:
+                    xmltodict.parse(inf, item_depth=5,
+                                    item_callback=self.index_intenz_entry,
+                                    process_namespaces=True,
+                                    namespaces=namespaces,
+                                    attr_prefix='')
+                else:
+                    parse_xmlrecords(inf, self.index_intenz_entry, 'enzyme',
+                                     processes, process_namespaces=True,
+                                     namespaces=namespaces, attr_prefix='')
         print("\nCompleted")
         if self.db == "Neo4j":
             self.indexwithneo4j()
+        else:
+            self.writer.close()
 
     def index_intenz_entry(self, _, entry):
         slim = False  # TODO: option to select indexing selected fields only
@@ -72,14 +84,8 @@ class Indexer(DBconnection):
                     unifylistattribute(r, 'productList', 'product', 'products')
             # TODO: make accepted_name list
             try:
-                if self.db == "Elasticsearch":
-                    self.es.index(index=self.index,
-                                  op_type='create', ignore=409,
-                                  filter_path=['hits.hits._id'],
-                                  id=docid, body=entry)
-                elif self.db == "MongoDB":
-                    entry["_id"] = docid
-                    self.mcl.insert_one(entry)
+                if self.db in ("Elasticsearch", "MongoDB"):
+                    self.writer.add(entry, docid=docid)
                 else:  # Neo4j
                     self.updatereactionsandelements_sets(entry)
             except Exception as e:
@@ -176,9 +182,9 @@ def mongodb_textindex(mdb):
     mdb.create_index(index, name="text fields")
 
 
-def main(infile, index, doctype, db, host=None, port=None):
+def main(infile, index, doctype, db, host=None, port=None, processes=None):
     indxr = Indexer(db, index, host, port, doctype)
-    indxr.parse_intenz_xmlfiles(infile)
+    indxr.parse_intenz_xmlfiles(infile, processes)
     if db == 'Elasticsearch':
         indxr.es.indices.refresh(index=index)
     elif db == 'MongoDB':
@@ -205,5 +211,10 @@ if __name__ == '__main__':
                         help="Elasticsearch, MongoDB or Neo4j server port")
     parser.add_argument('--db', default='MongoDB',
                         help="Database: 'Elasticsearch', 'MongoDB' or 'Neo4j'")
+    parser.add_argument('--processes', type=int,
+                        help='Number of processes for parsing IntEnz entries,'
+                             ' by default entries are parsed in the main'
+                             ' process')
     args = parser.parse_args()
-    main(args.infile, args.index, args.doctype, args.db, args.host, args.port)
+    main(args.infile, args.index, args.doctype, args.db, args.host, args.port,
+         args.processes)
@@ -3,7 +3,6 @@
 from __future__ import print_function
 
 import argparse
-import json
 import os
 import sys
 import tarfile
@@ -63,8 +62,10 @@ class Indexer(DBconnection):
         self.index = index
         self.doctype = doctype
         super(Indexer, self).__init__(db, index, host, port)
-        if db != "Elasticsearch":
+        if db == "MongoDB":
             self.mcl = self.mdbi[doctype]
+        self.writer = self.bulkwriter(collection=doctype, doctype=doctype,
+                                      chunksize=40)
 
     # Prepare reaction objects for indexing
     @staticmethod
@@ -103,8 +104,7 @@ class Indexer(DBconnection):
         docid = entry['name']
         self.update_entry(entry)
         try:
-            self.es.index(index=self.index, doc_type=self.doctype,
-                          id=docid, body=json.dumps(entry))
+            self.writer.add(entry, docid=docid)
             return True
         except Exception as e:
             print(e)
@@ -115,10 +115,9 @@ class Indexer(DBconnection):
         print(".", end='')
         sys.stdout.flush()
         docid = entry['name']
-        spec = {"_id": docid}
         self.update_entry(entry)
         try:
-            self.mcl.update(spec, entry, upsert=True)
+            self.writer.add(entry, docid=docid)
             return True
         except Exception as e:
             print(e)
@@ -135,10 +134,13 @@ def main(infile, index, doctype, db, host, port):
     indxr = Indexer(db, index, host, port, doctype)
     if db == 'Elasticsearch':
         read_and_index_kegg_xmlfiles(infile, indxr.es_index_kegg_entry)
+        indxr.writer.close()
         indxr.es.indices.refresh(index=index)
     else:
         read_and_index_kegg_xmlfiles(infile, indxr.mongodb_index_kegg_entry)
-        mongodb_textindex(indxr.mcl)
+        indxr.writer.close()
+        if db == 'MongoDB':
+            mongodb_textindex(indxr.mcl)
 
 
 if __name__ == '__main__':
@@ -161,6 +163,7 @@ if __name__ == '__main__':
     parser.add_argument('--port',
                         help="Elasticsearch or MongoDB server port number")
     parser.add_argument('-db', '--db', default='Elasticsearch',
-                        help="Database: 'Elasticsearch' or 'MongoDB'")
+                        help="Database: 'Elasticsearch' or 'MongoDB',"
+                             " or 'File' for writing to NDJSON files")
     args = parser.parse_args()
     main(args.infile, args.index, args.doctype, args.db, args.host, args.port)
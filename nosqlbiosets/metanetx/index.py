@@ -6,17 +6,24 @@ from __future__ import print_function
 import argparse
 import csv
 import os
+import re
 import time
+from array import array
 from pymongo import IndexModel
 
-from elasticsearch.helpers import streaming_bulk
-
 from nosqlbiosets.dbutils import DBconnection
+from nosqlbiosets.xrefs import XrefWriter
 
 ES_CHUNK_SIZE = 256  # for Elasticsearch index requests
 TYPE_COMPOUND = 'metanetx_compound'
 TYPE_REACTION = 'metanetx_reaction'
 TYPE_COMPARTMENT = 'metanetx_compartment'
+# Metabolite -> reaction inverted index of the reaction equations
+TYPE_REACTION_METABOLITE = 'metanetx_reaction_metabolite'
+# Metabolite terms of the equations, '<coefficient> <MNX_ID>@<compartment>'
+METABOLITE_RE = re.compile(
+    r'(\d*\.\d+|\d+) (MNXM\d+|BIOMASS)@(MNXD[\dX]|BOUNDARY)')
+ES_KEYWORD_FIELDS = ['metabolite', 'compartment', 'side', 'reaction']
 
 
 # Parse records in MetaNetX chem_prop.tsv file which has the following header
@@ -103,19 +110,88 @@ def getcompartmentxrefrecord(row):
     return metanetxid, {"lib": reflib, "id": refid, "desc": row[2]}
 
 
-# Collect xrefs in a dictionary
-def getxrefs(infile, xrefparser):
-    print("Collecting xrefs '%s' in a dictionary" % infile)
-    cxrefs = dict()
+class XrefsMap(object):
+    """ Cross-references of the MetaNetX entries, read from the xref files
+
+    Xref records are not kept as dicts, but as rows of array columns:
+    values of the 'id' field are kept in a list, values of the other fields
+    (libraries, evidence codes, descriptions) are interned in a table and
+    saved as their table indexes. Rows of the same MetaNetX id are linked
+    with the `prev` array. Xref records of the entries are created when
+    they are requested, merged with the `merge` function if it is set.
+    Values assigned to the entries are kept as they were assigned.
+    """
+
+    def __init__(self, merge=None):
+        self.merge = merge
+        self.fields = None   # xref record fields, other than 'id'
+        self.columns = None  # table indexes of the field values, by row
+        self.ids = []        # values of the 'id' field, by row
+        self.prev = array('l')  # previous row of the same MetaNetX id
+        self.last = {}       # MetaNetX id -> last row of its xrefs
+        self.values = []     # interned field values
+        self.vindex = {}     # field value -> index in the values table
+        self.assigned = {}   # MetaNetX id -> assigned xref records
+
+    def intern(self, value):
+        i = self.vindex.get(value)
+        if i is None:
+            i = self.vindex[value] = len(self.values)
+            self.values.append(value)
+        return i
+
+    def add(self, key, xref):
+        if self.fields is None:
+            self.fields = [f for f in xref if f != 'id']
+            self.columns = [array('l') for _ in self.fields]
+        for f, column in zip(self.fields, self.columns):
+            column.append(self.intern(xref[f]))
+        self.ids.append(xref['id'])
+        self.prev.append(self.last.get(key, -1))
+        self.last[key] = len(self.ids) - 1
+
+    def record(self, row):
+        r = {f: self.values[column[row]]
+             for f, column in zip(self.fields, self.columns)}
+        r['id'] = self.ids[row]
+        return r
+
+    def __getitem__(self, key):
+        if key in self.assigned:
+            return self.assigned[key]
+        rows = []
+        row = self.last[key]
+        while row != -1:
+            rows.append(row)
+            row = self.prev[row]
+        xrefs = [self.record(row) for row in reversed(rows)]
+        return xrefs if self.merge is None else self.merge(xrefs)
+
+    def __setitem__(self, key, xrefs):
+        self.assigned[key] = xrefs
+
+    def __contains__(self, key):
+        return key in self.last or key in self.assigned
+
+    def __iter__(self):
+        return iter(list(self.last))
+
+    def __len__(self):
+        return len(self.last)
+
+
+# Collect xrefs in an XrefsMap, xrefs of the entries are merged with
+# the merge function, if it is set, when they are requested
+def getxrefs(infile, xrefparser, merge=None):
+    print("Collecting xrefs '%s'" % infile)
+    cxrefs = XrefsMap(merge)
     with open(infile) as csvfile:
         reader = csv.reader(csvfile, delimiter='\t', quotechar='|')
         for row in reader:
             if row[0][0] == '#':
                 continue
             key, val = xrefparser(row)
-            if key not in cxrefs:
-                cxrefs[key] = []
-            cxrefs[key].append(val)
+            cxrefs.add(key, val)
     return cxrefs
 
 
@@ -133,6 +209,36 @@ def getreactionxrefrecord(row):
     return metanetxid, {"lib": reflib, "id": refid}
 
 
+# Parse MetaNetX reaction equation, return lists of its reactants and products,
+# with their MNX ids, compartments and coefficients, or None if the equation
+# could not be parsed
+def parse_equation(equation):
+    sides = equation.split(' = ')
+    if len(sides) != 2:
+        return None
+    r = []
+    for side in sides:
+        terms = []
+        for term in side.split(' + '):
+            match = METABOLITE_RE.search(term)
+            if match is None:
+                return None
+            terms.append({'mnx_id': match.group(2),
+                          'compartment': match.group(3),
+                          'coefficient': float(match.group(1))})
+        r.append(terms)
+    return r
+
+
+# Rows of the metabolite -> reaction inverted index for the reaction record
+def getreactionmetaboliterecords(r):
+    for side in ['reactants', 'products']:
+        for m in r[side] or []:
+            yield {'metabolite': m['mnx_id'], 'compartment': m['compartment'],
+                   'side': side, 'coefficient': m['coefficient'],
+                   'reaction': r['_id']}
+
+
 # Parse records in react_prop.tsv file which has the following header
 # #MNX_ID  Equation  Description  Balance  EC  Source
 def getreactionrecord(row, xrefsmap):
@@ -143,8 +249,11 @@ def getreactionrecord(row, xrefsmap):
     if j > 0:
         sourcelib = row[5][0:j]
         sourceid = row[5][j + 1:]
+    sides = parse_equation(row[1])
     r = {
         '_id':  id_, 'equation': row[1],
+        'reactants': sides[0] if sides else None,
+        'products': sides[1] if sides else None,
         'desc': row[2], 'balance':  row[3],
         'ecno': row[4].split(";"),
         'source': {'lib': sourcelib, 'id': sourceid},
@@ -165,26 +274,63 @@ def read_metanetx_mappings(infile, metanetxparser, xrefsmap):
 
 class Indexer(DBconnection):
 
-    def __init__(self, db, index, host, port, doctype):
+    # If xrefs is set cross-references of the entries are saved in
+    # the xref lookup table, see nosqlbiosets/xrefs.py
+    def __init__(self, db, index, host, port, doctype, xrefs=False):
         self.doctype = doctype
         if db == "Elasticsearch":
             index = doctype
         super(Indexer, self).__init__(db, index, host, port,
                                       recreateindex=True)
-        if db == "MongoDB":
+        if db in ("MongoDB", "SQLite"):
             self.mdbi.drop_collection(doctype)
             self.mcl = self.mdbi[doctype]
+        elif db == "File":
+            self.removefiles(doctype)
+        if doctype == TYPE_REACTION:
+            self.recreate_invertedindex()
+        self.xrefwriter = XrefWriter(self, doctype) if xrefs else None
+
+    def recreate_invertedindex(self):
+        if self.db == "Elasticsearch":
+            self.es.indices.delete(index=TYPE_REACTION_METABOLITE, ignore=404)
+            self.es.indices.create(index=TYPE_REACTION_METABOLITE, body={
+                "mappings": {"properties": {
+                    f: {"type": "keyword"} for f in ES_KEYWORD_FIELDS}}})
+        elif self.db in ("MongoDB", "SQLite"):
+            self.mdbi.drop_collection(TYPE_REACTION_METABOLITE)
+        elif self.db == "File":
+            self.removefiles(TYPE_REACTION_METABOLITE)
+
+    # Write metabolite -> reaction inverted index rows of the reactions
+    # read by the reader
+    def invertedindex(self, reader):
+        with self.bulkwriter(collection=TYPE_REACTION_METABOLITE,
+                             index=TYPE_REACTION_METABOLITE,
+                             upsert=False) as writer:
+            for r in reader:
+                for row in getreactionmetaboliterecords(r):
+                    writer.add(row)
+                yield r
+        if self.db in ("MongoDB", "SQLite"):
+            self.mdbi[TYPE_REACTION_METABOLITE].create_index([
+                ("metabolite", 1), ("side", 1), ("compartment", 1),
+                ("reaction", 1)])
 
     def indexall(self, reader):
         print("Reading/indexing %s" % reader.gi_frame.f_locals['infile'])
         t1 = time.time()
+        if self.doctype == TYPE_REACTION:
+            reader = self.invertedindex(reader)
         if self.db == "Elasticsearch":
             i = self.es_index(reader)
         else:
             i = self.mongodb_index(reader)
-            if reader != getcompartmentrecord:
+            if self.db == "MongoDB" and reader != getcompartmentrecord:
                 collection = self.doctype
                 self.mongodb_indices(collection)
+        if self.xrefwriter is not None:
+            self.xrefwriter.close()
 
         t2 = time.time()
         print("-- Processed %d entries, in %d sec"
@@ -192,28 +338,30 @@ class Indexer(DBconnection):
 
     def es_index(self, reader):
         i = 0
-        for ok, result in streaming_bulk(self.es, reader, index=self.index,
-                                         doc_type="_doc",
-                                         chunk_size=ES_CHUNK_SIZE):
-            action, result = result.popitem()
-            i += 1
-            doc_id = '/%s/commits/%s' % (self.index, result['_id'])
-            if not ok:
-                print('Failed to %s document %s: %r' % (action, doc_id, result))
-            self.reportprogress()
+        with self.bulkwriter(doctype="_doc",
+                             chunksize=ES_CHUNK_SIZE) as writer:
+            for r in reader:
+                self.addxrefs(r)
+                writer.add(r)
+                i += 1
+                self.reportprogress()
         return i
 
     def mongodb_index(self, reader):
         i = 0
-        for r in reader:
-            try:
-                self.mcl.insert_one(r)
+        with self.bulkwriter(collection=self.doctype, upsert=False) as writer:
+            for r in reader:
+                self.addxrefs(r)
+                writer.add(r)
                 i += 1
                 self.reportprogress()
-            except Exception as e:
-                print(e)
         return i
 
+    def addxrefs(self, r):
+        if self.xrefwriter is not None and r['xrefs'] is not None:
+            for xref in r['xrefs']:
+                self.xrefwriter.add(xref['lib'], xref['id'], r['_id'])
+
     def mongodb_indices(self, collection):
         index = IndexModel([
             ("desc", "text"),
@@ -224,7 +372,7 @@ class Indexer(DBconnection):
         self.mdbi[collection].create_indexes([index])
         indx_fields = ["xrefs.id"]
         if collection == TYPE_REACTION:
-            indx_fields += ["ecno"]
+            indx_fields += ["ecno", "reactants.mnx_id", "products.mnx_id"]
         for field in indx_fields:
             self.mdbi[collection].create_index(field)
 
@@ -260,7 +408,11 @@ if __name__ == '__main__':
     parser.add_argument('--port',
                         help="Elasticsearch/MongoDB server port number")
     parser.add_argument('--db', default='Elasticsearch',
-                        help="Database: Elasticsearch or MongoDB")
+                        help="Database: Elasticsearch, MongoDB or SQLite,"
+                             " or File for writing to NDJSON files")
+    parser.add_argument('--xrefs', action='store_true',
+                        help='Save cross-references of the compounds and'
+                             ' reactions in the xref lookup table')
     args = parser.parse_args()
 
     files = [("compoundsfile", "chem_prop.tsv"),
@@ -275,10 +427,10 @@ if __name__ == '__main__':
         if v[arg] is None:
             v[arg] = os.path.join(args.metanetxdatafolder, filename)
 
-    xrefsmap_ = getxrefs(args.compoundsxreffile, getcompoundxrefrecord)
-    for refs in xrefsmap_:
-        xrefsmap_[refs] = _mergecompoundxrefs(xrefsmap_[refs])
-    indxr = Indexer(args.db, args.index, args.host, args.port, TYPE_COMPOUND)
+    xrefsmap_ = getxrefs(args.compoundsxreffile, getcompoundxrefrecord,
+                         _mergecompoundxrefs)
+    indxr = Indexer(args.db, args.index, args.host, args.port, TYPE_COMPOUND,
+                    args.xrefs)
     indxr.indexall(read_metanetx_mappings(args.compoundsfile,
                                           getcompoundrecord, xrefsmap_))
 
@@ -288,7 +440,8 @@ if __name__ == '__main__':
                                           getcompartmentrecord, xrefsmap_))
 
     xrefsmap_ = getxrefs(args.reactionsxreffile, getreactionxrefrecord)
-    indxr = Indexer(args.db, args.index, args.host, args.port, TYPE_REACTION)
+    indxr = Indexer(args.db, args.index, args.host, args.port, TYPE_REACTION,
+                    args.xrefs)
     indxr.indexall(read_metanetx_mappings(args.reactionsfile,
                                           getreactionrecord, xrefsmap_))
     indxr.close()
@@ -0,0 +1,114 @@
+""" In-memory network of MetaNetX reactions and metabolites
+
+ Metabolites of the reactions are kept in compressed sparse row (CSR)
+ arrays: metabolites of the reaction in row i are the columns
+ indices[indptr[i]:indptr[i+1]], with their stoichiometric coefficients
+ in the same positions of the coefficients array, negative for reactants.
+ Networks are built once for each version of the MetaNetX reactions,
+ see QueryMetaNetX.network(), and are sliced with the reactions selected
+ by queries to build metabolite graphs without reading the reactions again.
+"""
+from array import array
+from collections import OrderedDict
+
+import networkx as nx
+
+from nosqlbiosets.graphutils import remove_highly_connected_nodes
+
+
+class MetaNetXNetwork(object):
+    """ Reactions x metabolites matrix in CSR form, with id<->name arrays """
+
+    def __init__(self, version=None):
+        self.version = version  # version stamp of the reactions collection
+        self.tversion = 0       # last time the version stamp was checked
+        self.queries = OrderedDict()  # recent reaction queries -> rows
+        self.reactions = []     # reaction ids, by row
+        self.sourcelibs = []    # source libraries of the reactions, by row
+        self.ecnos = []         # EC numbers of the reactions, by row
+        self.rindex = {}        # reaction id -> row
+        self.metabolites = []   # metabolite ids, by column
+        self.names = []         # metabolite names, by column
+        self.mindex = {}        # metabolite id -> column
+        self.indptr = array('l', [0])
+        self.indices = array('l')
+        self.coefficients = array('d')
+
+    def __len__(self):
+        return len(self.reactions)
+
+    def column(self, mid):
+        """ Column of the metabolite, new column if it was not seen before """
+        c = self.mindex.get(mid)
+        if c is None:
+            c = self.mindex[mid] = len(self.metabolites)
+            self.metabolites.append(mid)
+            self.names.append(mid)
+        return c
+
+    def addreaction(self, rid, metabolites, sourcelib=None, ecno=None):
+        """ Add reaction with its (metabolite id, coefficient) pairs;
+            terms of the same metabolite in different compartments
+            are kept as separate entries """
+        self.rindex[rid] = len(self.reactions)
+        self.reactions.append(rid)
+        self.sourcelibs.append(sourcelib)
+        self.ecnos.append(ecno)
+        for mid, coefficient in metabolites:
+            self.indices.append(self.column(mid))
+            self.coefficients.append(coefficient)
+        self.indptr.append(len(self.indices))
+
+    def setnames(self, names):
+        """ Set names of the metabolites given as a dict of id -> name,
+            metabolites without names are named with their ids """
+        for mid, name in names.items():
+            c = self.mindex.get(mid)
+            if c is not None:
+                self.names[c] = name
+
+    def rows(self, rids):
+        """ Rows of the reactions, reactions not in the network are skipped """
+        return [self.rindex[rid] for rid in rids if rid in self.rindex]
+
+    def sides(self, row):
+        """ Columns of the reactants and products of the reaction """
+        reactants, products = set(), set()
+        for j in range(self.indptr[row], self.indptr[row + 1]):
+            if self.coefficients[j] < 0:
+                reactants.add(self.indices[j])
+            else:
+                products.add(self.indices[j])
+        return reactants, products
+
+    def metabolitegraph(self, rows, sidec=None, selfloops=False,
+                        max_degree=40, **graphattrs):
+        """ Network of the metabolites of the reactions in given rows,
+            see QueryMetaNetX.get_metabolite_network() """
+        skip = set(self.mindex[m] for m in sidec or [] if m in self.mindex)
+        edges = {}
+        for row in rows:
+            reactants, products = self.sides(row)
+            for u in reactants - skip:
+                for v in products - skip:
+                    if not selfloops and u == v:
+                        continue
+                    e = edges.get((u, v))
+                    if e is None:
+                        edges[u, v] = [row]
+                    elif row not in e:
+                        e.append(row)
+        mn = nx.DiGraph(**graphattrs)
+        names, reactions = self.names, self.reactions
+        for (u, v), erows in edges.items():
+            rids = [reactions[i] for i in erows]
+            u, v = names[u], names[v]  # metabolites may share names
+            if mn.has_edge(u, v):
+                er = mn.get_edge_data(u, v)['reactions']
+                er.extend(rid for rid in rids if rid not in er)
+            else:
+                mn.add_edge(u, v, reactions=rids,
+                            sourcelib=self.sourcelibs[erows[0]],
+                            ec=self.ecnos[erows[0]])
+        remove_highly_connected_nodes(mn, max_degree=max_degree)
+        return mn
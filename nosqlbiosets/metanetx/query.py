@@ -3,13 +3,22 @@
 
 import json
 import re
+import threading
 
-import networkx as nx
+from elasticsearch.helpers import scan
 
 from nosqlbiosets.dbutils import DBconnection
-from nosqlbiosets.graphutils import remove_highly_connected_nodes
-from nosqlbiosets.metanetx.index import TYPE_COMPOUND, TYPE_REACTION
-from nosqlbiosets.qryutils import parseinputquery
+from nosqlbiosets.metanetx.index import METABOLITE_RE, TYPE_COMPOUND, \
+    TYPE_REACTION, TYPE_REACTION_METABOLITE
+from nosqlbiosets.metanetx.network import MetaNetXNetwork
+from nosqlbiosets.qryutils import parseinputquery, DatasetObjects
+from nosqlbiosets.stoichiometry import getmatrix
+from nosqlbiosets.xrefs import hasxrefs, resolve_xrefs
+
+NETWORK_QUERIES = 256  # Reaction queries kept with their rows, per network
+# (database, reactions collection) -> in-memory MetaNetX network
+_networks = DatasetObjects()
+_querieslock = threading.Lock()  # for the queries kept with the networks
 
 
 def cobrababel_parse_metanetx_equation(equation):
@@ -19,8 +28,7 @@ def cobrababel_parse_metanetx_equation(equation):
               https://github.com/mmundy42/cobrababel/blob/master/LICENSE.txt
     Copyright (c) 2017,2017, Mayo Foundation for Medical Education and Research
     """
-    metabolite_re = re.compile(
-        r'(\d*\.\d+|\d+) (MNXM\d+|BIOMASS)@(MNXD[\dX]|BOUNDARY)')
+    metabolite_re = METABOLITE_RE
 
     parts = equation.split(' = ')
     if len(parts) != 2:
@@ -54,12 +62,31 @@ def cobrababel_parse_metanetx_equation(equation):
     return metabolites
 
 
+def stoichiometry(r, compartments=False):
+    """ (metabolite id, coefficient) pairs of the reaction record,
+        coefficients of the reactants are negative; metabolite ids include
+        the compartments, such as 'MNXM1@MNXD1', if compartments is set.
+        Reactions indexed before the reactants and products fields
+        were saved are parsed """
+    def mid(m):
+        return m['mnx_id'] + '@' + m['compartment'] if compartments \
+            else m['mnx_id']
+    if r.get('reactants') is not None:
+        return [(mid(m), -m['coefficient']) for m in r['reactants']] + \
+               [(mid(m), m['coefficient']) for m in r['products']]
+    eq = cobrababel_parse_metanetx_equation(r['equation'])
+    if eq is None:
+        return None
+    return [(mid(m), m['coefficient']) for m in eq.values()]
+
+
 class QueryMetaNetX:
 
     def __init__(self, db="MongoDB", index='biosets', version="", **kwargs):
         self.dbc = DBconnection(db, index, **kwargs)
         self.rcollection = TYPE_REACTION+version
         self.ccollection = TYPE_COMPOUND+version
+        self.mcollection = TYPE_REACTION_METABOLITE+version
 
     # Given MetaNetX compound id return its name
     def getcompoundname(self, mid, limit=0):
@@ -97,6 +124,8 @@ class QueryMetaNetX:
 
     # Given KEGG compound ids find ids for other libraries
     def keggcompoundids2otherids(self, cids, lib='MetanetX'):
+        if hasxrefs(self.dbc, self.ccollection):
+            return self.keggcompoundids2otherids_xrefs(cids, lib)
         if self.dbc.db == 'Elasticsearch':
             index, doctype = TYPE_COMPOUND, "_doc"
             qc = {"match": {"xrefs.id": ' '.join(cids)}}
@@ -125,6 +154,17 @@ class QueryMetaNetX:
                 mids[i] = libids[0]  # TODO: check me
         return mids
 
+    # Same as keggcompoundids2otherids(), with the xref lookup table;
+    # None is returned for the KEGG ids without MetaNetX compounds
+    def keggcompoundids2otherids_xrefs(self, cids, lib='MetanetX'):
+        mids = resolve_xrefs(self.dbc, cids, 'kegg', self.ccollection)
+        mids = [mids[cid][0] if cid in mids else None for cid in cids]
+        if lib == 'MetanetX':
+            return mids
+        libids = resolve_xrefs(self.dbc, [mid for mid in mids if mid],
+                               self.ccollection, lib)
+        return [libids[mid][0] if mid in libids else None for mid in mids]
+
     @staticmethod
     def esquery(es, index, qc, doc_type=None, size=10):
         print("Querying '%s'  %s" % (doc_type, str(qc)))
@@ -167,7 +207,7 @@ class QueryMetaNetX:
 
     # Query reactions with given query clause
     def query_reactions(self, qc, **kwargs):
-        if "MongoDB" == self.dbc.db:
+        if self.dbc.db in ("MongoDB", "SQLite"):
             hits = self.dbc.mdbi[self.rcollection].find(qc, **kwargs)
             r = [c for c in hits]
         else:
@@ -175,21 +215,49 @@ class QueryMetaNetX:
             r, _ = self.esquery(self.dbc.es, index, qc, doctype, **kwargs)
         return r
 
+    def metabolite_reactions(self, mid, side=None, compartment=None):
+        """
+        Return ids of the reactions with given metabolite,
+        read from the metabolite -> reaction inverted index
+        :param mid: MetaNetX id of the metabolite
+        :param side: 'reactants' or 'products', by default both sides
+        :param compartment: MetaNetX id of the compartment, such as 'MNXD1',
+           by default all compartments
+        """
+        qc = {"metabolite": mid}
+        if side is not None:
+            qc["side"] = side
+        if compartment is not None:
+            qc["compartment"] = compartment
+        if self.dbc.db == 'Elasticsearch':
+            filters = [{"term": {k: v}} for k, v in qc.items()]
+            hits = scan(self.dbc.es, index=self.mcollection,
+                        _source=["reaction"],
+                        query={"query": {"bool": {"filter": filters}}})
+            rows = (hit['_source'] for hit in hits)
+        else:
+            rows = self.dbc.mdbi[self.mcollection].find(
+                qc, projection={"_id": 0, "reaction": 1})
+        r = []
+        for row in rows:
+            if row['reaction'] not in r:
+                r.append(row['reaction'])
+        return r
+
     # Query reactions and return reactions together with their metabolites
     def reactionswithmetabolites(self, qc, **kwargs):
         cr = self.dbc.mdbi[self.rcollection].find(qc, **kwargs)
         reacts = []
         mids = set()
         for r in cr:
-            eq = cobrababel_parse_metanetx_equation(r['equation'])
+            eq = stoichiometry(r)
             if eq is None:
                 continue
             r['reactants'] = set()
             r['products'] = set()
-            for m in eq.items():
-                mid = m[1]['mnx_id']
+            for mid, coefficient in eq:
                 mids.add(mid)
-                if m[1]['coefficient'] < 0:
+                if coefficient < 0:
                     r['reactants'].add(mid)
                 else:
                     r['products'].add(mid)
@@ -200,6 +268,68 @@ class QueryMetaNetX:
         metabolites = {i['_id']: i['desc'] for i in cr}
         return reacts, metabolites
 
+    def network(self):
+        """ In-memory network of the MetaNetX reactions, built once for
+            each version of the reactions collection, see network.py """
+        return _networks.get(self.dbc, self.rcollection, self.buildnetwork)
+
+    def buildnetwork(self, version=None):
+        """ Read all reactions and build their in-memory network """
+        net = MetaNetXNetwork(version)
+        cr = self.dbc.mdbi[self.rcollection].find(
+            {}, projection=['equation', 'reactants', 'products',
+                            'source', 'ecno'])
+        for r in cr:
+            eq = stoichiometry(r)
+            if eq is None:
+                continue
+            net.addreaction(r['_id'], eq, r['source']['lib'], r['ecno'])
+        cr = self.dbc.mdbi[self.ccollection].find({}, projection=['desc'])
+        net.setnames({c['_id']: c['desc'] for c in cr})
+        return net
+
+    def reactionrows(self, net, qc):
+        """ Rows of the reactions selected by the query clause,
+            results of recent queries are kept with the network """
+        key = json.dumps(qc)
+        with _querieslock:
+            rows = net.queries.pop(key, None)
+        if rows is None:
+            cr = self.dbc.mdbi[self.rcollection].find(qc, projection=['_id'])
+            rows = net.rows(r['_id'] for r in cr)
+        with _querieslock:
+            net.queries[key] = rows
+            while len(net.queries) > NETWORK_QUERIES:
+                net.queries.popitem(last=False)
+        return rows
+
+    def stoichiometric_matrix(self, qc=None, cachefolder=None):
+        """
+        Stoichiometric matrix of the reactions selected by the query clause,
+        sliced from the matrix of all reactions, which is saved in
+        the cache folder for each version of the reactions collection,
+        see nosqlbiosets/stoichiometry.py; requires numpy and scipy
+        :param qc: query clause, by default all reactions are selected
+        :param cachefolder: by default 'matrix_folder' configuration setting
+        :return: scipy.sparse.csr_matrix of metabolites x reactions,
+           arrays of the metabolite ids with compartments, and reaction ids
+        """
+        def reactions():
+            cr = self.dbc.mdbi[self.rcollection].find(
+                {}, projection=['equation', 'reactants', 'products'])
+            for r in cr:
+                eq = stoichiometry(r, compartments=True)
+                if eq is not None:
+                    yield r['_id'], eq
+        m = getmatrix(self.dbc.dbid(), self.rcollection,
+                      self.dbc.getversion(self.rcollection), reactions,
+                      cachefolder)
+        rows = None
+        if qc is not None:
+            cr = self.dbc.mdbi[self.rcollection].find(qc, projection=['_id'])
+            rows = m.rows(r['_id'] for r in cr)
+        return m.matrix(rows)
+
     def get_metabolite_network(self, qc, sidec=None, selfloops=False,
                                max_degree=40):
         """
@@ -213,32 +343,11 @@ class QueryMetaNetX:
            are not included in the result graph
         :return: metabolites graph as NetworkX object
         """
-        reacts, metabolites = self.reactionswithmetabolites(qc)
-        if sidec is not None:
-            sidec = " ".join(sidec)
-        mn = nx.DiGraph(name='MetaNetX',
-                        query=json.dumps(qc).replace('"', '\''))
-        for r in reacts:
-            for u_ in r['reactants']:
-                if sidec is not None and u_ in sidec:
-                    continue
-                u = metabolites[u_]
-                for v in r['products']:
-                    if not selfloops and v == u_:
-                        continue
-                    if sidec is not None and v in sidec:
-                        continue
-                    v = metabolites[v]
-                    if mn.has_edge(u, v):
-                        er = mn.get_edge_data(u, v)['reactions']
-                        if r['_id'] not in er:
-                            er.append(r['_id'])
-                    else:
-                        er = list([r['_id']])
-                        mn.add_edge(u, v, reactions=er,
-                                    sourcelib=r['source']['lib'], ec=r['ecno'])
-        remove_highly_connected_nodes(mn, max_degree=max_degree)
-        return mn
+        net = self.network()
+        rows = self.reactionrows(net, qc)
+        return net.metabolitegraph(rows, sidec, selfloops, max_degree,
+                                   name='MetaNetX',
+                                   query=json.dumps(qc).replace('"', '\''))
 
 
 def cyview(query):
@@ -0,0 +1,199 @@
+""" Ingestion metrics and profiling for indexing jobs
+
+ Metrics objects record number of records indexed, bytes read from
+ input files, time spent in the parse/transform/write stages,
+ latency histogram of bulk write requests and documents rejected
+ by the databases. Snapshots of the metrics are logged as json lines
+ in regular intervals, final summary can be saved as json file.
+ Comparing parse, transform and write times tells whether a dataset
+ load is parser-bound or database-bound.
+"""
+from __future__ import print_function
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.addHandler(logging.StreamHandler())
+
+LOG_INTERVAL = 60  # Seconds between the metrics log lines
+# Upper bounds of the bulk write latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+
+class Metrics(object):
+    """ Thread-safe counters and stage timers of an indexing job
+
+    Stage times are summed over threads, write times of parallel bulk
+    writes can add up to more than the elapsed time.
+    """
+
+    def __init__(self, name, loginterval=LOG_INTERVAL):
+        self.name = name
+        self.loginterval = loginterval
+        self.lock = threading.Lock()
+        self.tstart = time.time()
+        self.tlog = self.tstart
+        self.tlap = None
+        self.nrecords = 0
+        self.nbytes = 0      # bytes read from input files
+        self.stages = {}     # stage name -> [seconds, number of calls]
+        self.nbatches = 0    # bulk write requests
+        self.ndocs = 0       # documents written successfully
+        self.nrejected = 0   # documents the database failed to write
+        self.latencies = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record(self, n=1):
+        """ Count indexed records, log metrics if the log interval passed """
+        with self.lock:
+            self.nrecords += n
+        self.log()
+
+    def addtime(self, stage, seconds):
+        with self.lock:
+            s = self.stages.setdefault(stage, [0.0, 0])
+            s[0] += seconds
+            s[1] += 1
+
+    @contextmanager
+    def timer(self, stage):
+        """ Add time spent in the with block to the given stage """
+        t = time.time()
+        try:
+            yield
+        finally:
+            self.addtime(stage, time.time() - t)
+
+    def lap(self, stage=None):
+        """ Add time since the previous lap() call to the given stage
+
+        For parsers calling back for each record; lap('parse') at the
+        start of the callbacks, and lap() at their ends, records the time
+        spent in the parser between the callbacks
+        """
+        t = time.time()
+        if stage is not None and self.tlap is not None:
+            self.addtime(stage, t - self.tlap)
+        self.tlap = t
+
+    def batch(self, seconds, ndocs, nrejected=0):
+        """ Record latency and results of a bulk write request """
+        i = 0
+        while i < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[i]:
+            i += 1
+        with self.lock:
+            self.nbatches += 1
+            self.ndocs += ndocs
+            self.nrejected += nrejected
+            self.latencies[i] += 1
+            s = self.stages.setdefault('write', [0.0, 0])
+            s[0] += seconds
+            s[1] += 1
+
+    def reader(self, f):
+        """ Return wrapper of file object f counting the bytes read """
+        return _CountingReader(f, self)
+
+    def snapshot(self):
+        with self.lock:
+            t = time.time() - self.tstart
+            buckets = ["<=%g" % b for b in LATENCY_BUCKETS] + \
+                [">%g" % LATENCY_BUCKETS[-1]]
+            return {
+                "name": self.name,
+                "elapsed": round(t, 3),
+                "records": self.nrecords,
+                "records/s": round(self.nrecords / t, 1) if t > 0 else 0,
+                "bytes": self.nbytes,
+                "bytes/s": round(self.nbytes / t, 1) if t > 0 else 0,
+                "stages": {k: {"seconds": round(v[0], 3), "calls": v[1]}
+                           for k, v in self.stages.items()},
+                "batches": self.nbatches,
+                "batch_latency": dict(zip(buckets, self.latencies)),
+                "documents": self.ndocs,
+                "rejected": self.nrejected
+            }
+
+    def log(self, force=False):
+        """ Log metrics snapshot as json line if the log interval passed """
+        t = time.time()
+        with self.lock:
+            if not force and t - self.tlog < self.loginterval:
+                return
+            self.tlog = t
+        logger.info("metrics %s" % json.dumps(self.snapshot()))
+
+    def summary(self, outfile=None):
+        """ Log final metrics, and save them to outfile if specified """
+        s = self.snapshot()
+        self.log(force=True)
+        if outfile is not None:
+            with open(outfile, 'w') as f:
+                json.dump(s, f, indent=2)
+        return s
+
+
+class _CountingReader(object):
+
+    def __init__(self, f, metrics):
+        self.f = f
+        self.metrics = metrics
+
+    def read(self, *args):
+        b = self.f.read(*args)
+        with self.metrics.lock:
+            self.metrics.nbytes += len(b)
+        return b
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+
+def profile(outfile, func, *args, **kwargs):
+    """ Call func with cProfile and tracemalloc enabled
+
+    Profile stats are saved to outfile, readable with pstats module,
+    top memory allocations are saved to outfile + '.tracemalloc.txt'
+    tracemalloc is available with Python 3.4 and later, with earlier
+    versions only cProfile is enabled
+    """
+    import cProfile
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+    prof = cProfile.Profile()
+    try:
+        return prof.runcall(func, *args, **kwargs)
+    finally:
+        prof.dump_stats(outfile)
+        print("Profile stats saved to %s" % outfile)
+        if tracemalloc is not None:
+            _savetracemalloc(tracemalloc, outfile + '.tracemalloc.txt')
+
+
+def _savetracemalloc(tracemalloc, outfile):
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    with open(outfile, 'w') as f:
+        print("current: %d bytes, peak: %d bytes" % (current, peak), file=f)
+        for stat in snapshot.statistics('lineno')[:50]:
+            print(stat, file=f)
+
+
+def metricsargs(argp):
+    """ Given ArgumentParser object, argp, add metrics arguments """
+    argp.add_argument('--metrics',
+                      help='Save summary of the ingestion metrics'
+                           ' to given json file')
+    argp.add_argument('--profile',
+                      help='Run with cProfile and tracemalloc enabled,'
+                           ' save profile stats to given file;'
+                           ' tracemalloc requires Python 3.4 or later')
@@ -7,8 +7,6 @@ import argparse
 import csv
 import time
 
-from elasticsearch.helpers import streaming_bulk
-
 from nosqlbiosets.dbutils import DBconnection
 from pymongo import IndexModel
 
@@ -78,17 +76,10 @@ def read_modelseed_datafile(infile, lineparser):
 def es_index(dbc, infile, typetuner):
     i = 0
     t1 = time.time()
-    for ok, result in streaming_bulk(
-            dbc.es,
-            read_modelseed_datafile(infile, typetuner),
-            index=dbc.index,
-            chunk_size=ES_CHUNK_SIZE
-    ):
-        action, result = result.popitem()
-        i += 1
-        doc_id = '/%s/commits/%s' % (dbc.index, result['_id'])
-        if not ok:
-            print('Failed to %s document %s: %r' % (action, doc_id, result))
+    with dbc.bulkwriter(chunksize=ES_CHUNK_SIZE) as writer:
+        for entry in read_modelseed_datafile(infile, typetuner):
+            writer.add(entry)
+            i += 1
     t2 = time.time()
     print("-- Processed %d entries, in %d sec"
           % (i, (t2 - t1)))
@@ -114,13 +105,14 @@ def mongodb_indices(mdb):
         mdb.create_indexes([index])
 
 
-def mongodb_index(mdbc, infile, typetuner):
+def mongodb_index(dbc, collection, infile, typetuner):
     i = 0
     t1 = time.time()
-    for entry in read_modelseed_datafile(infile, typetuner):
-        del(entry['_type'])
-        mdbc.insert_one(entry)
-        i += 1
+    with dbc.bulkwriter(collection=collection, upsert=False) as writer:
+        for entry in read_modelseed_datafile(infile, typetuner):
+            del(entry['_type'])
+            writer.add(entry)
+            i += 1
     t2 = time.time()
     print("-- Processed %d entries, in %d sec"
           % (i, (t2 - t1)))
@@ -136,9 +128,12 @@ def main(infile, index, doctype, db, host=None, port=None):
     if db == 'Elasticsearch':
         es_index(dbc, infile, typetuner)
         dbc.es.indices.refresh(index=index)
+    elif db == 'File':
+        dbc.removefiles(doctype)
+        mongodb_index(dbc, doctype, infile, typetuner)
     else:  # assume MongoDB
         dbc.mdbi.drop_collection(doctype)
-        mongodb_index(dbc.mdbi[doctype], infile, typetuner)
+        mongodb_index(dbc, doctype, infile, typetuner)
         mongodb_indices(dbc.mdbi[doctype])
 
 
@@ -158,7 +153,8 @@ if __name__ == '__main__':
     parser.add_argument('--port',
                         help="Elasticsearch or MongoDB server port")
     parser.add_argument('--db', default='Elasticsearch',
-                        help="Database: 'Elasticsearch' or 'MongoDB'")
+                        help="Database: 'Elasticsearch' or 'MongoDB',"
+                             " or 'File' for writing to NDJSON files")
     args = parser.parse_args()
 
     if args.compoundsfile is not None:
@@ -7,11 +7,21 @@ import re
 import networkx as nx
 
 from nosqlbiosets.dbutils import DBconnection
-from nosqlbiosets.qryutils import parseinputquery
+from nosqlbiosets.qryutils import parseinputquery, DatasetObjects
+from nosqlbiosets.stoichiometry import getmatrix
 
 # MongoDB collection names or Elasticsearch index names:
 COMPOUNDSTYPE = "modelseed_compound"
 REACTIONSTYPE = "modelseed_reaction"
+# Terms of the stoichiometry field of the reactions,
+# '<coefficient>:<compound id>:<compartment>:<index>:"<name>"'
+STOICHIOMETRY_RE = re.compile(
+    r'(-?\d*\.?\d+(?:[eE]-?\d+)?):(cpd\d+):(\d+):\d+:"')
+# Compound terms of the equations,
+# '(<coefficient>) <compound id>[<compartment>]'
+EQUATION_TERM_RE = re.compile(r'\((\d*\.*\d*(e-\d+)?)\) (cpd\d+)\[(\d+)\]')
+# (database, compounds collection) -> compound names
+_compoundnames = DatasetObjects()
 
 
 def modelseeddb_parse_equation(equation, delimiter=' '):
@@ -54,6 +64,29 @@ def modelseeddb_parse_equation(equation, delimiter=' '):
     return reactants, products, direction
 
 
+def parse_stoichiometry(stoichiometry):
+    """ (metabolite id, coefficient) pairs of the stoichiometry field
+        of reactions, metabolite ids include the compartment indexes
+        in the form used in the equations, such as 'cpd00001[0]' """
+    return [("%s[%s]" % (cid, compartment), float(coefficient))
+            for coefficient, cid, compartment
+            in STOICHIOMETRY_RE.findall(stoichiometry)]
+
+
+def equation_compounds(equation):
+    """ Compound ids of the reactants and products of the reaction equation,
+        each term of the equation is parsed once """
+    reactants, products, _ = modelseeddb_parse_equation(equation)
+    assert reactants is not None
+    return ([EQUATION_TERM_RE.search(u).group(3) for u in reactants],
+            [EQUATION_TERM_RE.search(v).group(3) for v in products])
+
+
+class CompoundNames(dict):
+    """ Compound id -> name dict, with the version stamp
+        of the compounds collection it was read from """
+
+
 class QueryModelSEED:
 
     def __init__(self, db="MongoDB", index='biosets', version="", **kwargs):
@@ -114,6 +147,42 @@ class QueryModelSEED:
         r = self.query_metabolites(qc, projection=['name'], **kwargs)
         return list(r)
 
+    def stoichiometric_matrix(self, qc=None, cachefolder=None):
+        """
+        Stoichiometric matrix of the reactions selected by the query clause,
+        sliced from the matrix of all reactions, which is saved in
+        the cache folder for each version of the reactions collection,
+        see nosqlbiosets/stoichiometry.py; requires numpy and scipy
+        :param qc: query clause, by default all reactions are selected
+        :param cachefolder: by default 'matrix_folder' configuration setting
+        :return: scipy.sparse.csr_matrix of metabolites x reactions,
+           arrays of the metabolite ids with compartments, and reaction ids
+        """
+        def reactions():
+            cr = self.dbc.mdbi[self.rcollection].find(
+                {}, projection=['stoichiometry'])
+            for r in cr:
+                if 'stoichiometry' in r:
+                    yield r['_id'], parse_stoichiometry(r['stoichiometry'])
+        m = getmatrix(self.dbc.dbid(), self.rcollection,
+                      self.dbc.getversion(self.rcollection), reactions,
+                      cachefolder)
+        rows = None
+        if qc is not None:
+            cr = self.dbc.mdbi[self.rcollection].find(qc, projection=['_id'])
+            rows = m.rows(r['_id'] for r in cr)
+        return m.matrix(rows)
+
+    def compoundnames(self, refresh=False):
+        """ Compound id -> name dict, read once for each version of
+            the compounds collection and shared by the query objects;
+            it is read again if refresh is set """
+        def readnames(_):
+            cr = self.dbc.mdbi[self.ccollection].find({}, projection=['name'])
+            return CompoundNames({c['_id']: c['name'] for c in cr})
+        return _compoundnames.get(self.dbc, self.ccollection, readnames,
+                                  refresh)
+
     def get_metabolite_network(self, qc, **kwargs):
         """ Get graph of metabolites for given reaction query,
         edges data include the set of reactions connecting two metabolites
@@ -121,23 +190,15 @@ class QueryModelSEED:
         graph = nx.DiGraph(name='ModelSEEDdb', query=json.dumps(qc))
         reacts = self.dbc.mdbi[self.rcollection].\
             find(qc, projection=['name', 'equation'], **kwargs)
-        mre = re.compile(r'\((\d*\.*\d*(e-\d+)?)\) (cpd\d+)\[(\d+)\]')
-        r = self.query_metabolites({}, projection=['name'])
-        id2name = {i['_id']: i['name'] for i in r}
+        id2name = self.compoundnames()
         for r in reacts:
-            reactants, products, _ = \
-                modelseeddb_parse_equation(r['equation'])
-            assert reactants is not None
+            reactants, products = equation_compounds(r['equation'])
+            products = [id2name.get(v, v) for v in products]
             for u in reactants:
-                match = re.search(mre, u)
-                u = match.group(3)
-                u = id2name[u]
+                u = id2name.get(u, u)
                 if not graph.has_node(u):
                     graph.add_node(u)
                 for v in products:
-                    match = re.search(mre, v)
-                    v = match.group(3)
-                    v = id2name[v]
                     if not graph.has_node(v):
                         graph.add_node(v)
                     if graph.has_edge(u, v):
@@ -0,0 +1,128 @@
+""" Bounded-queue executor for running index calls in worker threads
+
+ Records are usually parsed in the main thread and their index calls are
+ submitted to a Pipeline. When the number of queued calls reaches
+ `maxqueued`, submit() blocks until a worker thread takes the next call,
+ so parsers can't get ahead of the database writes and fill the memory.
+ Exceptions raised by the calls are re-raised in the main thread,
+ by the next submit(), wait() or close() call.
+"""
+from __future__ import print_function
+
+import sys
+import threading
+import time
+
+import six
+from six.moves import queue
+
+_STOP = object()  # Sentinel for the worker threads to exit
+
+
+class Pipeline(object):
+    """ Run submitted calls in `threads` worker threads, with at most
+    `maxqueued` calls waiting in the queue
+
+    Counters of the pipeline stages, producer: `nsubmitted` and `tblocked`,
+    seconds submit() calls waited for free queue slots; workers:
+    `ncompleted`, `nfailed` and `tbusy`, total seconds spent in the calls.
+    """
+
+    def __init__(self, threads, maxqueued, name='pipeline'):
+        self.name = name
+        self.queue = queue.Queue(maxqueued)
+        self.lock = threading.Lock()
+        self.error = None   # exc_info of the first failed call
+        self.nsubmitted = 0
+        self.ncompleted = 0
+        self.nfailed = 0
+        self.tblocked = 0.0
+        self.tbusy = 0.0
+        self.tstart = time.time()
+        self.workers = []
+        for _ in range(threads):
+            t = threading.Thread(target=self._work)
+            t.daemon = True
+            t.start()
+            self.workers.append(t)
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if job is _STOP:
+                self.queue.task_done()
+                return
+            if self.error is not None:  # skip the remaining calls
+                self.queue.task_done()
+                continue
+            func, args, kwargs = job
+            t = time.time()
+            try:
+                func(*args, **kwargs)
+                failed = False
+            except Exception:
+                failed = True
+                with self.lock:
+                    if self.error is None:
+                        self.error = sys.exc_info()
+            with self.lock:
+                self.tbusy += time.time() - t
+                if failed:
+                    self.nfailed += 1
+                else:
+                    self.ncompleted += 1
+            self.queue.task_done()
+
+    def raise_error(self):
+        """ Re-raise exception of the first failed call, if any """
+        if self.error is not None:
+            six.reraise(*self.error)
+
+    def submit(self, func, *args, **kwargs):
+        """ Queue func(*args, **kwargs) call, block if the queue is full """
+        self.raise_error()
+        if self.queue.full():
+            t = time.time()
+            self.queue.put((func, args, kwargs))
+            self.tblocked += time.time() - t
+        else:
+            self.queue.put((func, args, kwargs))
+        self.nsubmitted += 1
+
+    def wait(self):
+        """ Wait for the queued calls to complete """
+        self.queue.join()
+        self.raise_error()
+
+    def close(self):
+        """ Wait for the queued calls, then stop the worker threads """
+        self._stop()
+        self.raise_error()
+
+    def _stop(self):
+        self.queue.join()
+        for _ in self.workers:
+            self.queue.put(_STOP)
+        for t in self.workers:
+            t.join()
+        self.workers = []
+
+    def report(self):
+        """ Print the counters of the pipeline """
+        t = time.time() - self.tstart
+        print("\n%s: %d calls submitted, %d completed, %d failed in %.1fs"
+              " (%.1f calls/s); submit blocked %.1fs, workers busy %.1fs"
+              % (self.name, self.nsubmitted, self.ncompleted, self.nfailed,
+                 t, self.ncompleted / t if t > 0 else 0, self.tblocked,
+                 self.tbusy))
+
+    def __enter__(self):
+        return self
+
+    # Exceptions raised in the with block are not replaced by
+    # the exceptions of the failed calls
+    def __exit__(self, exc_type, *_):
+        if exc_type is None:
+            self.close()
+        else:
+            self._stop()
@@ -6,7 +6,6 @@ import argparse
 import gzip
 import json
 import os
-import struct
 import sys
 import time
 from zipfile import ZipFile
@@ -15,29 +14,15 @@ from nosqlbiosets.dbutils import DBconnection
 
 # Document type name for the Elascticsearch or Collection name for MongoDB
 DOCTYPE = "bioassay"
+# Collection name for MongoDB, or Elasticsearch index name suffix,
+# for the bioassay data rows, tested substances and their results
+DATA_DOCTYPE = "bioassaydata"
 INDEX = "pubchem"
 
-# Maximum size of uncompressed files that should be indexed
-MaxEntrySize = 256*1024*1024
 
-# Maximum total size of uncompressed files indexed
-# before an Elasticsearch  _refresh call (~equivalent of database commits)
-MaxBulkSize = 4*MaxEntrySize
-
-
-def getuncompressedsize(filename):
-    with open(filename, 'rb') as f:
-        return getuncompressedsize_(f)
-
-
-def getuncompressedsize_(f):
-    f.seek(-4, 2)
-    return struct.unpack('I', f.read(4))[0]
-
-
-# Read given bioassay json file, index using the index function specified
+# Read given bioassay json file, index using the indexer specified
 # If the input file is a folder then iterate over files in the folder
-def read_and_index_pubchem_bioassays(infile, es, indexfunc):
+def read_and_index_pubchem_bioassays(infile, indxr):
     print("Reading %s " % infile)
     i = 0
     t1 = time.time()
@@ -45,15 +30,15 @@ def read_and_index_pubchem_bioassays(infile, es, indexfunc):
         for child in os.listdir(infile):
             c = os.path.join(infile, child)
             if child.endswith(".zip"):
-                read_and_index_pubchem_bioassays_zipfile(c, es, indexfunc)
+                read_and_index_pubchem_bioassays_zipfile(c, indxr)
             else:
-                read_and_index_pubchem_bioassays_file(c, es, indexfunc)
+                read_and_index_pubchem_bioassays_file(c, indxr)
             i += 1
     else:
         if infile.endswith(".zip"):
-            read_and_index_pubchem_bioassays_zipfile(infile, es, indexfunc)
+            read_and_index_pubchem_bioassays_zipfile(infile, indxr)
         else:
-            read_and_index_pubchem_bioassays_file(infile, es, indexfunc)
+            read_and_index_pubchem_bioassays_file(infile, indxr)
         i = 1
     t2 = time.time()
     print("-- %d files have been processed, in %dms"
@@ -61,35 +46,68 @@ def read_and_index_pubchem_bioassays(infile, es, indexfunc):
     return None
 
 
-# Read given bioassays zip file, index using the index function specified
-def read_and_index_pubchem_bioassays_zipfile(zipfile, dbc, indexf):
+# Read given bioassays zip file, index using the indexer specified
+def read_and_index_pubchem_bioassays_zipfile(zipfile, indxr):
     print("\nProcessing %s " % zipfile)
     i = 0
-    r = 0
     with ZipFile(zipfile) as myzip:
         for fname in myzip.namelist():
             aid = fname[fname.find('/')+1:fname.find(".json")]
-            with myzip.open(fname) as jfile:
-                # TODO: gzip.open() doesn't work with python2
-                f = gzip.open(jfile, 'rt')  # read as text, input to json.load
-                r = index_bioassay(dbc, f, r, aid, indexf)
+            with myzip.open(fname) as jfile, gzip.open(jfile, 'rb') as f:
+                indxr.index_bioassay(f, aid)
                 i += 1
     return i
 
 
-# Read given bioassay file, index using the index function specified
-def read_and_index_pubchem_bioassays_file(infile, dbc, indexfunc):
+# Read given bioassay file, index using the indexer specified
+def read_and_index_pubchem_bioassays_file(infile, indxr):
     if infile.endswith(".json.gz"):
-        print(getuncompressedsize(infile))
-        f = gzip.open(infile, 'rt')
+        f = gzip.open(infile, 'rb')
     elif infile.endswith(".json"):
-        f = open(infile, 'r')
+        f = open(infile, 'rb')
     else:
         print('Unsupported file extension; %s' % infile)
         return
     aid = infile[infile.rfind('/') + 1:infile.find(".json")]
-    r = index_bioassay(dbc, f, 0, aid, indexfunc)
-    return r
+    indxr.index_bioassay(f, aid)
+    f.close()
+
+
+def iter_bioassay(f):
+    """
+    Parse bioassay json file incrementally, without loading the file
+    to memory. Yields ('data', row) pairs for the rows of the
+    PC_AssaySubmit.data array, and (key, value) pairs for the other
+    attributes of the PC_AssaySubmit object, such as 'assay'
+    :param f: bioassay json file opened in binary mode
+    """
+    import ijson
+    from ijson.common import ObjectBuilder
+    starts, ends = ('start_map', 'start_array'), ('end_map', 'end_array')
+    builder, key, depth = None, None, 0
+    for prefix, event, value in ijson.parse(f, use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if event in starts:
+                depth += 1
+            elif event in ends:
+                depth -= 1
+                if depth == 0:
+                    yield key, builder.value
+                    builder = None
+            continue
+        if prefix == 'PC_AssaySubmit.data.item':
+            key = 'data'
+        elif prefix.startswith('PC_AssaySubmit.') and \
+                prefix.count('.') == 1 and prefix != 'PC_AssaySubmit.data':
+            key = prefix[len('PC_AssaySubmit.'):]
+        else:
+            continue
+        if event in starts:
+            builder, depth = ObjectBuilder(), 1
+            builder.event(event, value)
+        elif event not in ends:
+            yield key, value
 
 
 # Return given date in format YY-MM-DD
@@ -100,82 +118,84 @@ def update_date(date):
     return d
 
 
-def update_dates(doc):
-    for data in doc["PC_AssaySubmit"]["data"]:
-        date = data["date"]
-        d = update_date(date)
-        data["date"] = d
-    db = doc["PC_AssaySubmit"]["assay"]["descr"]["aid_source"]["db"]
+def update_assay_dates(assay):
+    db = assay["descr"]["aid_source"]["db"]
     if "date" in db:
-        d = update_date(db["date"])
-        doc["PC_AssaySubmit"]["assay"]["descr"]["aid_source"]["db"]["date"] = d
-    return
-
-
-def index_bioassay(es, f, r, aid_, indexf):
-    doc = json.load(f)
-    if f.tell() < MaxEntrySize:
-        update_dates(doc)
-        aid = doc['PC_AssaySubmit']['assay']['descr']['aid']['id']
-        if str(aid) != aid_:
-            print("File name and assay ids not same, please check '%s' vs '%s'"
-                  % (aid, aid_))
-            return r
-        r = indexf(es, f, r, aid_, doc)
-    else:
-        print("Large entry:  aid=%s  filesize=%d  max-entry-size=%d" %
-              (aid_, f.tell(), MaxEntrySize))
-    return r
-
-
-def es_index_bioassay(dbc, f, r, aid, doc):
-    try:
-        if r > 0 and (r + f.tell() > MaxBulkSize):
-            print("r", end='', file=sys.stdout)
-            sys.stdout.flush()
-            # refresh/commit to avoid Elasticsearch out-of-memory errors
-            dbc.es.indices.refresh(index=args.index)
-            dbc.es.indices.clear_cache(index=args.index)
-            r = 0
-        print(".", end='', file=sys.stdout)
-        sys.stdout.flush()
-        docx = doc['PC_AssaySubmit']
-        dbc.es.index(index=dbc.index, doc_type=DOCTYPE,
-                     id=aid, body=docx)
-        r += f.tell()
-    except Exception as e:
-        print(e)
-    return r
-
-
-def mongodb_index_bioassay(dbc, f, r, aid, doc):
-    try:
-        if r > 0 and (r + f.tell() > MaxBulkSize):
-            print("r", end='', file=sys.stdout)
-            sys.stdout.flush()
-            r = 0
+        db["date"] = update_date(db["date"])
+
+
+class Indexer(DBconnection):
+    """ Index bioassay descriptions and data rows as separate documents
+
+    Bioassay documents, PC_AssaySubmit objects without the 'data' array,
+    are indexed with bioassay ids, in DOCTYPE collection for MongoDB.
+    Data rows are indexed with '<aid>-<sid>' ids and with 'aid' attribute
+    linking them to their bioassays, in DATA_DOCTYPE collection for MongoDB
+    or in '<index>-bioassaydata' index for Elasticsearch
+    """
+
+    def __init__(self, db, index, host=None, port=None):
+        if db == 'Elasticsearch':
+            d = os.path.dirname(os.path.abspath(__file__))
+            cfg = json.load(open(d + "/../../mappings/pubchem-bioassays.json",
+                                 "r"))
+            mappings = cfg["mappings"]
+            datamappings = mappings[DOCTYPE]["properties"].pop("data")
+            super(Indexer, self).__init__(db, index, host, port,
+                                          recreateindex=True,
+                                          es_indexmappings=mappings)
+            dataindex = index + '-' + DATA_DOCTYPE
+            if self.es.indices.exists(index=dataindex):
+                self.es.indices.delete(index=dataindex)
+            self.es.indices.create(index=dataindex, body={
+                "settings": {"index.number_of_replicas": 0,
+                             "index.refresh_interval": "30s"},
+                "mappings": {DATA_DOCTYPE: datamappings}})
+            self.assays = self.bulkwriter(doctype=DOCTYPE, chunksize=40)
+            self.data = self.bulkwriter(index=dataindex, doctype=DATA_DOCTYPE)
+        else:
+            super(Indexer, self).__init__(db, index, host, port)
+            self.assays = self.bulkwriter(collection=DOCTYPE, chunksize=40)
+            self.data = self.bulkwriter(collection=DATA_DOCTYPE)
+
+    def index_bioassay(self, f, aid_):
+        try:
+            aid = int(aid_)
+        except ValueError:  # such as folder entries of the zip files
+            print("Skipping '%s': file name is not a bioassay id" % aid_)
+            return
+        assay = {}
+        for key, value in iter_bioassay(f):
+            if key == 'data':
+                if "date" in value:
+                    value["date"] = update_date(value["date"])
+                value['aid'] = aid
+                self.data.add(value, docid="%d-%d" % (aid, value['sid']))
+                continue
+            if key == 'assay':
+                if value['descr']['aid']['id'] != aid:
+                    print("File name and assay ids not same,"
+                          " please check '%s' vs '%s'"
+                          % (value['descr']['aid']['id'], aid_))
+                    return
+                update_assay_dates(value)
+            assay[key] = value
+        self.assays.add(assay, docid=aid)
         print(".", end='', file=sys.stdout)
         sys.stdout.flush()
-        docx = doc['PC_AssaySubmit']
-        dbc.mdbi[DOCTYPE].update({"_id": aid}, docx, upsert=True)
-        r += f.tell()
-    except Exception as e:
-        print(e)
-    return r
 
 
 def main(db, infile, index=INDEX, host=None, port=None):
+    indxr = Indexer(db, index, host, port)
+    read_and_index_pubchem_bioassays(infile, indxr)
+    indxr.assays.close()
+    indxr.data.close()
     if db == 'Elasticsearch':
-        d = os.path.dirname(os.path.abspath(__file__))
-        cfg = json.load(open(d + "/../../mappings/pubchem-bioassays.json", "r"))
-        dbc = DBconnection(db, index, host, port, recreateindex=True,
-                           es_indexmappings=cfg["mappings"])
-        read_and_index_pubchem_bioassays(infile, dbc, es_index_bioassay)
-        dbc.es.indices.refresh(index=index)
+        indxr.es.indices.refresh(index=index)
+        indxr.es.indices.refresh(index=index + '-' + DATA_DOCTYPE)
     else:
-        dbc = DBconnection(db, index, host, port)
-        read_and_index_pubchem_bioassays(infile, dbc,
-                                         mongodb_index_bioassay)
+        indxr.mdbi[DATA_DOCTYPE].create_index("aid")
+        indxr.mdbi[DATA_DOCTYPE].create_index("sid")
 
 
 if __name__ == '__main__':
@@ -6,35 +6,40 @@ import gzip
 import os
 import tarfile
 import time
-from multiprocessing.pool import ThreadPool
 
 import pubmed_parser as pp
 
+from nosqlbiosets.checkpoint import Checkpoint, checkpointargs, \
+    CHECKPOINT_DB, CHECKPOINT_INTERVAL
 from nosqlbiosets.dbutils import DBconnection, dbargs
 from nosqlbiosets.objutils import num
+from nosqlbiosets.pipeline import Pipeline
 
 SOURCEURL = "ftp://ftp.ncbi.nlm.nih.gov/pub/pmc/oa_bulk/*.xml.tar.gz"
 d = os.path.dirname(os.path.abspath(__file__))
 
-pool = ThreadPool(14)  # Threads for parser/index calls
+THREADS = 14  # Threads for parser/index calls
 MAX_QUEUED_JOBS = 140  # Maximum number of jobs in queue
 
 
 # Read PMC article xml files;
 # If the input file is a folder iterate over files in the folder
-def read_and_index_pmc_articles(infile, dbc):
+# If checkpoint is set, files and tar file members indexed before are skipped
+# If pipeline is set, tar file members are parsed and indexed in its threads
+def read_and_index_pmc_articles(infile, dbc, checkpoint=None, pipeline=None):
     n = 0
     t1 = time.time()
     if os.path.isdir(infile):
         for child in os.listdir(infile):
             c = os.path.join(infile, child)
-            read_and_index_pmc_articles(c, dbc)
+            read_and_index_pmc_articles(c, dbc, checkpoint, pipeline)
             n += 1
     else:
         if infile.endswith(".tar") or infile.endswith(".tar.gz"):
-            n = read_and_index_pmc_articles_tarfile(infile, dbc)
+            n = read_and_index_pmc_articles_tarfile(infile, dbc, checkpoint,
+                                                    pipeline)
         else:
-            read_and_index_pmc_articles_file(infile, dbc)
+            read_and_index_pmc_articles_file(infile, dbc, checkpoint)
             n = 1
     t2 = time.time()
     print("-- %d files have been processed, in %dms"
@@ -76,30 +81,55 @@ def parse_index(xml, dbc):
 
 
 # Read given PMC tar file
-def read_and_index_pmc_articles_tarfile(infile, dbc):
-    import gc
+def read_and_index_pmc_articles_tarfile(infile, dbc, checkpoint=None,
+                                        pipeline=None):
+    if checkpoint is not None and checkpoint.completed(infile):
+        print("%s has been indexed before, skipping" % infile)
+        return 0
+    offset = 0 if checkpoint is None else checkpoint.offset(infile)
     print("\nProcessing tar file: %s " % infile)
+    if offset > 0:
+        print("Skipping the first %d articles, indexed before" % offset)
     i = 0
     tar = tarfile.open(infile, 'r%s' % ':gz' if infile.endswith('.gz') else ':')
     for member in tar:
         f = tar.extractfile(member)
         if f is None:
             continue  # if the tar-file entry is folder then skip
-        xml = f.read()
-        pool.apply_async(parse_index, (xml, dbc))
-        del xml
+        i += 1
+        if i <= offset:
+            f.close()
+            tar.members = []
+            continue
+        if pipeline is None:
+            parse_index(f.read(), dbc)
+        else:
+            pipeline.submit(parse_index, f.read(), dbc)
         f.close()
         tar.members = []
-        r = gc.collect()
-        if r > 0:
-            print(r)
-        i += 1
+        if checkpoint is not None and i % CHECKPOINT_INTERVAL == 0:
+            savecheckpoint(checkpoint, pipeline, infile, i)
+    if checkpoint is not None:
+        savecheckpoint(checkpoint, pipeline, infile, i, completed=True)
     return i
 
 
+# Wait for the pending index calls, then save number of articles indexed,
+# if no index calls failed
+def savecheckpoint(checkpoint, pipeline, infile, i, completed=False):
+    nfailed = 0
+    if pipeline is not None:
+        pipeline.wait()
+        nfailed = pipeline.nfailed
+    checkpoint.commit(infile, i, nfailed, completed)
+
+
 # Read PMC articles file, index
-def read_and_index_pmc_articles_file(infile_, dbc):
+def read_and_index_pmc_articles_file(infile_, dbc, checkpoint=None):
     infile = str(infile_)
+    if checkpoint is not None and checkpoint.completed(infile):
+        print("%s has been indexed before, skipping" % infile)
+        return
     print("Reading %s " % infile)
     if infile.endswith(".gz"):
         f = gzip.open(infile, 'rb')
@@ -107,6 +137,8 @@ def read_and_index_pmc_articles_file(infile_, dbc):
         f = open(infile, 'rb')
     ba = pubmed_parser(f)
     index_article(dbc, ba)
+    if checkpoint is not None:
+        checkpoint.save(infile, 1, completed=True)
 
 
 def index_article(dbc, ar):
@@ -123,15 +155,18 @@ def index_article(dbc, ar):
     del ar
 
 
-def main(infile, db, index, **kwargs):
+def main(infile, db, index, resume=False, checkpointdb=CHECKPOINT_DB,
+         **kwargs):
     esindxcfg = {  # Elasticsearch index configuration
         "index.number_of_replicas": 0,
         "index.number_of_shards": 5}
     dbc = DBconnection(db, index, es_indexsettings=esindxcfg, **kwargs)
-    read_and_index_pmc_articles(infile, dbc)
-    pool.close()
-    pool.join()
-    pool.terminate()
+    checkpoint = Checkpoint("pmc:%s:%s" % (db, index), checkpointdb, resume)
+    pipeline = Pipeline(THREADS, MAX_QUEUED_JOBS, 'pmc')
+    read_and_index_pmc_articles(infile, dbc, checkpoint, pipeline)
+    pipeline.close()
+    pipeline.report()
+    checkpoint.close()
     dbc.close()
 
 
@@ -145,5 +180,7 @@ if __name__ == '__main__':
                            ' such as Biotechnol_Lett/PMC6828833.nxml'
                            ' or input folder with the XML document files')
     dbargs(args)
+    checkpointargs(args)
     args = args.parse_args()
-    main(args.infile, args.dbtype, args.esindex, host=args.host, port=args.port)
+    main(args.infile, args.dbtype, args.esindex, resume=args.resume,
+         checkpointdb=args.checkpointdb, host=args.host, port=args.port)
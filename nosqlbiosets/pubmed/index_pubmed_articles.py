@@ -5,20 +5,73 @@ import datetime
 import gzip
 import os
 import time
+from collections import deque
+from multiprocessing import Pool
 
 import pubmed_parser as pp
 from elasticsearch.helpers import parallel_bulk
+from pymongo.errors import BulkWriteError
+from nosqlbiosets.checkpoint import Checkpoint, checkpointargs, \
+    CHECKPOINT_DB, CHECKPOINT_INTERVAL
 from nosqlbiosets.dbutils import DBconnection, dbargs
 from nosqlbiosets.objutils import num
-from nosqlbiosets.pubmed.query import QueryPubMed
+from nosqlbiosets.pubmed.query import QueryPubMed, filechecksum, \
+    publishedchecksum
 
 SOURCEURL = "ftp://ftp.ncbi.nlm.nih.gov/pubmed/baseline/"
+DUPLICATE_KEY = 11000  # MongoDB error code for duplicate _id values
 d = os.path.dirname(os.path.abspath(__file__))
 
 
+# Read PubMed articles xml file, returns the articles
+# and PMIDs of the deleted citations
+def read_articles(infile):
+    print("Reading %s " % infile)
+    if infile.endswith(".xml.gz"):
+        f = gzip.open(infile, 'rb')
+    else:
+        f = open(infile, 'rb')
+    articles = pp.parse_medline_xml(f)
+    f.close()
+    listattrs = ['authors', 'mesh_terms', 'publication_types',
+                 'chemical_list', 'keywords', 'references', 'affiliations'
+                 ]
+    deletedrecords, deletedpmids = list(), list()
+    for i, ar in enumerate(articles):
+        if ar['delete']:
+            # DeleteCitation entries at the end of the xml archive files
+            # are parsed to an object with field values set to float NaN
+            deletedrecords.append(i)
+            deletedpmids.append(ar['pmid'])
+            continue
+        try:
+            num(ar, 'pmc')
+        except ValueError:
+            ar['pmc'] = 2000
+        ar['_id'] = num(ar, 'pmid')
+        try:
+            ar['pubdate'] = datetime.datetime(int(ar['pubdate']), 1, 1)
+        except ValueError:
+            print(ar['pubdate'])
+            ar['pubdate'] = datetime.datetime(2000, 1, 1)
+        for listattr in listattrs:
+            if len(ar[listattr]) == 0:
+                del ar[listattr]
+            else:
+                spr = ';' if listattr in ['authors', 'references'] else '; '
+                ar[listattr] = ar[listattr].split(spr)
+    for i in reversed(deletedrecords):
+        del articles[i]
+    return articles, deletedpmids
+
+
+# Completed files are recorded in the ingest manifest, see query.py;
+# with the --resume option articles of partially indexed files
+# are skipped up to the offsets saved in the checkpoint journal
 class IndexPubMedArticles(DBconnection):
 
-    def __init__(self, db, index, **kwargs):
+    def __init__(self, db, index, resume=False, checkpointdb=CHECKPOINT_DB,
+                 **kwargs):
         esindxcfg = {  # Elasticsearch index configuration
             "index.number_of_replicas": 0,
             "index.number_of_shards": 14}
@@ -28,74 +81,97 @@ class IndexPubMedArticles(DBconnection):
         self.qry = QueryPubMed(db, index, **kwargs)
         if 'mdbcollection' in kwargs:
             self.mdbcollection = kwargs['mdbcollection']
+        self.checkpoint = Checkpoint("pubmed:%s:%s:%s" % (
+            db, index, kwargs.get('mdbcollection')), checkpointdb, resume)
+        self.nfailed = 0  # number of articles failed to be indexed
 
     # If the input file is a folder iterate over files in the folder
-    def read_and_index_articles(self, infile):
-        n = 0
+    # If workers is set files are parsed in a pool of worker processes
+    def read_and_index_articles(self, infile, workers=None):
         t1 = time.time()
         if os.path.isdir(infile):
-            for child in sorted(os.listdir(infile)):
-                c = os.path.join(infile, child)
-                self.read_and_index_articles_file(c)
-                n += 1
+            infiles = [os.path.join(infile, child)
+                       for child in sorted(os.listdir(infile))]
+        else:
+            infiles = [str(infile)]
+        if workers is None:
+            for infile_ in infiles:
+                self.read_and_index_articles_file(infile_)
         else:
-            self.read_and_index_articles_file(infile)
-            n = 1
+            self.read_and_index_articles_files(infiles, workers)
         t2 = time.time()
         print("-- %d files have been processed, in %ds"
-              % (n, (t2 - t1)))
+              % (len(infiles), (t2 - t1)))
+
+    # Returns checksum of the input file if it should be indexed,
+    # None if it is not a PubMed xml file or it has been indexed before.
+    # Files with the recorded sizes and modification times are skipped
+    # without reading them, checksums published in NCBI's .md5 files
+    # are used if available, otherwise checksums are calculated
+    def checkinputfile(self, infile):
+        if not infile.endswith(".xml.gz") and not infile.endswith(".xml"):
+            print("Ignoring '%s': filename does not end with '.xml' or '.xml.gz'"
+                  % infile)
+            return None
+        manifest = self.qry.getfilemanifest(infile)
+        if self.qry.isfileunchanged(manifest, infile):
+            print("%s has been indexed before, skipping" % infile)
+            return None
+        checksum = publishedchecksum(infile) or filechecksum(infile)
+        if manifest is not None and manifest['checksum'] == checksum:
+            print("%s has been indexed before, skipping" % infile)
+            return None
+        return checksum
 
     def read_and_index_articles_file(self, infile_):
         infile = str(infile_)
-        print("Reading %s " % infile)
-        if infile.endswith(".xml.gz"):
-            f = gzip.open(infile, 'rb')
-        elif infile.endswith(".xml"):
-            f = open(infile, 'rb')
+        checksum = self.checkinputfile(infile)
+        if checksum is not None:
+            articles, deletedpmids = read_articles(infile)
+            self.index_articles(infile, checksum, articles, deletedpmids)
+
+    # Parse files in worker processes, index parsed articles in the main
+    # process in the order of the input files, so that the citations
+    # deleted in update files are deleted in sequence
+    def read_and_index_articles_files(self, infiles, workers):
+        pool = Pool(workers)
+        pending = deque()  # parsed or being parsed files
+
+        def index_next():
+            infile_, checksum_, result = pending.popleft()
+            self.index_articles(infile_, checksum_, *result.get())
+        try:
+            for infile in infiles:
+                checksum = self.checkinputfile(infile)
+                if checksum is None:
+                    continue
+                pending.append((infile, checksum,
+                                pool.apply_async(read_articles, (infile,))))
+                if len(pending) > workers:
+                    index_next()
+            while len(pending) > 0:
+                index_next()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def index_articles(self, infile, checksum, articles, deletedpmids):
+        offset = self.checkpoint.offset(infile)
+        if offset == 0:
+            self.qry.deletepubmedids(deletedpmids)
         else:
-            print("Ignoring '%s': filename does not end with '.xml' or '.xml.gz'"
-                  % infile)
-            return
-        articles = pp.parse_medline_xml(f)
-        listattrs = ['authors', 'mesh_terms', 'publication_types',
-                     'chemical_list', 'keywords', 'references', 'affiliations'
-                     ]
-        ids = set()
-        deletedrecords, deletedpmids = list(), list()
-        for i, ar in enumerate(articles):
-            if ar['delete']:
-                # DeleteCitation entries at the end of the xml archive files
-                # are parsed to an object with field values set to float NaN
-                deletedrecords.append(i)
-                deletedpmids.append(ar['pmid'])
-                continue
-            try:
-                num(ar, 'pmc')
-            except ValueError:
-                ar['pmc'] = 2000
-            ar['_id'] = num(ar, 'pmid')
-            ids.add(ar['_id'])
-            try:
-                ar['pubdate'] = datetime.datetime(int(ar['pubdate']), 1, 1)
-            except ValueError:
-                print(ar['pubdate'])
-                ar['pubdate'] = datetime.datetime(2000, 1, 1)
-            for listattr in listattrs:
-                if len(ar[listattr]) == 0:
-                    del ar[listattr]
-                else:
-                    spr = ';' if listattr in ['authors', 'references'] else '; '
-                    ar[listattr] = ar[listattr].split(spr)
-        for i in reversed(deletedrecords):
-            del articles[i]
-        self.qry.deletepubmedids(deletedpmids)
-        if self.db == "Elasticsearch":
-            if not self.qry.checkpubmedidsindexed(list(ids)):
-                self.es_index(articles)
-            else:
-                print("Records in %s looks have been indexed, skipping" % infile)
-        else:  # assume MongoDB
-            self.mdb_index(articles)
+            print("Resuming %s after the first %d articles" % (infile, offset))
+        for i in range(offset, len(articles), CHECKPOINT_INTERVAL):
+            chunk = articles[i:i + CHECKPOINT_INTERVAL]
+            if self.db == "Elasticsearch":
+                self.es_index(chunk)
+            else:  # assume MongoDB
+                self.mdb_index(chunk)
+            self.checkpoint.commit(infile, i + len(chunk), self.nfailed)
+        self.qry.savefilemanifest(infile, checksum, len(articles),
+                                  len(deletedpmids))
+        self.checkpoint.commit(infile, len(articles), self.nfailed,
+                               completed=True)
 
     def es_index(self, articles):
         for ok, result in parallel_bulk(
@@ -104,21 +180,35 @@ class IndexPubMedArticles(DBconnection):
                 index=self.index, chunk_size=140
         ):
             if not ok:
+                self.nfailed += 1
                 action, result = result.popitem()
                 doc_id = '/%s/commits/%s' % (self.index, result['_id'])
-                print('Failed to %s document %s: %r' % (action, doc_id, 'result'))
+                print('Failed to %s document %s: %r' % (action, doc_id, result))
 
     def mdb_index(self, ar):
         try:
-            self.mdbi[self.mdbcollection].insert_many(ar)
+            # unordered, so that articles of partially indexed files
+            # do not stop indexing of the remaining articles
+            self.mdbi[self.mdbcollection].insert_many(ar, ordered=False)
+        except BulkWriteError as e:
+            # articles indexed before an interruption are not failures
+            errors = [err for err in e.details['writeErrors']
+                      if err['code'] != DUPLICATE_KEY]
+            self.nfailed += len(errors)
+            if errors:
+                print("***** ERROR: %s" % errors[0]['errmsg'])
         except Exception as e:
+            self.nfailed += len(ar)
             print("***** ERROR: %s" % e)
 
 
-def main(infile, db, index, **kwargs):
+def main(infile, db, index, workers=None, **kwargs):
     dbc = IndexPubMedArticles(db, index, **kwargs)
-    dbc.read_and_index_articles(infile)
-    dbc.close()
+    try:
+        dbc.read_and_index_articles(infile, workers)
+    finally:
+        dbc.checkpoint.close()
+        dbc.close()
 
 
 if __name__ == '__main__':
@@ -129,8 +219,13 @@ if __name__ == '__main__':
                       help='PubmedArticleSet XML document file,'
                            ' such as pubmed20n0124.xml.gz'
                            ' or input folder with the XML document files')
+    args.add_argument('--workers', type=int,
+                      help='Number of processes for parsing the XML files,'
+                           ' by default files are parsed in the main process')
     dbargs(args)
+    checkpointargs(args)
     args = args.parse_args()
-    main(args.infile, args.dbtype, args.esindex,
+    main(args.infile, args.dbtype, args.esindex, args.workers,
          mdbcollection=args.mdbcollection,
-         host=args.host, port=args.port)
+         host=args.host, port=args.port,
+         resume=args.resume, checkpointdb=args.checkpointdb)
@@ -1,23 +1,92 @@
 """ Queries with PubMed data indexed with Elasticsearch """
+import datetime
+import hashlib
+import os
+
+from elasticsearch.exceptions import NotFoundError
 
 from nosqlbiosets.qryutils import Query
 
+# Suffix for the name of the index or collection where the names,
+# checksums and record counts of the indexed files are saved
+MANIFEST_SUFFIX = '_ingestmanifest'
+
+
+# MD5 checksum of the input file, same as NCBI's .md5 files
+def filechecksum(infile):
+    md5 = hashlib.md5()
+    with open(infile, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+# Checksum published by NCBI in the .md5 file of the input file,
+# 'MD5(pubmed21n0001.xml.gz)= <checksum>', None if there is no .md5 file
+def publishedchecksum(infile):
+    md5file = infile + '.md5'
+    if not os.path.exists(md5file):
+        return None
+    with open(md5file) as f:
+        return f.read().rsplit('=', 1)[-1].strip() or None
+
+
+# Size and modification time of the input file
+def filestat(infile):
+    st = os.stat(infile)
+    return st.st_size, st.st_mtime
+
 
 class QueryPubMed(Query):
 
-    # Check whether ids have already been indexed
-    def checkpubmedidsindexed(self, ids):
+    # Name of the index or collection that ingested files are recorded
+    def manifestname(self):
         if self.dbc.db == 'Elasticsearch':
-            qry = {
-                "query": {"ids": {"values": ids}}
-            }
-            r = self.count(qry)
-            # 200 is an arbitrary number
-            # that represents the maximum number of entries that could have been
-            # deleted with the later update files,    need to be improved
-            return r >= len(ids)-200
+            return self.dbc.index + MANIFEST_SUFFIX
+        else:
+            return self.mdbcollection + MANIFEST_SUFFIX
+
+    # Return manifest record of the input file, None if it was not indexed
+    def getfilemanifest(self, infile):
+        fname = os.path.basename(infile)
+        if self.dbc.db == 'Elasticsearch':
+            try:
+                r = self.dbc.es.get(index=self.manifestname(), id=fname)
+            except NotFoundError:
+                return None
+            return r['_source']
+        else:
+            return self.dbc.mdbi[self.manifestname()].find_one({"_id": fname})
+
+    # Check whether the input file, with given checksum, has been indexed
+    def isfileindexed(self, infile, checksum):
+        r = self.getfilemanifest(infile)
+        return r is not None and r['checksum'] == checksum
+
+    # Check whether the input file has been indexed and its size and
+    # modification time are the same as the recorded ones
+    @staticmethod
+    def isfileunchanged(manifest, infile):
+        return manifest is not None and \
+            (manifest.get('size'), manifest.get('mtime')) == filestat(infile)
+
+    # Record that the input file has been indexed completely
+    def savefilemanifest(self, infile, checksum, nrecords, ndeleted=0):
+        fname = os.path.basename(infile)
+        doc = {
+            "file": fname,
+            "checksum": checksum,
+            "records": nrecords,
+            "deleted": ndeleted,
+            "completed": datetime.datetime.now()
+        }
+        if os.path.exists(infile):
+            doc["size"], doc["mtime"] = filestat(infile)
+        if self.dbc.db == 'Elasticsearch':
+            self.dbc.es.index(index=self.manifestname(), id=fname, body=doc)
         else:
-            return False
+            self.dbc.mdbi[self.manifestname()].replace_one(
+                {"_id": fname}, doc, upsert=True)
 
     # Delete PubMed records that have been marked as deleted
     def deletepubmedids(self, ids):
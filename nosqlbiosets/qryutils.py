@@ -1,6 +1,17 @@
 import json
+import threading
+import time
+
+from elasticsearch.exceptions import RequestError
+from elasticsearch.helpers import scan
 
 from nosqlbiosets.dbutils import DBconnection
+from nosqlbiosets.xrefs import hasxrefs, resolve_xrefs
+
+VERSION_CHECK_INTERVAL = 60  # Seconds between reading the dataset versions
+BATCH_SIZE = 1000  # Number of documents read in each request by iterquery()
+PIT_KEEP_ALIVE = '2m'  # Elasticsearch point in time kept between requests
+_MISSING = object()
 
 
 def parseinputquery(query):
@@ -22,14 +33,120 @@ def parseinputquery(query):
     return qc
 
 
+def readversion(obj, dbc, name, t, refresh=False):
+    """ Version stamp of the dataset, read from the database if obj, with
+        version and tversion attributes, was not checked in the last
+        VERSION_CHECK_INTERVAL seconds, or if refresh is set;
+        otherwise obj.version """
+    if refresh or t - obj.tversion > VERSION_CHECK_INTERVAL:
+        obj.tversion = t
+        return dbc.getversion(name)
+    return obj.version
+
+
+class DatasetObjects(object):
+    """ Objects built from the datasets, such as in-memory networks,
+        shared by the query objects; built once for each version of the
+        datasets, with a lock for each database and dataset, so that
+        objects of the other datasets are available while one is built """
+
+    def __init__(self):
+        self.objects = {}  # (database id, dataset name) -> object
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def get(self, dbc, name, build, refresh=False):
+        """ Return object of the dataset, build(version) is called if it
+            was not built before for the current version of the dataset,
+            or if refresh is set; built objects are given the version
+            and tversion attributes """
+        key = dbc.dbid(), name
+        with self.lock:
+            keylock = self.locks.setdefault(key, threading.Lock())
+        with keylock:
+            obj = self.objects.get(key)
+            t = time.time()
+            if obj is None:
+                version = dbc.getversion(name)
+            else:
+                version = readversion(obj, dbc, name, t, refresh)
+            if refresh or obj is None or obj.version != version:
+                obj = build(version)
+                obj.version, obj.tversion = version, t
+                with self.lock:
+                    self.objects[key] = obj
+        return obj
+
+
+# Elasticsearch _source parameter for the MongoDB projection,
+# given as a list of fields or as a dict of fields with 1 or 0 values
+def _essource(projection):
+    if isinstance(projection, dict):
+        includes = [k for k, v in projection.items() if v]
+        excludes = [k for k, v in projection.items() if not v]
+        if excludes:
+            return {"includes": includes, "excludes": excludes}
+        return includes
+    return list(projection)
+
+
+# Base class of the query classes; with the SQLite option MongoDB queries
+# are run with the collections of SQLite database files, see sqlitedb.py
+# If a QueryCache is given, results of query(), distinct() and
+# aggregate_query() calls are cached, cursors are read to lists
 class Query:
 
-    def __init__(self, dbtype, index, mdbcollection, **kwargs):
+    def __init__(self, dbtype, index, mdbcollection, cache=None, **kwargs):
         self.index = index
         self.mdbcollection = mdbcollection
         self.dbc = DBconnection(dbtype, self.index, **kwargs)
+        self.cache = cache
+        self.version = None
+        self.tversion = 0  # last time the dataset version was read
+        self.xrefs = None  # whether xref rows of the dataset were saved
+
+    def datasetname(self):
+        return self.index if self.dbc.db == 'Elasticsearch' \
+            else self.mdbcollection
+
+    def datasetversion(self):
+        """ Version stamp of the dataset, saved when it was indexed """
+        self.version = readversion(self, self.dbc, self.datasetname(),
+                                   time.time())
+        return self.version
+
+    def resolve_xrefs(self, ids, from_lib, to_lib=None):
+        """ Given ids in library from_lib, return their ids in library
+            to_lib, by default ids of the entries of this dataset, read from
+            the xref lookup table; None if the xref rows were not saved """
+        if self.xrefs is None:
+            self.xrefs = hasxrefs(self.dbc, self.datasetname())
+        if not self.xrefs:
+            return None
+        if to_lib is None:
+            to_lib = self.datasetname()
+        return resolve_xrefs(self.dbc, ids, from_lib, to_lib)
+
+    def cached(self, func, *args, **kwargs):
+        """ Return cached result of the func call if there is one,
+            otherwise call the function and save its result in the cache """
+        if self.cache is None:
+            return func(*args, **kwargs)
+        key = self.cache.key(self.dbc.db, self.index, self.mdbcollection,
+                             self.datasetversion(), func.__name__,
+                             args, kwargs)
+        r = self.cache.get(key, _MISSING)
+        if r is _MISSING:
+            r = func(*args, **kwargs)
+            if not isinstance(r, (dict, list)):  # database cursors
+                r = list(r)
+            self.cache.set(key, r)
+        return r
 
     def query(self, qc, projection=None, limit=0):
+        return self.cached(self._query, qc, projection, limit)
+
+    def _query(self, qc, projection=None, limit=0):
         if self.dbc.db == 'Elasticsearch':
             c = self.dbc.es.search(index=self.index, body=qc, size=limit)
         else:
@@ -38,6 +155,62 @@ class Query:
                                                        limit=limit)
         return c
 
+    def iterquery(self, qc, projection=None, batchsize=BATCH_SIZE):
+        """ Iterate all documents matching the query, reading them
+            in batches, for result sets of any size
+
+        Elasticsearch: qc is a search request body, results are read
+          with point in time and search_after requests, hits are yielded;
+          the scroll API is used with servers or clients not supporting
+          point in time; projection is sent as the _source parameter
+        MongoDB: documents are read from the cursor in batches of batchsize
+        """
+        if self.dbc.db == 'Elasticsearch':
+            if projection is not None:
+                qc = dict(qc, _source=_essource(projection))
+            return self._iteresquery(self.index, qc, batchsize)
+        kwargs = {'batch_size': batchsize} if self.dbc.db == 'MongoDB' else {}
+        return self.dbc.mdbi[self.mdbcollection].find(qc,
+                                                      projection=projection,
+                                                      **kwargs)
+
+    def _iteresquery(self, index, qc, batchsize):
+        es = self.dbc.es
+        pit = None
+        if hasattr(es, 'open_point_in_time'):  # not in clients before 7.10
+            try:
+                pit = es.open_point_in_time(index=index,
+                                            keep_alive=PIT_KEEP_ALIVE)['id']
+            except RequestError:  # servers older than 7.10
+                pass
+        if pit is None:
+            for hit in scan(es, query=qc, index=index, size=batchsize):
+                yield hit
+            return
+        body = dict(qc)
+        body.pop('from', None)
+        body['size'] = batchsize
+        # _shard_doc is the tiebreaker for the hits with equal sort values
+        sort = body.get('sort', [])
+        sort = list(sort) if isinstance(sort, list) else [sort]
+        if not any(s == '_shard_doc' or isinstance(s, dict) and
+                   '_shard_doc' in s for s in sort):
+            sort.append({'_shard_doc': 'asc'})
+        body['sort'] = sort
+        try:
+            while True:
+                body['pit'] = {'id': pit, 'keep_alive': PIT_KEEP_ALIVE}
+                r = es.search(body=body)
+                hits = r['hits']['hits']
+                for hit in hits:
+                    yield hit
+                if len(hits) < batchsize:
+                    break
+                pit = r.get('pit_id', pit)
+                body['search_after'] = hits[-1]['sort']
+        finally:
+            es.close_point_in_time(body={'id': pit})
+
     def count(self, qc, **kwargs):
         if self.dbc.db == 'Elasticsearch':
             n = self.dbc.es.count(index=self.dbc.index, body=qc)['count']
@@ -46,10 +219,16 @@ class Query:
         return n
 
     def distinct(self, key, qc=None):
+        return self.cached(self._distinct, key, qc)
+
+    def _distinct(self, key, qc=None):
         r = self.dbc.mdbi[self.mdbcollection].distinct(key, filter=qc)
         return r
 
     def aggregate_query(self, agpl, **kwargs):
+        return self.cached(self._aggregate_query, agpl, **kwargs)
+
+    def _aggregate_query(self, agpl, **kwargs):
         r = self.dbc.mdbi[self.mdbcollection].aggregate(agpl, **kwargs)
         return r
 
@@ -0,0 +1,101 @@
+""" Cache of query results, with LRU and time-to-live eviction
+
+ Query objects created with a QueryCache save results of their query(),
+ distinct() and aggregate_query() calls in the cache, with keys made of
+ the database, collection, dataset version, method name and the query
+ arguments. Dataset versions are saved in the databases when indexing
+ jobs complete writing documents, cached results of the earlier
+ versions are not used once a dataset is reindexed.
+ Results can also be saved in a SQLite database file, shared by
+ processes and kept between runs, in addition to the in-process cache.
+"""
+import json
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_SIZE = 256  # Maximum number of results in the in-process cache
+CACHE_TTL = 3600  # Seconds cached results are used
+
+
+class QueryCache(object):
+    """ In-process LRU cache of query results, with optional SQLite file
+
+    Results are evicted when they are older than `ttl` seconds, and the
+    least recently used results are evicted when there are more than
+    `maxsize` results in the in-process cache.
+    Cached results are shared by the callers, they should not be modified.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL, dbfile=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.results = OrderedDict()  # key -> (time saved, result)
+        self.hits = 0
+        self.misses = 0
+        self.conn = None
+        if dbfile is not None:
+            self.conn = sqlite3.connect(dbfile, check_same_thread=False)
+            with self.conn:
+                self.conn.execute("CREATE TABLE IF NOT EXISTS results ("
+                                  " key TEXT PRIMARY KEY, result BLOB,"
+                                  " saved REAL)")
+                self.conn.execute("DELETE FROM results WHERE saved < ?",
+                                  (time.time() - ttl,))
+
+    @staticmethod
+    def key(*args):
+        """ Cache key for the arguments; key order of the query clauses
+            is kept, it is significant in $sort and $group stages """
+        return json.dumps(args, default=str, separators=(',', ':'))
+
+    def get(self, key, default=None):
+        t = time.time()
+        with self.lock:
+            r = self.results.get(key)
+            if r is not None and t - r[0] < self.ttl:
+                self.results[key] = self.results.pop(key)  # most recent
+                self.hits += 1
+                return r[1]
+            if self.conn is not None:
+                row = self.conn.execute(
+                    "SELECT result, saved FROM results WHERE key = ?",
+                    (key,)).fetchone()
+                if row is not None and t - row[1] < self.ttl:
+                    result = pickle.loads(row[0])
+                    self._save(key, row[1], result)
+                    self.hits += 1
+                    return result
+            self.misses += 1
+            return default
+
+    def set(self, key, result):
+        t = time.time()
+        with self.lock:
+            self._save(key, t, result)
+            if self.conn is not None:
+                with self.conn:
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                        (key, pickle.dumps(result, pickle.HIGHEST_PROTOCOL),
+                         t))
+
+    def _save(self, key, t, result):
+        self.results.pop(key, None)
+        self.results[key] = (t, result)
+        while len(self.results) > self.maxsize:
+            self.results.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.results.clear()
+            if self.conn is not None:
+                with self.conn:
+                    self.conn.execute("DELETE FROM results")
+
+    def stats(self):
+        return {"size": len(self.results), "hits": self.hits,
+                "misses": self.misses}
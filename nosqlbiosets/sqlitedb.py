@@ -0,0 +1,772 @@
+""" MongoDB-like collections stored in SQLite database files
+
+ Documents are stored as json text in tables with `_id` primary keys,
+ and are queried with a subset of MongoDB query operators and
+ aggregation pipeline stages, so the query methods written for MongoDB
+ can be run on local database files, without a database server.
+ Query clauses are evaluated with a Python function registered with
+ the SQLite connection: for the queries other than `_id` queries,
+ documents of the selected rows are parsed with json.loads() and
+ matched with the query clause in Python, row by row. Queries selecting
+ documents by their `_id` values are answered with the primary key index.
+ Indexes can be created for the top-level fields, equality and $in
+ conditions on the indexed fields are then answered with the indexes,
+ unless the indexed values include arrays.
+ Equality and $in conditions with scalar values on the other fields,
+ at the top level of the query clauses or in their $and lists,
+ select the rows with the json_each() and json_tree() functions of SQLite
+ before the documents are parsed and matched in Python.
+
+ Supported query operators: $eq, $ne, $gt, $gte, $lt, $lte, $in, $nin,
+ $exists, $regex, $not, $all, $size, $elemMatch, $and, $or, $nor and
+ a simple $text search matching the words in any string attribute.
+ Supported aggregation stages: $match, $project, $unwind, $group,
+ $sort, $skip, $limit and $count.
+"""
+import datetime
+import json
+import re
+import sqlite3
+import threading
+import uuid
+from collections import OrderedDict
+
+import six
+
+FETCH_SIZE = 1000  # Number of rows fetched from the database at a time
+JSON_QUERY_VALUES = 100  # Max number of values in the json_each conditions
+
+_MISSING = object()  # Value of the paths not found in documents
+
+
+class SQLiteDatabase(object):
+    """ SQLite database file, with a table for each collection """
+
+    def __init__(self, dbfile):
+        self.dbfile = dbfile
+        self.conn = sqlite3.connect(dbfile, check_same_thread=False)
+        self.conn.create_function('mongomatch', 2, _sqlmatch)
+        self.lock = threading.RLock()
+        self.collections = {}
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            self.collections[name] = SQLiteCollection(self, name)
+        return self.collections[name]
+
+    def list_collection_names(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'")
+            return [row[0] for row in rows]
+
+    def drop_collection(self, name):
+        with self.lock, self.conn:
+            self.conn.execute("DROP TABLE IF EXISTS %s" % _quote(name))
+        self.collections.pop(name, None)
+
+    def close(self):
+        self.conn.close()
+
+
+class SQLiteCollection(object):
+    """ Collection of json documents, with methods similar to
+     the methods of pymongo Collection objects """
+
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+        self.table = _quote(name)
+        with db.lock, db.conn:
+            db.conn.execute("CREATE TABLE IF NOT EXISTS %s"
+                            " (_id TEXT PRIMARY KEY, doc TEXT)" % self.table)
+            rows = db.conn.execute("SELECT name FROM sqlite_master WHERE"
+                                   " type = 'index' AND tbl_name = ?",
+                                   (name,))
+            # index names are the collection name and the indexed fields
+            self.indexed = set(f for row in rows
+                               if row[0].startswith(name + '$')
+                               for f in row[0][len(name) + 1:].split('$'))
+
+    def insert_many(self, docs, replace=True):
+        """ Insert documents, or replace the documents with the same ids
+            if replace is True, return number of documents written """
+        rows = []
+        for doc in docs:
+            if '_id' not in doc:
+                doc['_id'] = uuid.uuid4().hex
+            rows.append((json.dumps(doc['_id']),
+                         json.dumps(doc, default=_sqlitejson)))
+        sql = "INSERT OR %s INTO %s VALUES (?, ?)" % (
+            "REPLACE" if replace else "IGNORE", self.table)
+        with self.db.lock, self.db.conn:
+            n = self.db.conn.total_changes
+            self.db.conn.executemany(sql, rows)
+            return self.db.conn.total_changes - n
+
+    def replace_one(self, filter, doc, upsert=False):
+        """ Replace the document selected by its `_id` """
+        assert list(filter) == ['_id']
+        doc = dict(doc, _id=filter['_id'])
+        if upsert or self.count(filter) > 0:
+            self.insert_many([doc])
+
+    def delete_many(self, filter):
+        """ Delete documents matching the query clause,
+            return number of documents deleted """
+        sql, params = self._select("_id", filter)
+        with self.db.lock, self.db.conn:
+            n = self.db.conn.total_changes
+            self.db.conn.execute("DELETE FROM %s WHERE _id IN (%s)"
+                                 % (self.table, sql), params)
+            return self.db.conn.total_changes - n
+
+    def create_index(self, keys, **_):
+        """ Create index for the top-level fields, given as a field name
+            or as a list of (field, direction) pairs; if values of an indexed
+            field include arrays the index is not used for its queries """
+        if isinstance(keys, six.string_types):
+            keys = [(keys, 1)]
+        fields = [k for k, _ in keys]
+        assert all('.' not in f and '$' not in f for f in fields)
+        name = '$'.join([self.name] + fields)
+        with self.db.lock, self.db.conn:
+            self.db.conn.execute("CREATE INDEX IF NOT EXISTS %s ON %s (%s)" % (
+                _quote(name), self.table,
+                ', '.join(_jsonfield(f) for f in fields)))
+        self.indexed.update(fields)
+        return name
+
+    def drop(self):
+        self.db.drop_collection(self.name)
+
+    def _select(self, column, qc):
+        """ Select statement and its parameters for the query clause qc """
+        sql = "SELECT %s FROM %s" % (column, self.table)
+        if not qc:
+            return sql, ()
+        ids = _idsquery(qc)
+        if ids is not None:
+            return (sql + " WHERE _id IN (%s)" % ','.join('?' * len(ids)),
+                    [json.dumps(i) for i in ids])
+        # arrays are not matched element-wise with the indexes
+        indexed = set(f for f in self.indexed
+                      if f not in qc or not self._hasarrays(f))
+        conditions, params = _indexedquery(qc, indexed)
+        jsonconditions, jsonparams = _jsonquery(qc, indexed)
+        conditions += jsonconditions
+        params += jsonparams
+        conditions.append("mongomatch(doc, ?)")
+        params.append(json.dumps(qc))
+        return sql + " WHERE " + " AND ".join(conditions), params
+
+    def _hasarrays(self, field):
+        """ Whether values of the indexed field include arrays, checked with
+            the index; also true if the values include strings starting
+            with '[' """
+        f = _jsonfield(field)
+        sql = "SELECT 1 FROM %s WHERE %s >= '[' AND %s < '\\' LIMIT 1" % (
+            self.table, f, f)
+        with self.db.lock:
+            return self.db.conn.execute(sql).fetchone() is not None
+
+    def _rows(self, sql, params):
+        with self.db.lock:
+            c = self.db.conn.execute(sql, params)
+            rows = c.fetchmany(FETCH_SIZE)
+        while rows:
+            for row in rows:
+                yield row
+            with self.db.lock:
+                rows = c.fetchmany(FETCH_SIZE)
+
+    def find(self, filter=None, projection=None, skip=0, limit=0):
+        """ Iterate documents matching the query clause, filter;
+            arguments are in the same order as in pymongo find() """
+        sql, params = self._select("doc", filter)
+        if limit:
+            sql += " LIMIT %d OFFSET %d" % (limit, skip)
+        elif skip:
+            sql += " LIMIT -1 OFFSET %d" % skip
+        if isinstance(projection, (list, tuple)):
+            projection = {k: 1 for k in projection}
+        for row in self._rows(sql, params):
+            doc = json.loads(row[0])
+            yield doc if not projection else _project(doc, projection)
+
+    def find_one(self, filter=None, projection=None):
+        for doc in self.find(filter, projection, limit=1):
+            return doc
+
+    def count(self, filter=None, **_):
+        sql, params = self._select("count(*)", filter)
+        with self.db.lock:
+            return self.db.conn.execute(sql, params).fetchone()[0]
+
+    count_documents = count
+
+    def distinct(self, key, filter=None):
+        """ Distinct values of the key in documents matching the filter,
+            values in arrays are included as separate values """
+        r = OrderedDict()
+        for doc in self.find(filter):
+            for v in _resolve(doc, key.split('.')):
+                for x in v if isinstance(v, list) else [v]:
+                    r.setdefault(_hashable(x), x)
+        return list(r.values())
+
+    def aggregate(self, pipeline, **_):
+        """ Run aggregation pipeline, documents for the first $match
+            stage are selected with the SQL query """
+        stages = list(pipeline)
+        if stages and '$match' in stages[0]:
+            docs = self.find(stages.pop(0)['$match'])
+        else:
+            docs = self.find()
+        return aggregate(docs, stages)
+
+
+def _quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+# json.dumps default function, dates are saved in ISO format
+def _sqlitejson(o):
+    if isinstance(o, (datetime.datetime, datetime.date)):
+        return o.isoformat()
+    return str(o)
+
+
+# Ids of the documents selected by the query clause,
+# if it is a simple _id query, otherwise None
+def _idsquery(qc):
+    if list(qc) != ['_id']:
+        return None
+    c = qc['_id']
+    if not isinstance(c, dict):
+        return [c]
+    if list(c) == ['$in']:
+        return list(c['$in'])
+    if list(c) == ['$eq']:
+        return [c['$eq']]
+    return None
+
+
+def _jsonpath(name):
+    return "'$.\"%s\"'" % name.replace("'", "''")
+
+
+def _jsonfield(name):
+    return "json_extract(doc, %s)" % _jsonpath(name)
+
+
+# Scalar values of the equality, or $in, condition c; None if c is another
+# condition, or if the values are not strings or numbers
+def _scalars(c):
+    if isinstance(c, dict):
+        if list(c) == ['$in']:
+            values = list(c['$in'])
+        elif list(c) == ['$eq']:
+            values = [c['$eq']]
+        else:
+            return None
+    else:
+        values = [c]
+    if not values or not all(
+            isinstance(v, six.string_types + six.integer_types + (float,))
+            and not isinstance(v, bool) for v in values):
+        return None
+    return values
+
+
+# SQL conditions, and their parameters, for the equality and $in
+# conditions of the query clause on the indexed fields
+def _indexedquery(qc, indexed):
+    conditions, params = [], []
+    for k, c in qc.items():
+        if k not in indexed:
+            continue
+        values = _scalars(c)
+        if values is None:
+            continue
+        conditions.append("%s IN (%s)" % (_jsonfield(k),
+                                          ','.join('?' * len(values))))
+        params.extend(values)
+    return conditions, params
+
+
+# SQL conditions, and their parameters, for the equality and $in conditions
+# of the query clause on the fields without indexes; rows are selected if the
+# values are in the field, in its arrays, or anywhere under the first field
+# of the dotted paths; selected documents are then matched in Python
+def _jsonquery(qc, indexed):
+    conditions, params = [], []
+    for k, c in qc.items():
+        if k == '$and' and isinstance(c, list):
+            for qc_ in c:
+                if isinstance(qc_, dict):
+                    conditions_, params_ = _jsonquery(qc_, indexed)
+                    conditions += conditions_
+                    params += params_
+            continue
+        if k.startswith('$') or k in indexed or '"' in k:
+            continue
+        values = _scalars(c)
+        if values is None or len(values) > JSON_QUERY_VALUES:
+            continue
+        path = k.split('.')
+        if len(path) == 1:
+            sql = "EXISTS (SELECT 1 FROM json_each(doc, %s) WHERE value IN (%s))"
+        else:  # values of the path can be in arrays at any level
+            sql = "EXISTS (SELECT 1 FROM json_tree(doc, %s) WHERE atom IN (%s))"
+        conditions.append(sql % (_jsonpath(path[0]),
+                                 ','.join('?' * len(values))))
+        params.extend(values)
+    return conditions, params
+
+
+_queries = {}  # Parsed query clauses of the SQL queries
+_querieslock = threading.Lock()
+
+
+def _sqlmatch(doc, qc):
+    with _querieslock:
+        q = _queries.get(qc)
+        if q is None:
+            if len(_queries) > 100:
+                _queries.clear()
+            q = _queries[qc] = json.loads(qc)
+    return match(json.loads(doc), q)
+
+
+def _resolve(value, keys):
+    """ Values at the path of keys, array elements are traversed as in
+        MongoDB queries, a path can select more than one value """
+    if not keys:
+        return [value]
+    if isinstance(value, dict):
+        if keys[0] in value:
+            return _resolve(value[keys[0]], keys[1:])
+        return []
+    if isinstance(value, list):
+        r = []
+        if keys[0].isdigit() and int(keys[0]) < len(value):
+            r = _resolve(value[int(keys[0])], keys[1:])
+        for v in value:
+            if isinstance(v, dict):
+                r.extend(_resolve(v, keys))
+        return r
+    return []
+
+
+# Values, and elements of the array values
+def _expand(values):
+    r = []
+    for v in values:
+        if isinstance(v, list):
+            r.extend(v)
+        r.append(v)
+    return r
+
+
+def _hashable(v):
+    if isinstance(v, (dict, list)):
+        return json.dumps(v, sort_keys=True)
+    return type(v), v
+
+
+def _comparable(a, b):
+    numbers = (int, float)
+    if isinstance(a, bool) or isinstance(b, bool):
+        return False
+    if isinstance(a, numbers) and isinstance(b, numbers):
+        return True
+    return type(a) == type(b) and not isinstance(a, (dict, list))
+
+
+def _equals(values, x):
+    if x is None:
+        return not values or None in _expand(values)
+    return any(v == x and isinstance(v, bool) == isinstance(x, bool)
+               for v in _expand(values))
+
+
+_COMPARISONS = {
+    '$gt': lambda a, b: a > b,
+    '$gte': lambda a, b: a >= b,
+    '$lt': lambda a, b: a < b,
+    '$lte': lambda a, b: a <= b
+}
+
+
+def _regex(c, options=''):
+    flags = 0
+    for o in options:
+        flags |= {'i': re.I, 'm': re.M, 's': re.S, 'x': re.X}[o]
+    return re.compile(c, flags)
+
+
+def _matchvalues(values, cond):
+    """ Whether values selected by a path match the condition """
+    if not (isinstance(cond, dict) and cond and
+            all(k.startswith('$') for k in cond)):
+        return _equals(values, cond)
+    for op, c in cond.items():
+        if op == '$eq':
+            r = _equals(values, c)
+        elif op == '$ne':
+            r = not _equals(values, c)
+        elif op in _COMPARISONS:
+            r = any(_comparable(v, c) and _COMPARISONS[op](v, c)
+                    for v in _expand(values))
+        elif op == '$in':
+            r = any(_equals(values, x) for x in c)
+        elif op == '$nin':
+            r = not any(_equals(values, x) for x in c)
+        elif op == '$exists':
+            r = bool(values) == bool(c)
+        elif op == '$regex':
+            rx = _regex(c, cond.get('$options', ''))
+            r = any(isinstance(v, six.string_types) and rx.search(v)
+                    for v in _expand(values))
+        elif op == '$options':
+            continue
+        elif op == '$not':
+            r = not _matchvalues(values, c)
+        elif op == '$all':
+            r = all(_equals(values, x) for x in c)
+        elif op == '$size':
+            r = any(isinstance(v, list) and len(v) == c for v in values)
+        elif op == '$elemMatch':
+            r = any(isinstance(v, list) and any(_matchelement(e, c)
+                                                for e in v)
+                    for v in values)
+        else:
+            raise NotImplementedError("Query operator %s is not supported"
+                                      " with SQLite" % op)
+        if not r:
+            return False
+    return True
+
+
+def _matchelement(e, cond):
+    if isinstance(e, dict) and not all(k.startswith('$') for k in cond):
+        return match(e, cond)
+    return _matchvalues([e], cond)
+
+
+def _strings(value):
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, list):
+        for v in value:
+            for s in _strings(v):
+                yield s
+    elif isinstance(value, six.string_types):
+        yield value
+
+
+def _textmatch(doc, search):
+    words = search.lower().split()
+    for s in _strings(doc):
+        s = s.lower()
+        if any(w in s for w in words):
+            return True
+    return False
+
+
+def match(doc, qc):
+    """ Whether the document matches the MongoDB query clause qc """
+    for k, cond in qc.items():
+        if k == '$and':
+            r = all(match(doc, c) for c in cond)
+        elif k == '$or':
+            r = any(match(doc, c) for c in cond)
+        elif k == '$nor':
+            r = not any(match(doc, c) for c in cond)
+        elif k == '$text':
+            r = _textmatch(doc, cond['$search'])
+        elif k.startswith('$'):
+            raise NotImplementedError("Query operator %s is not supported"
+                                      " with SQLite" % k)
+        else:
+            r = _matchvalues(_resolve(doc, k.split('.')), cond)
+        if not r:
+            return False
+    return True
+
+
+def getvalue(doc, path):
+    """ Value of the field path, as in aggregation expressions '$a.b',
+        for arrays the values of the elements are returned in arrays """
+    v = doc
+    for k in path.split('.'):
+        if isinstance(v, dict):
+            v = v.get(k, _MISSING)
+        elif isinstance(v, list):
+            v = [x[k] for x in v if isinstance(x, dict) and k in x]
+        else:
+            return _MISSING
+        if v is _MISSING:
+            return v
+    return v
+
+
+def evaluate(doc, expr):
+    """ Evaluate aggregation expression for the document """
+    if isinstance(expr, six.string_types) and expr.startswith('$'):
+        return getvalue(doc, expr[1:])
+    if isinstance(expr, list):
+        return [evaluate(doc, e) for e in expr]
+    if not isinstance(expr, dict):
+        return expr
+    if len(expr) == 1 and list(expr)[0].startswith('$'):
+        op, args = list(expr.items())[0]
+        if op == '$literal':
+            return args
+        args = evaluate(doc, args)
+        if op == '$arrayElemAt':
+            a, i = args
+            return a[i] if isinstance(a, list) and -len(a) <= i < len(a) \
+                else _MISSING
+        if op == '$size':
+            return len(args)
+        if op == '$concat':
+            return ''.join(args)
+        if op == '$toLower':
+            return args.lower()
+        if op == '$toUpper':
+            return args.upper()
+        if op == '$ifNull':
+            return args[0] if args[0] not in (None, _MISSING) else args[1]
+        raise NotImplementedError("Expression operator %s is not supported"
+                                  " with SQLite" % op)
+    r = OrderedDict()
+    for k, e in expr.items():
+        v = evaluate(doc, e)
+        if v is not _MISSING:
+            r[k] = v
+    return r
+
+
+# Tree of the field paths, {'a.b': 1, 'c': 1} -> {'a': {'b': 1}, 'c': 1}
+def _pathtree(paths):
+    tree = {}
+    for path, v in paths:
+        keys = path.split('.')
+        t = tree
+        for k in keys[:-1]:
+            t = t.setdefault(k, {})
+        t[keys[-1]] = v
+    return tree
+
+
+def _include(value, tree):
+    if not isinstance(tree, dict):
+        return value
+    if isinstance(value, list):
+        return [_include(v, tree) for v in value
+                if isinstance(v, (dict, list))]
+    if isinstance(value, dict):
+        r = OrderedDict()
+        for k, v in value.items():
+            if k in tree:
+                r[k] = _include(v, tree[k])
+        return r
+    return _MISSING
+
+
+def _exclude(value, tree):
+    if isinstance(value, list):
+        return [_exclude(v, tree) for v in value]
+    if isinstance(value, dict):
+        r = OrderedDict()
+        for k, v in value.items():
+            if k not in tree:
+                r[k] = v
+            elif isinstance(tree[k], dict):
+                r[k] = _exclude(v, tree[k])
+        return r
+    return value
+
+
+def _setpath(doc, keys, value):
+    """ Copy of the document with the value set at the path of keys,
+        documents on the path are copied, other values are shared """
+    doc = OrderedDict(doc) if isinstance(doc, dict) else OrderedDict()
+    if len(keys) == 1:
+        doc[keys[0]] = value
+    else:
+        doc[keys[0]] = _setpath(doc.get(keys[0]), keys[1:], value)
+    return doc
+
+
+def _project(doc, spec):
+    included, excluded, computed = [], [], []
+    for k, v in spec.items():
+        if v in (0, False):
+            excluded.append((k, 1))
+        elif v in (1, True) and not isinstance(v, six.string_types):
+            included.append((k, 1))
+        else:
+            computed.append((k, v))
+    if included or computed:
+        if '_id' not in spec:
+            included.append(('_id', 1))
+        r = _include(doc, _pathtree(included))
+        for k, e in computed:
+            v = evaluate(doc, e)
+            if v is not _MISSING:
+                r = _setpath(r, k.split('.'), v)
+        return r
+    return _exclude(doc, _pathtree(excluded))
+
+
+def _unwind(docs, spec):
+    preserve = False
+    if isinstance(spec, dict):
+        preserve = spec.get('preserveNullAndEmptyArrays', False)
+        spec = spec['path']
+    keys = spec[1:].split('.')
+    for doc in docs:
+        v = getvalue(doc, spec[1:])
+        if isinstance(v, list):
+            for e in v:
+                yield _setpath(doc, keys, e)
+            if not v and preserve:
+                yield doc
+        elif v is not None and v is not _MISSING:
+            yield doc
+        elif preserve:
+            yield doc
+
+
+def _accumulate(acc, op, v):
+    if op == '$sum':
+        if isinstance(v, (int, float)) and not isinstance(v, bool):
+            acc = (acc or 0) + v
+        return acc or 0
+    if v is _MISSING:
+        return acc
+    if op == '$avg':
+        if isinstance(v, (int, float)):
+            acc = acc or [0, 0]
+            acc[0] += v
+            acc[1] += 1
+    elif op == '$min':
+        acc = v if acc is None or (v is not None and v < acc) else acc
+    elif op == '$max':
+        acc = v if acc is None or (v is not None and v > acc) else acc
+    elif op == '$first':
+        acc = v if acc is None else acc
+    elif op == '$last':
+        acc = v
+    elif op == '$push':
+        acc = (acc or []) + [v]
+    elif op == '$addToSet':
+        acc = acc or []
+        if v not in acc:
+            acc.append(v)
+    else:
+        raise NotImplementedError("Accumulator %s is not supported"
+                                  " with SQLite" % op)
+    return acc
+
+
+def _group(docs, spec):
+    groups = OrderedDict()
+    accumulators = [(k, list(v.items())[0]) for k, v in spec.items()
+                    if k != '_id']
+    for doc in docs:
+        key = evaluate(doc, spec['_id'])
+        key = None if key is _MISSING else key
+        h = _hashable(key)
+        if h not in groups:
+            groups[h] = [key, {}]
+        accs = groups[h][1]
+        for field, (op, expr) in accumulators:
+            accs[field] = _accumulate(accs.get(field), op,
+                                      evaluate(doc, expr))
+    for key, accs in groups.values():
+        r = OrderedDict([('_id', key)])
+        for field, (op, _) in accumulators:
+            acc = accs.get(field)
+            if op == '$avg':
+                acc = acc[0] / float(acc[1]) if acc else None
+            r[field] = acc
+        yield r
+
+
+# Sort order of the values of different types, as in MongoDB
+def _sortkey(v):
+    if v is None or v is _MISSING:
+        return 0, 0
+    if isinstance(v, bool):
+        return 5, v
+    if isinstance(v, (int, float)):
+        return 1, v
+    if isinstance(v, six.string_types):
+        return 2, v
+    if isinstance(v, dict):
+        return 3, json.dumps(v, sort_keys=True)
+    return 4, json.dumps(v, sort_keys=True, default=str)
+
+
+def _sort(docs, spec):
+    docs = list(docs)
+    for k, order in reversed(list(spec.items())):
+        docs.sort(key=lambda doc: _sortkey(getvalue(doc, k)),
+                  reverse=order < 0)
+    return docs
+
+
+def aggregate(docs, pipeline):
+    """ Run the aggregation pipeline stages on the documents """
+    for stage in pipeline:
+        (name, spec), = stage.items()
+        if name == '$match':
+            docs = _match(docs, spec)
+        elif name == '$project':
+            docs = _projectdocs(docs, spec)
+        elif name == '$unwind':
+            docs = _unwind(docs, spec)
+        elif name == '$group':
+            docs = _group(docs, spec)
+        elif name == '$sort':
+            docs = _sort(docs, spec)
+        elif name == '$limit':
+            docs = _limit(docs, spec)
+        elif name == '$skip':
+            docs = _skip(docs, spec)
+        elif name == '$count':
+            docs = iter([{spec: sum(1 for _ in docs)}])
+        else:
+            raise NotImplementedError("Aggregation stage %s is not supported"
+                                      " with SQLite" % name)
+    return iter(docs)
+
+
+# Stages are run with generator functions, so that each stage
+# keeps its own spec while the pipeline runs lazily
+def _match(docs, qc):
+    for doc in docs:
+        if match(doc, qc):
+            yield doc
+
+
+def _projectdocs(docs, spec):
+    for doc in docs:
+        yield _project(doc, spec)
+
+
+def _limit(docs, n):
+    for i, doc in enumerate(docs):
+        if i >= n:
+            break
+        yield doc
+
+
+def _skip(docs, n):
+    for i, doc in enumerate(docs):
+        if i >= n:
+            yield doc
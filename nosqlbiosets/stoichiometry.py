@@ -0,0 +1,151 @@
+""" Sparse stoichiometric matrices of the reaction datasets
+
+ StoichiometricMatrix objects keep the stoichiometry of all reactions of
+ a dataset version as the CSR arrays of a reactions x metabolites matrix,
+ saved in a cache folder as .npy files, which are loaded with memory
+ mapping when the matrix is needed again for the same dataset version.
+ Stoichiometric matrices of reaction subsets, metabolites x reactions,
+ are sliced from them as scipy.sparse.csr_matrix objects.
+ Requires numpy and scipy packages.
+"""
+import glob
+import hashlib
+import os
+import shutil
+import threading
+from array import array
+
+from nosqlbiosets.dbutils import dbconfig
+
+MATRIX_ARRAYS = ['indptr', 'indices', 'data', 'reactions', 'metabolites']
+_matrices = {}  # cache folder of the matrix -> StoichiometricMatrix
+_matriceslock = threading.Lock()
+
+
+class StoichiometricMatrix(object):
+    """ Reactions x metabolites matrix in CSR arrays, with id arrays """
+
+    def __init__(self, indptr, indices, data, reactions, metabolites):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.reactions = reactions      # reaction ids, by row
+        self.metabolites = metabolites  # metabolite ids, by column
+        self.order = None  # reaction rows sorted by the reaction ids
+
+    @classmethod
+    def build(cls, reactions):
+        """ Build matrix for (reaction id, [(metabolite id, coefficient)])
+            tuples, coefficients of the reactants are negative """
+        import numpy as np
+        indptr, indices, data = array('q', [0]), array('q'), array('d')
+        rids, mindex = [], {}
+        for rid, terms in reactions:
+            rids.append(rid)
+            for mid, coefficient in terms:
+                j = mindex.get(mid)
+                if j is None:
+                    j = mindex[mid] = len(mindex)
+                indices.append(j)
+                data.append(coefficient)
+            indptr.append(len(indices))
+        mids = [None] * len(mindex)
+        for mid, j in mindex.items():
+            mids[j] = mid
+        return cls(np.array(indptr, dtype=np.int64),
+                   np.array(indices, dtype=np.int64),
+                   np.array(data, dtype=np.float64),
+                   np.array(rids, dtype=str), np.array(mids, dtype=str))
+
+    def save(self, folder):
+        """ Save the arrays as .npy files in the folder, written first to
+            a temporary folder which is then renamed """
+        import numpy as np
+        tmpfolder = "%s.tmp%d" % (folder, os.getpid())
+        os.makedirs(tmpfolder)
+        for name in MATRIX_ARRAYS:
+            np.save(os.path.join(tmpfolder, name + '.npy'),
+                    getattr(self, name))
+        try:
+            os.rename(tmpfolder, folder)
+        except OSError:  # saved by another process
+            shutil.rmtree(tmpfolder, ignore_errors=True)
+
+    @classmethod
+    def load(cls, folder):
+        """ Load the arrays saved in the folder, with memory mapping """
+        import numpy as np
+        return cls(*[np.load(os.path.join(folder, name + '.npy'),
+                             mmap_mode='r') for name in MATRIX_ARRAYS])
+
+    def rows(self, rids):
+        """ Rows of the reactions, reactions not in the matrix are skipped """
+        import numpy as np
+        if len(self.reactions) == 0:
+            return np.array([], dtype=np.int64)
+        if self.order is None:
+            self.order = np.argsort(self.reactions, kind='stable')
+        rids = np.array(list(rids), dtype=str)
+        sortedids = self.reactions[self.order]
+        i = np.searchsorted(sortedids, rids)
+        i[i == len(sortedids)] = 0
+        found = sortedids[i] == rids
+        return np.sort(self.order[i[found]])
+
+    def matrix(self, rows=None):
+        """ Return stoichiometric matrix of the reactions in given rows,
+            with all reactions if rows is None, as scipy.sparse.csr_matrix
+            of metabolites x reactions, with the metabolite and reaction
+            id arrays; only the metabolites of the reactions are included """
+        import numpy as np
+        from scipy.sparse import csr_matrix
+        a = csr_matrix((self.data, self.indices, self.indptr),
+                       shape=(len(self.reactions), len(self.metabolites)))
+        reactions, metabolites = self.reactions, self.metabolites
+        if rows is not None:
+            a = a[rows]
+            reactions = reactions[rows]
+            columns = np.unique(a.indices)
+            a = a[:, columns]
+            metabolites = metabolites[columns]
+        s = a.T.tocsr()
+        s.sum_duplicates()
+        return s, metabolites, reactions
+
+
+def matrixprefix(cachefolder, database, name):
+    """ Path prefix of the matrix folders of the dataset, named with the
+        dataset name and a hash of the database identifier, see
+        DBconnection.dbid(), followed by the dataset version """
+    dbhash = hashlib.md5(database.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(os.path.abspath(cachefolder),
+                        "%s-%s-" % (name, dbhash))
+
+
+def getmatrix(database, name, version, reactions, cachefolder=None):
+    """ Return matrix of the dataset version in the database, loaded from
+        the cache folder if it was saved before; otherwise built with the
+        reactions function, which returns the (reaction id, metabolite terms)
+        tuples, and saved in the cache folder, replacing matrices of the
+        earlier versions of the dataset in the same database.
+        Matrices are not saved if version of the dataset is not known """
+    if version is None:
+        return StoichiometricMatrix.build(reactions())
+    if cachefolder is None:
+        cachefolder = dbconfig().get('matrix_folder', '.')
+    prefix = matrixprefix(cachefolder, database, name)
+    folder = prefix + str(version)
+    with _matriceslock:
+        if folder not in _matrices:
+            if os.path.exists(folder):
+                m = StoichiometricMatrix.load(folder)
+            else:
+                m = StoichiometricMatrix.build(reactions())
+                for f in glob.glob(prefix + '*'):
+                    if '.tmp' not in os.path.basename(f):  # being saved
+                        shutil.rmtree(f, ignore_errors=True)
+                m.save(folder)
+            for f in [f for f in _matrices if f.startswith(prefix)]:
+                del _matrices[f]  # earlier versions
+            _matrices[folder] = m
+        return _matrices[folder]
@@ -9,28 +9,35 @@ import json
 import logging
 import os
 import traceback
+from functools import partial
 from gzip import GzipFile
-from multiprocessing.pool import ThreadPool
 
 import xmltodict
 from pymongo import IndexModel
 from six import string_types
 
+from nosqlbiosets.checkpoint import Checkpoint, checkpointargs, \
+    CHECKPOINT_DB, CHECKPOINT_INTERVAL
 from nosqlbiosets.dbutils import DBconnection, dbargs
+from nosqlbiosets.metrics import metricsargs, profile
+from nosqlbiosets.pipeline import Pipeline
+from nosqlbiosets.xmlutils import ListChildren, lxml_parse, \
+    parse_xmlrecords
+from nosqlbiosets.xrefs import XrefWriter
 
-logging.basicConfig(filename='uniprot-indexer.log',
-                    format='%(message)s',
-                    level=logging.WARNING)
-pool = ThreadPool(14)   # Threads for index calls, parsing is in the main thread
+THREADS = 14  # Threads for index calls, parsing is in the main thread
 MAX_QUEUED_JOBS = 1400  # Maximum number of index jobs in queue
 MDBCOLLECTION = 'uniprot'
+# Entry attributes always read as lists by the xml parsers
+FORCE_LIST = ListChildren([('entry', 'gene'), ('entry', 'comment')])
 
 
 class Indexer(DBconnection):
 
     def __init__(self, db, esindex, mdbdb, mdbcollection=MDBCOLLECTION,
                  host=None, port=None,
-                 recreateindex=True):
+                 recreateindex=True, resume=False, checkpointdb=CHECKPOINT_DB,
+                 xrefs=False):
         self.index = esindex if db == "Elasticsearch" else mdbdb
         self.db = db
         indxcfg = {  # for Elasticsearch
@@ -45,57 +52,116 @@ class Indexer(DBconnection):
                                       mdbcollection=mdbcollection,
                                       es_indexsettings=indxcfg,
                                       es_indexmappings=mappings,
-                                      recreateindex=recreateindex)
+                                      recreateindex=recreateindex and
+                                      not resume)
         if db == "MongoDB":
             self.mcl = self.mdbi[mdbcollection]
-            self.mcl.drop()
+            if not resume:
+                self.mcl.drop()
+        elif db == "File" and not resume:
+            self.removefiles(mdbcollection)
+        self.writer = self.bulkwriter(collection=mdbcollection,
+                                      optype='create', threads=4)
+        # dbReference ids are saved in the xref lookup table if xrefs is set
+        self.xrefwriter = XrefWriter(
+            self, self.index if db == "Elasticsearch" else mdbcollection,
+            recreate=not resume) if xrefs else None
+        self.checkpoint = Checkpoint("uniprot:%s:%s:%s" % (
+            db, self.index, mdbcollection), checkpointdb, resume)
+        self.infile = None
+        self.offset = 0     # number of entries indexed in the earlier runs
+        self.nrecords = 0   # number of entries read from the input file
+        self.pipeline = Pipeline(THREADS, MAX_QUEUED_JOBS, 'uniprot')
 
     # Read and Index entries in UniProt xml file
-    def parse_uniprot_xmlfiles(self, infile):
+    # If processes is set entries are parsed and updated in worker processes
+    # If uselxml is set entries are parsed with lxml instead of xmltodict
+    def parse_uniprot_xmlfiles(self, infile, processes=None, uselxml=False):
         infile = str(infile)
+        if self.checkpoint.completed(infile):
+            print("%s has been indexed before, skipping" % infile)
+            return
+        self.infile = infile
+        self.offset = self.checkpoint.offset(infile)
+        self.nrecords = 0
         print("Reading/indexing %s " % infile)
+        if self.offset > 0:
+            print("Skipping the first %d entries, indexed before"
+                  % self.offset)
         if infile.endswith(".gz"):
             with GzipFile(infile) as inf:
-                xmltodict.parse(inf, item_depth=2,
-                                item_callback=self.index_uniprot_entry,
-                                attr_prefix='')
+                self.parse_uniprot_xml(self.metrics.reader(inf),
+                                       processes, uselxml)
         else:
             with open(infile, 'rb') as inf:
-                xmltodict.parse(inf, item_depth=2,
-                                item_callback=self.index_uniprot_entry,
-                                attr_prefix='')
+                self.parse_uniprot_xml(self.metrics.reader(inf),
+                                       processes, uselxml)
+        self.savecheckpoint(completed=True)
         print("\nCompleted")
 
-    def index_uniprot_entry(self, _, entry):
+    # Wait for the pending index calls and bulk writes,
+    # then save number of entries indexed, if no index calls or writes failed
+    def savecheckpoint(self, completed=False):
+        self.pipeline.wait()
+        self.writer.sync()
+        nfailed = self.pipeline.nfailed + self.writer.nerrors
+        if self.xrefwriter is not None:
+            self.xrefwriter.writer.sync()
+            nfailed += self.xrefwriter.writer.nerrors
+        self.checkpoint.commit(self.infile, self.nrecords, nfailed,
+                               completed)
+
+    # Time spent in the parsers, between the entry callbacks, is recorded
+    # as 'parse' time, time spent in the callbacks as 'submit' time
+    def parse_uniprot_xml(self, inf, processes=None, uselxml=False):
+        self.metrics.lap()
+        if processes is None and uselxml:
+            lxml_parse(inf, 2, self.index_uniprot_entry, 'entry',
+                       attr_prefix='', force_list=FORCE_LIST)
+        elif processes is None:
+            xmltodict.parse(inf, item_depth=2,
+                            item_callback=self.index_uniprot_entry,
+                            attr_prefix='', force_list=FORCE_LIST)
+        else:
+            parse_xmlrecords(inf, partial(self.index_uniprot_entry,
+                                          tuned=True),
+                             'entry', processes, tuner=self.update_entry,
+                             uselxml=uselxml, attr_prefix='',
+                             force_list=FORCE_LIST)
+
+    def index_uniprot_entry(self, _, entry, tuned=False):
+        self.metrics.lap('parse')
         def index():
             try:
-                self.update_entry(entry)
-                docid = entry['name']
-                if self.db == "Elasticsearch":
-                    self.es.index(index=self.index,
-                                  op_type='create', ignore=409,
-                                  filter_path=['hits.hits._id'],
-                                  id=docid, document=entry)
-                else:  # assume MongoDB
-                    spec = {"_id": docid}
-                    self.mcl.update(spec, entry, upsert=True)
+                if not tuned:
+                    with self.metrics.timer('transform'):
+                        self.update_entry(entry)
+                self.writer.add(entry, docid=entry['name'])
+                if self.xrefwriter is not None:
+                    self.addxrefs(entry)
             except Exception as e:
                 print("ERROR: %s" % e)
-                print(traceback.format_exc())
                 logging.error(e)
                 logging.error(traceback.format_exc())
-                pool.close()
+                raise
             self.reportprogress(1000)
         if isinstance(entry, string_types):  # Assume <copyright> notice
             print("\nUniProt copyright notice: %s " % entry.strip())
         else:
-            if pool._inqueue.qsize() > MAX_QUEUED_JOBS:
-                from time import sleep
-                print('sleeping 1 sec')
-                sleep(1)
-            pool.apply_async(index, ())
+            self.nrecords += 1
+            if self.nrecords <= self.offset:
+                return True
+            self.pipeline.submit(index)
+            if self.nrecords % CHECKPOINT_INTERVAL == 0:
+                self.savecheckpoint()
+        self.metrics.lap('submit')
         return True
 
+    def addxrefs(self, entry):
+        refs = entry.get('dbReference', [])
+        for ref in refs if isinstance(refs, list) else [refs]:
+            self.xrefwriter.add(ref['type'], ref['id'], entry['name'])
+
     # Prepare 'comments' for indexing
     # Sample err msg: failed to parse [comment.absorption.text]
     @staticmethod
@@ -125,23 +191,25 @@ class Indexer(DBconnection):
                 int(c['location']['end']['position'])
 
     # Prepare 'features' for indexing
-    def updatefeatures(self, e):
+    @classmethod
+    def updatefeatures(cls, e):
         if isinstance(e['feature'], list):
             for f in e['feature']:
                 if 'location' in f:
-                    self.updatelocation(f)
+                    cls.updatelocation(f)
         else:
-            self.updatelocation(e['feature'])
+            cls.updatelocation(e['feature'])
 
     # Prepare 'locations' for indexing
-    def updatelocation(self, obj):
+    @classmethod
+    def updatelocation(cls, obj):
         if 'location' in obj:
             loc = obj['location']
             if isinstance(loc, list):
                 for i in loc:
-                    self.updateposition(i)
+                    cls.updateposition(i)
             else:
-                self.updateposition(loc)
+                cls.updateposition(loc)
 
     # Prepare 'positions' for indexing
     @staticmethod
@@ -205,26 +273,18 @@ class Indexer(DBconnection):
         return r
 
     # Prepare UniProt entry for indexing
-    def update_entry(self, entry):
-        # Make sure type of 'gene' attr is list
-        if 'gene' in entry:
-            if not isinstance(entry['gene'], list):
-                entry['gene'] = [entry['gene']]
-            # Make sure type of 'gene.name' attribute is list
-            for gene in entry['gene']:
-                if not isinstance(gene['name'], list):
-                    gene['name'] = [gene['name']]
-        if 'comment' in entry:
-            if isinstance(entry['comment'], list):
-                for c in entry['comment']:
-                    self.updatecomment(c)
-                    self.updatelocation(c)
-            else:
-                self.updatecomment(entry['comment'])
-                self.updatelocation(entry['comment'])
-                entry['comment'] = [entry['comment']]
+    @classmethod
+    def update_entry(cls, entry):
+        # 'gene' and 'comment' attributes are read as lists,
+        # see FORCE_LIST; make sure type of 'gene.name' attribute is list
+        for gene in entry.get('gene', []):
+            if not isinstance(gene['name'], list):
+                gene['name'] = [gene['name']]
+        for c in entry.get('comment', []):
+            cls.updatecomment(c)
+            cls.updatelocation(c)
         if 'protein' in entry:
-            self.updateprotein(entry)
+            cls.updateprotein(entry)
         if 'reference' in entry:
             if isinstance(entry['reference'], list):
                 for r in entry['reference']:
@@ -232,16 +292,16 @@ class Indexer(DBconnection):
                         del r['source']
                     if 'date' in r['citation']:
                         c = r['citation']['date']
-                        r['citation']['date'] = self.checkdate(c)
+                        r['citation']['date'] = cls.checkdate(c)
             elif 'source' in entry['reference']:
                 del entry['reference']['source']
                 if 'date' in entry['reference']['citation']:
                     c = entry['reference']['citation']['date']
-                    entry['reference']['citation']['date'] = self.checkdate(c)
+                    entry['reference']['citation']['date'] = cls.checkdate(c)
 
         if 'feature' in entry:
-            self.updatefeatures(entry)
-        self.updatesequence(entry['sequence'])
+            cls.updatefeatures(entry)
+        cls.updatesequence(entry['sequence'])
 
 
 def mongodb_indices(mdb):
@@ -266,27 +326,53 @@ def mongodb_indices(mdb):
 
 
 def main(infile, esindex, mdbdb, mdbcollection, db, host=None, port=None,
-         recreateindex=False):
+         recreateindex=False, processes=None, uselxml=False, resume=False,
+         checkpointdb=CHECKPOINT_DB, metricsfile=None, xrefs=False):
     indxr = Indexer(db, esindex, mdbdb, mdbcollection, host, port,
-                    recreateindex=recreateindex)
-    indxr.parse_uniprot_xmlfiles(infile)
-    pool.close()
-    pool.join()
-    pool.terminate()
+                    recreateindex=recreateindex, resume=resume,
+                    checkpointdb=checkpointdb, xrefs=xrefs)
+    indxr.parse_uniprot_xmlfiles(infile, processes, uselxml)
+    indxr.pipeline.close()
+    indxr.pipeline.report()
+    indxr.writer.close()
+    if indxr.xrefwriter is not None:
+        indxr.xrefwriter.close()
+    indxr.checkpoint.close()
+    indxr.metrics.summary(metricsfile)
     if db == 'Elasticsearch':
         indxr.es.indices.refresh(index=esindex)
-    else:
+    elif db == 'MongoDB':
         mongodb_indices(indxr.mcl)
 
 
 if __name__ == '__main__':
+    logging.basicConfig(filename='uniprot-indexer.log',
+                        format='%(message)s',
+                        level=logging.WARNING)
     args = argparse.ArgumentParser(
         description='Index UniProt xml files,'
                     ' with Elasticsearch or MongoDB')
     args.add_argument('infile',
                       help='Input file name for UniProt Swiss-Prot compressed'
                            ' xml dataset')
+    args.add_argument('--processes', type=int,
+                      help='Number of processes for parsing UniProt entries,'
+                           ' by default entries are parsed in the main'
+                           ' process')
+    args.add_argument('--lxml', action='store_true',
+                      help='Parse UniProt entries with lxml,'
+                           ' faster than the default xmltodict parser')
+    args.add_argument('--xrefs', action='store_true',
+                      help='Save dbReference ids of the entries in'
+                           ' the xref lookup table')
     dbargs(args)
+    checkpointargs(args)
+    metricsargs(args)
     args = args.parse_args()
-    main(args.infile, args.esindex, args.mdbdb, args.mdbcollection,
-         args.dbtype, args.host, args.port)
+    run = main if args.profile is None else partial(profile, args.profile,
+                                                    main)
+    run(args.infile, args.esindex, args.mdbdb, args.mdbcollection,
+        args.dbtype, args.host, args.port, processes=args.processes,
+        uselxml=args.lxml, resume=args.resume,
+        checkpointdb=args.checkpointdb, metricsfile=args.metrics,
+        xrefs=args.xrefs)
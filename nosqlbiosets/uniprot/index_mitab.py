@@ -7,8 +7,6 @@ import csv
 import os
 import time
 
-from elasticsearch.helpers import streaming_bulk
-
 from nosqlbiosets.dbutils import DBconnection
 
 ES_CHUNK_SIZE = 2048  # for Elasticsearch index requests
@@ -47,31 +45,24 @@ def es_index(dbc, doctype, reader):
     print("Reading from %s" % reader.gi_frame.f_locals['infile'])
     i = 0
     t1 = time.time()
-    for ok, result in streaming_bulk(
-            dbc.es,
-            reader,
-            index=dbc.index,
-            doc_type=doctype,
-            chunk_size=ES_CHUNK_SIZE
-    ):
-        action, result = result.popitem()
-        i += 1
-        doc_id = '/%s/commits/%s' % (dbc.index, result['_id'])
-        if not ok:
-            print('Failed to %s document %s: %r' % (action, doc_id, result))
+    with dbc.bulkwriter(doctype=doctype, chunksize=ES_CHUNK_SIZE) as writer:
+        for entry in reader:
+            writer.add(entry)
+            i += 1
     t2 = time.time()
     print("-- Processed %d entries, in %d sec"
           % (i, (t2 - t1)))
     return 1
 
 
-def mongodb_index(mdbc, infile, reader):
+def mongodb_index(dbc, infile, reader):
     print("Reading from %s" % infile)
     i = 0
     t1 = time.time()
-    for entry in read_mitab_datafile(infile, reader):
-        mdbc.insert(entry)
-        i += 1
+    with dbc.bulkwriter(upsert=False) as writer:
+        for entry in read_mitab_datafile(infile, reader):
+            writer.add(entry)
+            i += 1
     t2 = time.time()
     print("-- Processed %d entries, in %d sec"
           % (i, (t2 - t1)))
@@ -79,13 +70,16 @@ def mongodb_index(mdbc, infile, reader):
 
 
 def main(infile, index, doctype, db, host=None, port=None):
-    dbc = DBconnection(db, index, host, port)
+    dbc = DBconnection(db, index, host, port, mdbcollection=doctype)
     if db == 'Elasticsearch':
         es_index(dbc, doctype, read_mitab_datafile(infile, updatemitabrecord))
         dbc.es.indices.refresh(index=index)
+    elif db == 'File':
+        dbc.removefiles(doctype)
+        mongodb_index(dbc, infile, updatemitabrecord)
     else:  # assume MongoDB
         dbc.mdbi.drop_collection(doctype)
-        mongodb_index(dbc.mdbi[doctype], infile, updatemitabrecord)
+        mongodb_index(dbc, infile, updatemitabrecord)
         indx_fields = ["idA", "idB", "idsA", "idsB"]
         for field in indx_fields:
             dbc.mdbi[doctype].create_index(field)
@@ -109,7 +103,8 @@ if __name__ == '__main__':
     parser.add_argument('--port',
                         help="Elasticsearch or MongoDB server port")
     parser.add_argument('--db', default='Elasticsearch',
-                        help="Database: 'Elasticsearch' or 'MongoDB'")
+                        help="Database: 'Elasticsearch' or 'MongoDB',"
+                             " or 'File' for writing to NDJSON files")
     args = parser.parse_args()
 
     main(args.infile, args.index, args.doctype, args.db, args.host, args.port)
@@ -10,6 +10,8 @@ from pymongo import IndexModel
 
 from nosqlbiosets.dbutils import DBconnection
 from nosqlbiosets.objutils import num, unifylistattribute
+from nosqlbiosets.xmlutils import parse_xmlrecords
+from nosqlbiosets.xrefs import XrefWriter
 
 MDBCOLLECTION = 'interpro'
 
@@ -18,7 +20,7 @@ class Indexer(DBconnection):
 
     def __init__(self, db, esindex, mdbdb='biosets',
                  mdbcollection=MDBCOLLECTION,
-                 host=None, port=None, recreateindex=True):
+                 host=None, port=None, recreateindex=True, xrefs=False):
         self.mdbcollection = mdbcollection
         self.index = esindex if db == 'Elasticsearch' else mdbdb
         self.db = db
@@ -31,23 +33,41 @@ class Indexer(DBconnection):
         if db == "MongoDB":
             self.mcl = self.mdbi[self.mdbcollection]
             self.mcl.drop()
+        elif db == "File":
+            self.removefiles(self.mdbcollection)
+        self.writer = self.bulkwriter(collection=self.mdbcollection,
+                                      optype='create', upsert=False)
+        # member database and external references are saved in
+        # the xref lookup table if xrefs is set
+        self.xrefwriter = XrefWriter(
+            self, self.index if db == 'Elasticsearch' else mdbcollection,
+            recreate=recreateindex) if xrefs else None
 
     # Read and Index entries in InterPro xml file
-    def parse_interpro_xmlfiles(self, infile):
+    # If processes is set entries are parsed in worker processes
+    def parse_interpro_xmlfiles(self, infile, processes=None):
         infile = str(infile)
         print("Reading/indexing %s " % infile)
         if infile.endswith(".gz"):
             with GzipFile(infile) as inf:
-                xmltodict.parse(inf, item_depth=2,
-                                item_callback=self.index_interpro_entry,
-                                attr_prefix='')
+                self.parse_interpro_xml(inf, processes)
         else:
             with open(infile, 'rb') as inf:
-                xmltodict.parse(inf, item_depth=2,
-                                item_callback=self.index_interpro_entry,
-                                attr_prefix='')
+                self.parse_interpro_xml(inf, processes)
+        self.writer.close()
+        if self.xrefwriter is not None:
+            self.xrefwriter.close()
         print("\nCompleted")
 
+    def parse_interpro_xml(self, inf, processes=None):
+        if processes is None:
+            xmltodict.parse(inf, item_depth=2,
+                            item_callback=self.index_interpro_entry,
+                            attr_prefix='')
+        else:
+            parse_xmlrecords(inf, self.index_interpro_entry, 'interpro',
+                             processes, attr_prefix='')
+
     def index_interpro_entry(self, _c, entry):
         def index(__c, _entry):
             try:
@@ -55,14 +75,8 @@ class Indexer(DBconnection):
                 _entry.update(__c[1][1])
                 docid = _entry['id']
                 self.update_entry(_entry)
-                if self.db == "Elasticsearch":
-                    self.es.index(index=self.index,
-                                  op_type='create', ignore=409,
-                                  filter_path=['hits.hits._id'],
-                                  id=docid, body=_entry)
-                else:  # assume MongoDB
-                    _entry["_id"] = docid
-                    self.mcl.insert_one(_entry)
+                self.writer.add(_entry, docid=docid)
+                self.addxrefs(_entry, docid)
             except Exception as e:
                 print("ERROR: %s" % e)
                 print(traceback.format_exc())
@@ -76,6 +90,15 @@ class Indexer(DBconnection):
             index(_c, entry)
         return True
 
+    def addxrefs(self, entry, docid):
+        if self.xrefwriter is None:
+            return
+        for l in ['external_doc_list', 'member_list']:
+            if l in entry:
+                refs = entry[l]['db_xref']
+                for ref in refs if isinstance(refs, list) else [refs]:
+                    self.xrefwriter.add(ref['db'], ref['dbkey'], docid)
+
     def update_entry(self, entry):
         del entry['id']
         num(entry, "protein_count", int)
@@ -105,14 +128,15 @@ def mongodb_indices(mdb):
 
 
 def main(infile, dbtype, esindex, mdbcollection='interpro', mdbdb='biosets',
-         host=None, port=None, recreateindex=True):
+         host=None, port=None, recreateindex=True, processes=None,
+         xrefs=False):
     indxr = Indexer(dbtype, esindex, mdbdb=mdbdb,
                     host=host, port=port, mdbcollection=mdbcollection,
-                    recreateindex=recreateindex)
-    indxr.parse_interpro_xmlfiles(infile)
+                    recreateindex=recreateindex, xrefs=xrefs)
+    indxr.parse_interpro_xmlfiles(infile, processes)
     if dbtype == 'Elasticsearch':
         indxr.es.indices.refresh(index=esindex)
-    else:
+    elif dbtype == 'MongoDB':
         mongodb_indices(indxr.mcl)
 
 
@@ -124,7 +148,15 @@ if __name__ == '__main__':
     args.add_argument('infile',
                       help='Input file name for interpro'
                            ' xml file')
+    args.add_argument('--processes', type=int,
+                      help='Number of processes for parsing InterPro entries,'
+                           ' by default entries are parsed in the main'
+                           ' process')
+    args.add_argument('--xrefs', action='store_true',
+                      help='Save member database and external references'
+                           ' of the entries in the xref lookup table')
     dbargs(args)
     args = args.parse_args()
     main(args.infile, args.dbtype, args.esindex, args.mdbcollection,
-         args.mdbdb, args.host, args.port, args.recreateindex)
+         args.mdbdb, args.host, args.port, args.recreateindex, args.processes,
+         args.xrefs)
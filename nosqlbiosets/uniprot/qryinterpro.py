@@ -6,8 +6,23 @@ from nosqlbiosets.qryutils import Query
 
 class QueryInterPro(Query):
 
+    # Names of the InterPro entries of the member database or external ids,
+    # ids of more than one InterPro entry are given the name of the entry
+    # with the smallest InterPro id, ids without entries are not included
     def id2names(self, ids):
-        assert self.dbc.db == "MongoDB"
+        assert self.dbc.db != "Elasticsearch"
+        xrefs = self.resolve_xrefs(ids, None)
+        if xrefs is not None:  # xref rows were saved
+            iprids = set(i for v in xrefs.values() for i in v)
+            r = self.query({"_id": {"$in": list(iprids)}},
+                           projection=["name"])
+            iprnames = {e['_id']: e['name'] for e in r}
+            names = dict()
+            for i, v in xrefs.items():
+                v = sorted(iprid for iprid in v if iprid in iprnames)
+                if v:
+                    names[i] = iprnames[v[0]]
+            return names
         qc = [
             {"$match":
                 {"$or": [
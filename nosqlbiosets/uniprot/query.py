@@ -2,10 +2,17 @@
 """ Query UniProt data indexed with MongoDB or Elasticsearch """
 # Server connection details are read from conf/dbservers.json file
 
-from collections import OrderedDict
+import sys
+from collections import OrderedDict, deque
+from itertools import islice
+from multiprocessing.pool import ThreadPool
 
 from nosqlbiosets.qryutils import Query
 
+IDMATCH_BATCH_SIZE = 1000  # Number of ids resolved with each query
+IDMATCH_THREADS = 4  # Number of queries run concurrently
+HUMAN = "9606"  # NCBI taxonomy id
+
 
 class QueryUniProt(Query):
 
@@ -13,7 +20,7 @@ class QueryUniProt(Query):
     def getaccs(self, ecn, reftype="EC"):
         qc = {"dbReference.id": ecn, "dbReference.type": reftype}
         key = 'accession'
-        r = self.dbc.mdbi[self.mdbcollection].distinct(key, filter=qc)
+        r = self.distinct(key, qc)
         return r
 
     # Get names and abundance of the genes for given enzyme
@@ -70,8 +77,9 @@ class QueryUniProt(Query):
         return r
 
     def getgeneids(self, qc, limit=1000):
-        """ Given query return matching genes primary name and Entrez ids """
-        assert self.dbc.db == 'MongoDB'
+        """ Given query return matching genes primary name and Entrez ids,
+            for all matching entries if limit is None """
+        assert self.dbc.db != 'Elasticsearch'
         aggq = [
             {"$match": qc},
             {"$project": {"dbReference": 1, "gene": 1}},
@@ -83,15 +91,72 @@ class QueryUniProt(Query):
             {"$unwind": "$gene.name"},
             {"$match": {"gene.name.type": "primary"}},
             {"$project": {
-                "gid": 1, "gene": "$gene.name.#text"}},
-            {"$limit": limit}
+                "gid": 1, "gene": "$gene.name.#text"}}
         ]
+        if limit is not None:
+            aggq.append({"$limit": limit})
         cr = self.aggregate_query(aggq)
         r = set()
         for i in cr:
             r.add((i['_id'], int(i['gid']), i['gene']))
         return r
 
+    def resolveids(self, ids, organism=HUMAN, batchsize=IDMATCH_BATCH_SIZE,
+                   threads=IDMATCH_THREADS):
+        """ Given mixed UniProt names, gene names and Entrez gene ids,
+        yield (UniProt name, Entrez id, primary gene name) tuples of the
+        matching entries, for organism given with its NCBI taxonomy id,
+        or for all organisms if it is None
+
+        Ids are resolved in batches of batchsize ids, with `threads`
+        concurrent queries; input ids are read as the batches are submitted,
+        at most `threads` batches ahead of the results yielded.
+        Results are yielded in the order of the batches, entries matched
+        in more than one batch are yielded once. Each branch of the query
+        uses the indexes of the name, gene.name.#text and dbReference.id
+        fields
+        """
+        def batches():
+            it = iter(ids)
+            while True:
+                batch = list(set(islice(it, batchsize)))
+                if not batch:
+                    return
+                yield batch
+
+        def resolve(batch):
+            qc = {"$or": [
+                {'name': {"$in": batch}},
+                {'gene.name.#text': {"$in": batch}},
+                {"dbReference": {'$elemMatch': {
+                    "id": {"$in": batch},
+                    "type": "GeneID"}}}
+            ]}
+            if organism is not None:
+                qc["organism.dbReference.id"] = organism
+            return self.getgeneids(qc, limit=None)
+
+        pool = ThreadPool(threads)
+        pending = deque()  # results of the submitted batches
+        seen = set()  # entries yielded
+
+        def results():
+            for i in pending.popleft().get():
+                if i not in seen:
+                    seen.add(i)
+                    yield i
+        try:
+            for batch in batches():
+                pending.append(pool.apply_async(resolve, (batch,)))
+                if len(pending) >= threads:
+                    for i in results():
+                        yield i
+            while pending:
+                for i in results():
+                    yield i
+        finally:
+            pool.terminate()
+
     # Find abundance of annotations for the set specified by the query clause
     def getannotations(self, qc, annottype="GO"):
         assert self.dbc.db == 'MongoDB'
@@ -149,28 +214,28 @@ class QueryUniProt(Query):
             assert ecn is not None
             qc = {"dbReference.id": ecn}
         if self.dbc.db == 'Elasticsearch':
-            qc = {"query": {"match": qc},
-                  "_source": "organism.name"
-                  }
-            hits, n, _ = self.esquery(self.index, qc, size=limit)
+            qc = {
+                "query": {"match": qc},
+                "aggs": {
+                    "organisms": {
+                        "terms": {
+                            "field": "organism.name.type.keyword",
+                        },
+                        "aggs": {
+                            "name": {
+                                "terms": {
+                                    "field": "organism.name.#text.keyword",
+                                    "size": limit
+                                }}}}}}
+            hits, n, aggs = self.esquery(self.index, qc, size=0)
+            # most abundant organism names, as with the MongoDB query
+            top = sorted(((j['doc_count'], i['key'], j['key'])
+                          for i in aggs['organisms']['buckets']
+                          for j in i['name']['buckets']),
+                         key=lambda x: -x[0])[:limit]
             rr = dict()
-
-            def digestnames(name):
-                nametype_ = name['type']
-                organism = name['#text']
-                if nametype_ not in rr:
-                    rr[nametype_] = OrderedDict()
-                if organism in rr[nametype_]:
-                    rr[nametype_][organism] += 1
-                else:
-                    rr[nametype_][organism] = 1
-
-            for names in [hit['_source']['organism']['name'] for hit in hits]:
-                if isinstance(names, list):
-                    for name_ in names:
-                        digestnames(name_)
-                else:
-                    digestnames(names)
+            for n, nametype, organism in top:
+                rr.setdefault(nametype, OrderedDict())[organism] = n
         else:
             aggq = [
                 {"$match": qc},
@@ -265,12 +330,17 @@ class QueryUniProt(Query):
             {"$sort": {"total": -1}},
             {"$limit": limit}
         ]
-        r = self.dbc.mdbi[self.mdbcollection].aggregate(aggq)
+        r = self.aggregate_query(aggq)
         return r
 
     # Get UniProt names(=ids) for given KEGG gene ids
     def getnamesforkegg_geneids(self, kgids, db="MongoDB"):
-        if db == 'Elasticsearch':
+        xrefs = self.resolve_xrefs(kgids, "KEGG")
+        if xrefs is not None:  # xref rows were saved
+            r = []
+            for names in xrefs.values():
+                r.extend(name for name in names if name not in r)
+        elif db == 'Elasticsearch':
             # esc = DBconnection(db, self.index)
             qc = {"terms": {
                 "dbReference.id.keyword": kgids}}
@@ -279,7 +349,7 @@ class QueryUniProt(Query):
         else:
             qc = {"dbReference.id": {'$in': kgids}}
             key = 'name'
-            r = self.dbc.mdbi[self.mdbcollection].distinct(key, filter=qc)
+            r = self.distinct(key, qc)
         return r
 
     def top_annotation_pairs(self, qc, limit=10):
@@ -322,33 +392,31 @@ class QueryUniProt(Query):
         return r
 
 
-def idmatch(idlist, limit=100, mdbdb="biosets", mdbcollection="uniprot", **kwargs):
+def idmatch(idlist, limit=100, mdbdb="biosets", mdbcollection="uniprot",
+            organism=HUMAN, batchsize=IDMATCH_BATCH_SIZE,
+            threads=IDMATCH_THREADS, **kwargs):
     """ Given mixed protein/gene ids return Entrez id and primary gene name
-    for each matching UniProt record """
+    for each matching UniProt record, of the organism given with its NCBI
+    taxonomy id, 'any' for all organisms; at most limit records,
+    or all matching records if limit is 0
+
+    If idlist is '-' ids are read from stdin, one id per line,
+    and matching records are printed as they are found
+    """
     qry = QueryUniProt("MongoDB", mdbdb, mdbcollection, **kwargs)
-    import sys
     if idlist == '-':
-        ids = []
-        for line in sys.stdin:
-            ids.append(line.strip())
+        ids = (line.strip() for line in sys.stdin if line.strip())
     else:
         ids = idlist.split(", ")
-    qc = {
-        "organism.dbReference.id": "9606",
-        "$or": [
-            {'name': {"$in": ids}},
-            {'gene.name.#text': {"$in": ids}},
-            {"dbReference": {'$elemMatch': {
-                "id": {"$in": ids},
-                "type": "GeneID"}}}
-        ]
-    }
-    r = qry.getgeneids(qc, limit)
+    organism = None if organism == 'any' else organism
+    r = qry.resolveids(ids, organism, batchsize, threads)
+    if limit:
+        r = islice(r, limit)
     if idlist == '-':
         for i in r:
             print("%s, %d, %s" % (i[0], i[1], i[2]))
     else:
-        return r
+        return set(r)
 
 
 if __name__ == '__main__':
@@ -4,25 +4,38 @@
 from __future__ import print_function
 
 import argparse
-import traceback
+from functools import partial
 from gzip import GzipFile
-from multiprocessing.pool import ThreadPool
 
 import xmltodict
 from pymongo import IndexModel
 from six import string_types
 
+from nosqlbiosets.checkpoint import Checkpoint, checkpointargs, \
+    CHECKPOINT_DB, CHECKPOINT_INTERVAL
 from nosqlbiosets.dbutils import DBconnection, dbargs
+from nosqlbiosets.metrics import metricsargs, profile
 from nosqlbiosets.objutils import unifylistattribute, num
+from nosqlbiosets.pipeline import Pipeline
+from nosqlbiosets.xmlutils import ListChildren, lxml_parse, \
+    parse_xmlrecords
 
-pool = ThreadPool(30)   # Threads for index calls, parsing is in the main thread
+THREADS = 30  # Threads for index calls, parsing is in the main thread
 MAX_QUEUED_JOBS = 1400  # Maximum number of index jobs in queue
+# Objects of the list attributes, always read as lists by the xml parsers
+FORCE_LIST = ListChildren([
+    ('RCVList', 'RCVAccession'),
+    ('InterpretedConditionList', 'InterpretedCondition'),
+    ('ClinicalAssertionList', 'ClinicalAssertion'),
+    ('ObservedInList', 'ObservedIn'),
+    ('MolecularConsequenceList', 'MolecularConsequence')])
 
 
 class Indexer(DBconnection):
 
     def __init__(self, dbtype, mdbdb, mdbcollection, esindex=None, host=None,
-                 port=None, recreateindex=True):
+                 port=None, recreateindex=True, resume=False,
+                 checkpointdb=CHECKPOINT_DB):
         self.index = mdbdb if dbtype == 'MongoDB' else esindex
         self.dbtype = dbtype
         self.i = 1
@@ -33,29 +46,83 @@ class Indexer(DBconnection):
         super(Indexer, self).__init__(dbtype, self.index, host, port,
                                       mdbcollection=mdbcollection,
                                       es_indexsettings=indxcfg,
-                                      recreateindex=recreateindex)
+                                      recreateindex=recreateindex and
+                                      not resume)
         if dbtype == "MongoDB":
             self.mcl = self.mdbi[mdbcollection]
-            self.mcl.drop()
+            if not resume:
+                self.mcl.drop()
+        elif dbtype == "File" and not resume:
+            self.removefiles(mdbcollection)
+        # entries read again after the last checkpoint are replaced
+        # when resumed
+        self.writer = self.bulkwriter(collection=mdbcollection,
+                                      doctype="_doc", upsert=resume,
+                                      threads=4)
+        self.checkpoint = Checkpoint("clinvar:%s:%s:%s" % (
+            dbtype, self.index, mdbcollection), checkpointdb, resume)
+        self.infile = None
+        self.offset = 0     # number of entries indexed in the earlier runs
+        self.nrecords = 0   # number of entries read from the input file
+        self.pipeline = Pipeline(THREADS, MAX_QUEUED_JOBS, 'clinvar')
 
     # Read and Index entries in ClinVar xml file
-    def parse_and_index_xmlfile(self, infile):
+    # If processes is set entries are parsed and updated in worker processes
+    # If uselxml is set entries are parsed with lxml instead of xmltodict
+    def parse_and_index_xmlfile(self, infile, processes=None, uselxml=False):
         infile = str(infile)
+        if self.checkpoint.completed(infile):
+            print("%s has been indexed before, skipping" % infile)
+            return
+        self.infile = infile
+        self.offset = self.checkpoint.offset(infile)
+        self.nrecords = 0
         print("Reading/indexing %s " % infile)
+        if self.offset > 0:
+            print("Skipping the first %d entries, indexed before"
+                  % self.offset)
         if infile.endswith(".gz"):
             with GzipFile(infile) as inf:
-                xmltodict.parse(inf, item_depth=2,
-                                item_callback=self.index_clinvar_entry,
-                                xml_attribs=True,
-                                attr_prefix='')
+                self.parse_and_index_xml(self.metrics.reader(inf),
+                                         processes, uselxml)
         else:
             with open(infile, 'rb') as inf:
-                xmltodict.parse(inf, item_depth=2,
-                                item_callback=self.index_clinvar_entry,
-                                xml_attribs=True,
-                                attr_prefix='')
+                self.parse_and_index_xml(self.metrics.reader(inf),
+                                         processes, uselxml)
+        self.savecheckpoint(completed=True)
 
-    def index_clinvar_entry(self, _, entry):
+    # Wait for the pending index calls and bulk writes,
+    # then save number of entries indexed, if no index calls or writes failed
+    def savecheckpoint(self, completed=False):
+        self.pipeline.wait()
+        self.writer.sync()
+        self.checkpoint.commit(self.infile, self.nrecords,
+                               self.pipeline.nfailed + self.writer.nerrors,
+                               completed)
+
+    # Time spent in the parsers, between the entry callbacks, is recorded
+    # as 'parse' time, time spent in the callbacks as 'submit' time
+    def parse_and_index_xml(self, inf, processes=None, uselxml=False):
+        self.metrics.lap()
+        if processes is None and uselxml:
+            lxml_parse(inf, 2, self.index_clinvar_entry, 'VariationArchive',
+                       xml_attribs=True, attr_prefix='',
+                       force_list=FORCE_LIST)
+        elif processes is None:
+            xmltodict.parse(inf, item_depth=2,
+                            item_callback=self.index_clinvar_entry,
+                            xml_attribs=True,
+                            attr_prefix='', force_list=FORCE_LIST)
+        else:
+            parse_xmlrecords(inf, partial(self.index_clinvar_entry,
+                                          tuned=True),
+                             'VariationArchive', processes,
+                             tuner=self.update_entry, uselxml=uselxml,
+                             xml_attribs=True, attr_prefix='',
+                             force_list=FORCE_LIST)
+
+    def index_clinvar_entry(self, _, entry, tuned=False):
+        self.metrics.lap('parse')
         def index():
             rtype = 'InterpretedRecord' if 'InterpretedRecord' in entry \
                 else 'IncludedRecord'
@@ -65,32 +132,26 @@ class Indexer(DBconnection):
                 else 'Genotype'
             docid = int(r[_type]['VariationID'])
             try:
-                self.update_entry(entry)
-                if self.dbtype == "Elasticsearch":
-                    self.es.index(index=self.index,
-                                  doc_type="_doc",
-                                  ignore=409,
-                                  filter_path=['hits.hits._id'],
-                                  id=docid, body=entry)
-                else:  # assume MongoDB
-                    entry["_id"] = docid
-                    self.mcl.insert_one(entry,
-                                        bypass_document_validation=True)
+                if not tuned:
+                    with self.metrics.timer('transform'):
+                        self.update_entry(entry)
+                self.writer.add(entry, docid=docid)
                 self.reportprogress(1000)
-                return True
             except Exception as e:
                 print("ERROR (docid=%d): %s" % (docid, e))
-                print(traceback.format_exc())
-                return False
-
-        if pool._inqueue.qsize() > MAX_QUEUED_JOBS:
-            from time import sleep
-            print('sleeping 1 sec')
-            sleep(1)
-        pool.apply_async(index, [])
+                raise
+
+        self.nrecords += 1
+        if self.nrecords <= self.offset:
+            return True
+        self.pipeline.submit(index)
+        if self.nrecords % CHECKPOINT_INTERVAL == 0:
+            self.savecheckpoint()
+        self.metrics.lap('submit')
         return True
 
-    def update_synonyms(self, sa):  # SimpleAllele
+    @classmethod
+    def update_synonyms(cls, sa):  # SimpleAllele
         if 'OtherNameList' in sa:
             unifylistattribute(sa, "OtherNameList", "Name",
                                renamelistto='otherNames')
@@ -99,22 +160,25 @@ class Indexer(DBconnection):
                     sa['otherNames'][i] = {'#text': name}
 
     # genotype or haplotype
-    def update_genotype_haplotype(self, catype):
+    @classmethod
+    def update_genotype_haplotype(cls, catype):
         if 'SimpleAllele' in catype:
             sa = catype['SimpleAllele']
             if isinstance(sa, list):
                 for i in sa:
-                    self.update_simpleallele(i)
+                    cls.update_simpleallele(i)
             else:
-                self.update_simpleallele(sa)
+                cls.update_simpleallele(sa)
 
-    def update_date(self, ca):
+    @classmethod
+    def update_date(cls, ca):
         if "DateLastEvaluated" in ca["Interpretation"] \
                 and len(ca["Interpretation"]["DateLastEvaluated"]) > 10:
             ca["Interpretation"]["DateLastEvaluated"] = \
                 ca["Interpretation"]["DateLastEvaluated"][:10]
 
-    def update_comment(self, ca):
+    @classmethod
+    def update_comment(cls, ca):
         if 'Comment' in ca:
             if not isinstance(ca['Comment'], list):
                 ca['Comment'] = [ca['Comment']]
@@ -122,25 +186,27 @@ class Indexer(DBconnection):
                 if isinstance(c, string_types):
                     ca['Comment'][i] = {'#text': c}
 
-    def update_simpleallele(self, sa):
-        self.update_synonyms(sa)
-        self.update_comment(sa)
+    @classmethod
+    def update_simpleallele(cls, sa):
+        cls.update_synonyms(sa)
+        cls.update_comment(sa)
         unifylistattribute(sa,
                            "MolecularConsequenceList",
                            "MolecularConsequence",
                            renamelistto='molecularConsequence')
         if 'molecularConsequence' in sa:
-            self.update_comment(sa['molecularConsequence'])
+            cls.update_comment(sa['molecularConsequence'])
         if 'FunctionalConsequence' in sa:
-            self.update_comment(sa['FunctionalConsequence'])
+            cls.update_comment(sa['FunctionalConsequence'])
         num(sa, 'AlleleID')
         num(sa, 'VariationID')
 
-    def update_entry(self, entry):  # ClinVar Variation Archive entry
+    @classmethod
+    def update_entry(cls, entry):  # ClinVar Variation Archive entry
         if 'InterpretedRecord' in entry:
             ir = entry['InterpretedRecord']
             if 'SimpleAllele' in ir:
-                self.update_simpleallele(ir['SimpleAllele'])
+                cls.update_simpleallele(ir['SimpleAllele'])
             if 'RCVList' in ir:
                 unifylistattribute(ir, "RCVList", "RCVAccession",
                                    renamelistto='rcv')
@@ -159,33 +225,33 @@ class Indexer(DBconnection):
             for ca in ir['clinicalAssertion']:
                 num(ca, 'ID')
                 if "Interpretation" in ca:
-                    self.update_date(ca)
-                    self.update_comment(ca['Interpretation'])
+                    cls.update_date(ca)
+                    cls.update_comment(ca['Interpretation'])
 
                 unifylistattribute(ca, "ObservedInList", "ObservedIn",
                                    renamelistto='observedIn')
                 if 'SimpleAllele' in ca:
                     sa = ca['SimpleAllele']
-                    self.update_simpleallele(sa)
+                    cls.update_simpleallele(sa)
 
                 if 'Genotype' in ca:
-                    self.update_genotype_haplotype(ca['Genotype'])
+                    cls.update_genotype_haplotype(ca['Genotype'])
                 if 'Haplotype' in ca:
-                    self.update_genotype_haplotype(ca['Haplotype'])
+                    cls.update_genotype_haplotype(ca['Haplotype'])
                 if 'TraitSet' in ca:
-                    self.update_comment(ca['TraitSet'])
+                    cls.update_comment(ca['TraitSet'])
 
-                self.update_comment(ca)
+                cls.update_comment(ca)
                 for o in ca['observedIn']:
-                    self.update_comment(o)
+                    cls.update_comment(o)
                     if not isinstance(o['Sample']['Species'], string_types):
                         o['Sample']['Species'] = o['Sample']['Species']['#text']
                     if 'TraitSet' in o:
-                        self.update_comment(o['TraitSet'])
+                        cls.update_comment(o['TraitSet'])
                     if 'ObservedData' in o:
-                        self.update_comment(o['ObservedData'])
+                        cls.update_comment(o['ObservedData'])
                     if 'Method' in o and 'ObsMethodAttribute' in o['Method']:
-                        self.update_comment(o['Method']['ObsMethodAttribute'])
+                        cls.update_comment(o['Method']['ObsMethodAttribute'])
 
 
 def mongodb_indices(mdb):
@@ -222,17 +288,21 @@ def mongodb_indices(mdb):
 
 
 def main(infile, dbtype, mdbdb, mdbcollection, esindex, host=None, port=None,
-         recreateindex=True):
+         recreateindex=True, processes=None, uselxml=False, resume=False,
+         checkpointdb=CHECKPOINT_DB, metricsfile=None):
     indxr = Indexer(dbtype, mdbdb, mdbcollection, esindex, host, port,
-                    recreateindex=recreateindex)
-    indxr.parse_and_index_xmlfile(infile)
-    pool.close()
-    pool.join()
-    pool.terminate()
+                    recreateindex=recreateindex, resume=resume,
+                    checkpointdb=checkpointdb)
+    indxr.parse_and_index_xmlfile(infile, processes, uselxml)
+    indxr.pipeline.close()
+    indxr.pipeline.report()
+    indxr.writer.close()
+    indxr.checkpoint.close()
+    indxr.metrics.summary(metricsfile)
     print("\nCompleted reading and indexing the ClinVar entries")
     if dbtype == 'Elasticsearch':
         indxr.es.indices.refresh(index=esindex)
-    else:
+    elif dbtype == 'MongoDB':
         mongodb_indices(indxr.mcl)
 
 
@@ -243,7 +313,20 @@ if __name__ == '__main__':
     args.add_argument('infile',
                       help='Input file name of ClinVar Variation Archive,'
                            ' compressed or uncompressed xml file')
+    args.add_argument('--processes', type=int,
+                      help='Number of processes for parsing ClinVar entries,'
+                           ' by default entries are parsed in the main'
+                           ' process')
+    args.add_argument('--lxml', action='store_true',
+                      help='Parse ClinVar entries with lxml,'
+                           ' faster than the default xmltodict parser')
     dbargs(args, mdbcollection='clinvarvariation', esindex='clinvarvariation')
+    checkpointargs(args)
+    metricsargs(args)
     args = args.parse_args()
-    main(args.infile, args.dbtype, args.mdbdb, args.mdbcollection, args.esindex,
-         args.host, args.port)
+    run = main if args.profile is None else partial(profile, args.profile,
+                                                    main)
+    run(args.infile, args.dbtype, args.mdbdb, args.mdbcollection, args.esindex,
+        args.host, args.port, processes=args.processes,
+        uselxml=args.lxml, resume=args.resume,
+        checkpointdb=args.checkpointdb, metricsfile=args.metrics)
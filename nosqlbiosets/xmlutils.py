@@ -0,0 +1,452 @@
+""" Multi-process and lxml based parsing of record oriented xml files.
+
+ Most xml datasets supported by nosqlbiosets project are sequences of
+ records under a root element, such as UniProt <entry>, DrugBank <drug>
+ or ClinVar <VariationArchive> records. xmltodict.parse() calls with the
+ item_callback option parse these files in the main process only.
+ Here parse_xmlrecords() splits the input stream on record boundaries
+ and ships the raw record bytes to a process pool, where the records are
+ parsed with xmltodict and optionally updated with a tuner function.
+ Parsed records are passed to the item_callback in the main process,
+ in the same order as they appear in the input files.
+ lxml_parse() is an alternative to xmltodict.parse() based on
+ lxml.etree.iterparse(), it returns records in the same form
+ as xmltodict.parse() but is faster.
+"""
+import re
+from collections import deque
+from multiprocessing import Pool, cpu_count
+
+import xmltodict
+
+BLOCK_SIZE = 4 * 1024 * 1024  # Size of the blocks read from input streams
+BATCH_SIZE = 64               # Number of records sent to workers per task
+
+_WRAPPER = b'nosqlbiosets-record'
+_STARTTAG = re.compile(br'<([^?!/\s>]+)([^>]*)>')
+_XMLNS = 'http://www.w3.org/XML/1998/namespace'
+_NSDECL = re.compile(br'''\sxmlns(?::[^\s=]+)?\s*=\s*(?:"[^"]*"|'[^']*')''')
+
+# Worker process state, set by _initworker()
+_header = None
+_tuner = None
+_uselxml = False
+_kwargs = None
+
+
+def iter_xmlrecords(inf, recordtag=None, blocksize=BLOCK_SIZE):
+    """
+    Split xml stream into the byte strings of records with given tag name
+    Records with the same tag name nested in records are not split.
+    Record tags in comments or CDATA sections are not recognized.
+    First element found is the prefix, bytes before the first record,
+    which includes the xml declaration and the start tag of the root element
+    :param inf: xml input stream opened in binary mode
+    :param recordtag: name of the record elements, if not specified
+                      name of the first child element of the root is used
+    """
+    buf = b''
+    eof = False
+    prefix = None
+    tagre = None
+    depth, start, pos = 0, 0, 0
+    while not eof:
+        block = inf.read(blocksize)
+        eof = len(block) == 0
+        buf += block
+        if prefix is None:
+            if recordtag is None:
+                recordtag = _firstchildtag(buf)
+                if recordtag is None:
+                    continue
+            if isinstance(recordtag, str):
+                recordtag = recordtag.encode()
+            tagre = re.compile(br'<(/?)' + re.escape(recordtag) +
+                               br'(?=[\s/>])')
+            m = tagre.search(buf)
+            if m is None:
+                if eof:
+                    yield buf
+                continue
+            prefix = buf[:m.start()]
+            yield prefix
+            buf = buf[m.start():]
+        m = None
+        for m in tagre.finditer(buf, pos):
+            gt = buf.find(b'>', m.end())
+            if gt == -1:
+                break  # incomplete tag, wait for more data
+            pos = gt + 1
+            if m.group(1):  # end tag
+                depth -= 1
+                if depth == 0:
+                    yield buf[start:pos]
+            elif buf[gt - 1:gt] == b'/':  # empty element tag
+                if depth == 0:
+                    yield buf[m.start():pos]
+            else:
+                if depth == 0:
+                    start = m.start()
+                depth += 1
+            m = None
+        # drop processed bytes, keep bytes that may start a tag
+        tail = len(buf) - len(recordtag) - 2
+        if depth == 0:
+            cut = pos if m is not None else max(pos, tail)
+            pos = 0
+        else:
+            cut = start
+            pos = (pos if m is not None else max(pos, tail)) - cut
+            start = 0
+        buf = buf[cut:]
+    if depth > 0:
+        raise ValueError("Incomplete '%s' record at the end of input"
+                         % recordtag.decode())
+
+
+def _firstchildtag(buf):
+    # Name of the first element under the root element, None if not found
+    root = None
+    for m in _STARTTAG.finditer(buf):
+        if root is None:
+            root = m
+        else:
+            return m.group(1)
+    return None
+
+
+def _rootpath(prefix, **kwargs):
+    # xmltodict path entry for the root element, as (name, attributes)
+    m = _STARTTAG.search(prefix)
+    if m is None:
+        return None
+    path = []
+    tag = m.group(0).rstrip(b'>').rstrip(b'/') + b'/>'
+    xmltodict.parse(tag, item_depth=1,
+                    item_callback=lambda p, _: path.extend(p) or True,
+                    **kwargs)
+    return path[0]
+
+
+def _parse_record(record, header, tuner, kwargs, uselxml=False):
+    r = []
+
+    def collect(path, item):
+        if tuner is not None and not isinstance(item, str):
+            tuner(item)
+        r.append((path[1], item))
+        return True
+    xml = header + record + b'</' + _WRAPPER + b'>'
+    if uselxml:
+        from io import BytesIO
+        lxml_parse(BytesIO(xml), item_depth=2, item_callback=collect,
+                   **kwargs)
+    else:
+        xmltodict.parse(xml, item_depth=2, item_callback=collect, **kwargs)
+    return r[0]
+
+
+def _initworker(header, tuner, kwargs, uselxml=False):
+    global _header, _tuner, _kwargs, _uselxml
+    _header, _tuner, _kwargs, _uselxml = header, tuner, kwargs, uselxml
+
+
+def _parse_batch(records):
+    return [_parse_record(record, _header, _tuner, _kwargs, _uselxml)
+            for record in records]
+
+
+def _batches(records, batchsize):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == batchsize:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def parse_xmlrecords(inf, item_callback, recordtag=None, processes=None,
+                     tuner=None, batchsize=BATCH_SIZE, uselxml=False,
+                     **kwargs):
+    """
+    Drop-in replacement for xmltodict.parse(inf, item_depth=2,
+    item_callback=item_callback, **kwargs) calls, where records are parsed
+    in a pool of worker processes
+    item_callback is called in the main process with (path, item) arguments,
+    path includes the root element and the record element only
+    :param inf: xml input stream opened in binary mode, utf-8 encoded
+    :param item_callback: function called for each record parsed,
+                          parsing is stopped if it returns False
+    :param recordtag: name of the record elements, if not specified
+                      name of the first child element of the root is used
+    :param processes: number of worker processes, default is the number
+                      of CPUs
+    :param tuner: function to update the parsed records in worker processes,
+                  should be picklable, i.e. module level function
+                  or static/class method
+    :param batchsize: number of records in each task sent to the workers
+    :param uselxml: parse records with lxml_parse() instead of xmltodict
+    :param kwargs: keyword arguments for xmltodict.parse()
+    """
+    records = iter_xmlrecords(inf, recordtag)
+    prefix = next(records, b'')
+    rootpath = _rootpath(prefix, **kwargs)
+    nsdecls = b''.join(_NSDECL.findall(prefix))
+    header = b'<' + _WRAPPER + nsdecls + b'>'
+    if processes is None:
+        processes = cpu_count()
+    pool = Pool(processes, initializer=_initworker,
+                initargs=(header, tuner, kwargs, uselxml))
+    maxpending = 4 * processes
+    pending = deque()
+    completed = True
+
+    def callback(batch):
+        for recordpath, item in batch:
+            if not item_callback([rootpath, recordpath], item):
+                return False
+        return True
+    try:
+        for batch in _batches(records, batchsize):
+            pending.append(pool.apply_async(_parse_batch, (batch,)))
+            if len(pending) >= maxpending:
+                if not callback(pending.popleft().get()):
+                    completed = False
+                    break
+        while completed and len(pending) > 0:
+            completed = callback(pending.popleft().get())
+    finally:
+        pool.terminate()
+        pool.join()
+    return completed
+
+
+class ListChildren(object):
+    """ force_list callable for xmltodict.parse() and lxml_parse(),
+     forces elements to lists only when they are children of the given
+     list elements, names of nested elements are often reused at other
+     depths, e.g. DrugBank categories.category.category
+    :param pairs: (list element name, child element name) tuples
+    """
+
+    def __init__(self, pairs):
+        self.pairs = frozenset(pairs)
+
+    def __call__(self, path, key, _):
+        return bool(path) and (path[-1][0], key) in self.pairs
+
+
+class _Converter(object):
+    """ Converts lxml elements to dicts of the form xmltodict returns
+     Element and attribute names are cached by their lxml tags,
+     i.e. a namespace is expected to be used with the same prefix """
+
+    def __init__(self, attr_prefix='@', cdata_key='#text', force_list=None,
+                 xml_attribs=True, process_namespaces=False, namespaces=None,
+                 strip_whitespace=True, cdata_separator=''):
+        self.attr_prefix = attr_prefix
+        self.cdata_key = cdata_key
+        self.force_list = force_list
+        self.xml_attribs = xml_attribs
+        self.process_namespaces = process_namespaces
+        self.namespaces = namespaces
+        self.strip_whitespace = strip_whitespace
+        self.cdata_separator = cdata_separator
+        self.nsdiff = True  # check elements for namespace declarations
+        self.names = {}
+        self.rawnames = {}
+        self.attrnames = {}
+
+    def rawname(self, tag, prefix):
+        # Element or attribute name as reported by expat to xmltodict
+        if tag[0] != '{':
+            return tag
+        uri, local = tag[1:].split('}', 1)
+        if self.process_namespaces:
+            return uri + ':' + local
+        if uri == _XMLNS:
+            return 'xml:' + local
+        return prefix + ':' + local if prefix else local
+
+    def buildname(self, name):
+        # Same as xmltodict _DictSAXHandler._build_name()
+        if not self.process_namespaces or not self.namespaces:
+            return name
+        i = name.rfind(':')
+        if i == -1:
+            return name
+        short = self.namespaces.get(name[:i], name[:i])
+        return short + ':' + name[i + 1:] if short else name[i + 1:]
+
+    def name(self, e):
+        tag = e.tag
+        name = self.names.get(tag)
+        if name is None:
+            name = self.buildname(self.rawname(tag, e.prefix))
+            self.names[tag] = name
+        return name
+
+    def _attrprefix(self, e, uri):
+        for prefix, u in e.nsmap.items():
+            if u == uri and prefix is not None:
+                return prefix
+        return None
+
+    @staticmethod
+    def nsdecls(e):
+        # Namespace declarations made by the element
+        parent = e.getparent()
+        pnsmap = parent.nsmap if parent is not None else {}
+        return {prefix or '': uri for prefix, uri in e.nsmap.items()
+                if pnsmap.get(prefix) != uri}
+
+    def rawattrs(self, e):
+        # Attributes of the element with their expat names,
+        # and the namespace declarations made by the element
+        attrs = {}
+        for k, v in e.items():
+            if k[0] == '{':
+                raw = self.rawnames.get(k)
+                if raw is None:
+                    uri = k[1:].split('}', 1)[0]
+                    raw = self.rawname(k, self._attrprefix(e, uri))
+                    self.rawnames[k] = raw
+                k = raw
+            attrs[k] = v
+        decls = self.nsdecls(e) if self.nsdiff else None
+        if decls:
+            if self.process_namespaces:
+                attrs['xmlns'] = dict(decls)
+            else:
+                for prefix, uri in decls.items():
+                    attrs['xmlns:' + prefix if prefix else 'xmlns'] = uri
+        return attrs
+
+    def attrs(self, e):
+        d = {}
+        if self.xml_attribs:
+            prefix = self.attr_prefix
+            for k, v in self.rawattrs(e).items():
+                name = self.attrnames.get(k)
+                if name is None:
+                    name = prefix + self.buildname(k)
+                    self.attrnames[k] = name
+                d[name] = v
+        return d
+
+    def _forcelist(self, path, key, value):
+        # path is the xmltodict path of the parent element
+        if not self.force_list:
+            return False
+        if isinstance(self.force_list, bool):
+            return self.force_list
+        if callable(self.force_list):
+            return self.force_list(path, key, value)
+        return key in self.force_list
+
+    def todict(self, e, item=False, path=None):
+        # path is the xmltodict path of the parent of e, required only
+        # when force_list is a callable
+        d = self.attrs(e) if self.nsdiff or e.keys() else {}
+        data = e.text
+        sep = self.cdata_separator
+        force_list = self.force_list
+        names = self.names
+        cpath = None
+        if callable(force_list):
+            cpath = path + [(self.name(e), self.rawattrs(e) or None)]
+        for c in e:
+            tail = c.tail
+            if tail:
+                data = data + sep + tail if data else tail
+            key = c.tag
+            if not isinstance(key, str):  # processing instructions
+                continue
+            key = names.get(key) or self.name(c)
+            value = self.todict(c, path=cpath)
+            if key in d:
+                v = d[key]
+                if isinstance(v, list):
+                    v.append(value)
+                else:
+                    d[key] = [v, value]
+            elif force_list and self._forcelist(cpath, key, value):
+                d[key] = [value]
+            else:
+                d[key] = value
+        if item:
+            # xmltodict does not include text of the items with children
+            # or attributes, and does not strip text of the plain items
+            return d if d else data or None
+        if data and self.strip_whitespace:
+            data = data.strip()
+        if data:
+            if not d:
+                return data
+            if force_list and self._forcelist(path, self.cdata_key, data):
+                d[self.cdata_key] = [data]
+            else:
+                d[self.cdata_key] = data
+        return d or None
+
+
+def lxml_parse(inf, item_depth, item_callback, recordtag=None, **kwargs):
+    """
+    Faster alternative to xmltodict.parse(inf, item_depth=item_depth,
+    item_callback=item_callback, **kwargs) calls based on lxml iterparse
+    Records are converted to the same dict structure xmltodict returns,
+    record elements are cleared after the item_callback returns
+    :param inf: xml input stream or file name
+    :param item_depth: depth of the record elements, root element is 1
+    :param item_callback: function called for each record parsed with
+                          (path, item) arguments,
+                          parsing is stopped if it returns False
+    :param recordtag: name of the record elements, without namespace prefix,
+                      when specified lxml skips the other elements
+                      which makes parsing faster
+    :param kwargs: keyword arguments supported by xmltodict.parse():
+                   attr_prefix, cdata_key, force_list, xml_attribs,
+                   process_namespaces, namespaces, strip_whitespace,
+                   cdata_separator
+    """
+    from lxml import etree
+    conv = _Converter(**kwargs)
+    if recordtag is None:
+        context = etree.iterparse(inf, events=('start-ns', 'start', 'end'),
+                                  remove_comments=True)
+    else:
+        context = etree.iterparse(inf, events=('start-ns', 'end'),
+                                  tag='{*}' + recordtag, remove_comments=True)
+    depth = 0
+    nsdecls, nsdecls_ = 0, 0  # number of namespace declarations seen
+    for event, e in context:
+        if event == 'start':
+            depth += 1
+            continue
+        if event == 'start-ns':
+            nsdecls += 1
+            continue
+        if recordtag is None:
+            depth -= 1
+            if depth + 1 != item_depth:
+                continue
+        ancestors = list(e.iterancestors())
+        if len(ancestors) + 1 != item_depth:
+            continue
+        conv.nsdiff = True
+        path = [(conv.name(a), conv.rawattrs(a) or None)
+                for a in reversed(ancestors)]
+        path.append((conv.name(e), conv.rawattrs(e) or None))
+        # record elements need to be checked for namespace declarations
+        # only if there were declarations after the previous record
+        conv.nsdiff = nsdecls != nsdecls_
+        nsdecls_ = nsdecls
+        item = conv.todict(e, item=True, path=path[:-1])
+        if not item_callback(path, item):
+            return False
+        e.clear()
+        while e.getprevious() is not None:
+            del e.getparent()[0]
+    return True
@@ -0,0 +1,125 @@
+""" Cross-reference lookup tables, saved by the indexers
+
+ Indexers run with their `--xrefs` option save ids of the dataset
+ entries in other libraries as flat rows of the `xref` collection
+ (or Elasticsearch index), in both directions:
+
+   {"id": <id in lib>, "lib": <library>, "tolib": <dataset>, "toid": <id>}
+   {"id": <entry id>, "lib": <dataset>, "tolib": <library>, "toid": <id>}
+
+ Datasets are named with their MongoDB collection names, or their
+ Elasticsearch index names. With the compound index of the rows,
+ resolve_xrefs() id-mapping queries are answered with the index only,
+ without reading the dataset entries.
+"""
+from elasticsearch.helpers import scan
+
+XREF = 'xref'  # Name of the index or collection the rows are saved
+XREF_INDEX = [('id', 1), ('tolib', 1), ('lib', 1), ('toid', 1)]
+XREF_LIB_INDEX = [('lib', 1), ('tolib', 1)]  # for removexrefs()
+XREF_MAPPINGS = {"properties": {
+    field: {"type": "keyword"} for field, _ in XREF_INDEX}}
+
+
+def xrefsversion(dataset):
+    """ Name the version stamp of the dataset's xref rows is saved with """
+    return "%s.%s" % (XREF, dataset)
+
+
+def hasxrefs(dbc, dataset):
+    """ Whether the xref rows of the dataset were saved """
+    return dbc.getversion(xrefsversion(dataset)) is not None
+
+
+def removexrefs(dbc, dataset):
+    """ Remove the xref rows of the dataset, saved before """
+    if dbc.db == 'Elasticsearch':
+        if dbc.es.indices.exists(index=XREF):
+            dbc.es.delete_by_query(index=XREF, body={"query": {"bool": {
+                "should": [{"term": {"lib": dataset}},
+                           {"term": {"tolib": dataset}}]}}})
+    elif dbc.db in ('MongoDB', 'SQLite'):
+        # rows are saved in both directions, rows to the dataset are
+        # selected with the libraries of the rows from the dataset,
+        # so that both deletes are run with the (lib, tolib) index
+        libs = dbc.mdbi[XREF].distinct("tolib", {"lib": dataset})
+        if libs:
+            dbc.mdbi[XREF].delete_many({"lib": {"$in": libs},
+                                        "tolib": dataset})
+        dbc.mdbi[XREF].delete_many({"lib": dataset})
+
+
+def resolve_xrefs(dbc, ids, from_lib, to_lib):
+    """ Given ids in library from_lib, return their ids in library to_lib,
+        as a dict of lists; ids of any library are resolved if from_lib
+        is None. Ids without cross-references are not included """
+    ids = list(ids)
+    r = dict()
+    if not ids:
+        return r
+    if dbc.db == 'Elasticsearch':
+        filters = [{"terms": {"id": ids}}, {"term": {"tolib": to_lib}}]
+        if from_lib is not None:
+            filters.append({"term": {"lib": from_lib}})
+        hits = scan(dbc.es, index=XREF, _source=["id", "toid"],
+                    query={"query": {"bool": {"filter": filters}}})
+        rows = (hit['_source'] for hit in hits)
+    else:
+        qc = {"id": {"$in": ids}, "tolib": to_lib}
+        if from_lib is not None:
+            qc["lib"] = from_lib
+        rows = dbc.mdbi[XREF].find(qc, projection={"_id": 0, "id": 1,
+                                                   "toid": 1})
+    for row in rows:
+        toids = r.setdefault(row['id'], [])
+        if row['toid'] not in toids:
+            toids.append(row['toid'])
+    return r
+
+
+class XrefWriter(object):
+    """ Writes xref rows of a dataset, with a BulkWriter of the connection
+
+    Rows of the dataset saved before are removed if `recreate` is set.
+    Indexes of the rows are created, and the version stamp of the rows
+    is saved, when the writer is closed.
+    """
+
+    def __init__(self, dbc, dataset, recreate=True, **kwargs):
+        self.dbc = dbc
+        self.dataset = dataset
+        if dbc.db == 'Elasticsearch':
+            dbc.es.indices.create(index=XREF, ignore=400,
+                                  body={"mappings": XREF_MAPPINGS})
+        if recreate:
+            removexrefs(dbc, dataset)
+        self.writer = dbc.bulkwriter(collection=XREF, index=XREF, **kwargs)
+
+    def add(self, lib, ids, toid):
+        """ Add rows for the ids in library lib, of the dataset entry toid """
+        toid = str(toid)
+        for id_ in ids if isinstance(ids, list) else [ids]:
+            id_ = str(id_)
+            self.writer.add(self.row(lib, id_, self.dataset, toid))
+            self.writer.add(self.row(self.dataset, toid, lib, id_))
+
+    @staticmethod
+    def row(lib, id_, tolib, toid):
+        return {"_id": "|".join([lib, id_, tolib, toid]),
+                "id": id_, "lib": lib, "tolib": tolib, "toid": toid}
+
+    def close(self):
+        n = self.writer.close()
+        if self.dbc.db in ('MongoDB', 'SQLite'):
+            self.dbc.mdbi[XREF].create_index(XREF_INDEX)
+            self.dbc.mdbi[XREF].create_index(XREF_LIB_INDEX)
+        elif self.dbc.db == 'Elasticsearch':
+            self.dbc.es.indices.refresh(index=XREF)
+        self.dbc.setversion(xrefsversion(self.dataset))
+        return n
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
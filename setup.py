@@ -25,6 +25,12 @@ setup(
               'gffutils': (
                      'gffutils'
               ),
+              'ijson': (
+                     'ijson'
+              ),
+              'lxml': (
+                     'lxml'
+              ),
               'neo4j': (
                      'neo4j-driver'
               ),
@@ -37,6 +43,15 @@ setup(
               'pandas': (
                      'pandas'
               ),
+              'pyarrow': (
+                     'pyarrow'
+              ),
+              'scipy': (
+                     'numpy', 'scipy'
+              ),
+              'async': (
+                     'motor', 'aiohttp'
+              ),
               'py2cytoscape': (
                      'py2cytoscape'
               ),
@@ -44,7 +59,7 @@ setup(
                      'cobra', 'cobrababel', 'psamm'
               )
        },
-       packages=find_packages(),
+       packages=find_packages(exclude=['benchmarks']),
        scripts=['scripts/nosqlbiosets'],
        keywords=['bioinformatics'],
        classifiers=[
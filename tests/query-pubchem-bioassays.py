@@ -23,11 +23,20 @@ def aggquery(es, index, qc, aggqc):
     return r
 
 
+# Return ids of the assays matching given query
+def assayids(es, index, qc, size=10000):
+    aggqc = {"aids": {"terms": {"field": "assay.descr.aid.id",
+                                "size": size}}}
+    r = aggquery(es, index, qc, aggqc)
+    return [b['key'] for b in r['aggregations']['aids']['buckets']]
+
+
 class Tests(unittest.TestCase):
-    es, index, doc_type = None, None, None
+    es, index, dataindex, doc_type = None, None, None, None
 
     def init(self, db, index, doc_type):
         self.index = index
+        self.dataindex = index + "-bioassaydata"
         self.doc_type = doc_type
         dbc = DBconnection(db, index)
         self.es = dbc.es
@@ -36,13 +45,13 @@ class Tests(unittest.TestCase):
     def check_numberoftestedsubstances(self):
         tsubts = ((638250, 5), (1120060, 27), (1224859, 5683))
         for (aid, n) in tsubts:
-            qc = {"match": {"assay.descr.aid.id": aid}}
+            qc = {"term": {"aid": aid}}
             aggqc = {
                 "tested substances": {"terms": {
-                    "field": "data.sid",
+                    "field": "sid",
                     "size": 1
                 }}}
-            r = aggquery(self.es, self.index, qc, aggqc)
+            r = aggquery(self.es, self.dataindex, qc, aggqc)
             ts = r['aggregations']['tested substances']
             a = ts['sum_other_doc_count'] + len(ts['buckets'])
             if n != a:
@@ -59,7 +68,11 @@ class Tests(unittest.TestCase):
     def sample_aggregation_queries(self):
         # distribution of outcome methods with databases
         # for assays with at least one active outcome
-        qc = {"match": {"data.outcome": "active"}}
+        qc = {"match": {"outcome": "active"}}
+        aggqc = {"aids": {"terms": {"field": "aid", "size": 10000}}}
+        r = aggquery(self.es, self.dataindex, qc, aggqc)
+        aids = [b['key'] for b in r['aggregations']['aids']['buckets']]
+        qc = {"terms": {"assay.descr.aid.id": aids}}
         aggqc = {
             "database": {
                 "terms": {
@@ -77,41 +90,33 @@ class Tests(unittest.TestCase):
             print("less than expected number of assays")
         if r['aggregations']['database']['buckets'][0]['doc_count'] < 3000:
             print("less than expected number of results")
-        # distribution of substances with databases
+        # distribution of substances
         # for assays with target molecule type protein
         qc = {"match": {"assay.descr.target.molecule_type": "protein"}}
+        aids = assayids(self.es, self.index, qc)
+        qc = {"terms": {"aid": aids}}
         aggqc = {
-            "database": {
+            "substance": {
                 "terms": {
-                    "field": "assay.descr.aid_source.db.name",
-                    "size": 100},
-                "aggs": {
-                    "substance": {
-                        "terms": {
-                            "field":
-                                "data.sid",
-                            "size": 10
-                        }}}}}
-        r = aggquery(self.es, self.index, qc, aggqc)
-        b = r['aggregations']['database']['buckets']
-        if len(b) > 0 and b[0]['substance']['buckets'][0]['doc_count'] < 200:
+                    "field": "sid",
+                    "size": 10
+                }}}
+        r = aggquery(self.es, self.dataindex, qc, aggqc)
+        b = r['aggregations']['substance']['buckets']
+        if len(b) == 0 or b[0]['doc_count'] < 200:
             print("less than expected number of substances")
-        # distribution of reference genes with substances
+        # distribution of substances
         # for assays with reference genes defined
         qc = {"exists": {"field": "assay.descr.xref.xref.gene"}}
+        aids = assayids(self.es, self.index, qc)
+        qc = {"terms": {"aid": aids}}
         aggqc = {
             "substance": {
                 "terms": {
-                    "field": "data.sid",
-                    "size": 100},
-                "aggs": {
-                    "gene": {
-                        "terms": {
-                            "field":
-                                "assay.descr.xref.xref.gene",
-                            "size": 10
-                        }}}}}
-        r = aggquery(self.es, self.index, qc, aggqc)
+                    "field": "sid",
+                    "size": 100
+                }}}
+        r = aggquery(self.es, self.dataindex, qc, aggqc)
         sb = r['aggregations']['substance']['buckets']
         if len(sb) == 0 or sb[0]['doc_count'] < 20:
             print("Less than expected number of substances")
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+""" Tests with the asynchronous queries, with SQLite database files """
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from nosqlbiosets.dbutils import DBconnection, closeclients
+from nosqlbiosets.fda.query import QueryFaers
+
+try:
+    import asyncio
+    from nosqlbiosets.asyncquery import AsyncQuery, runall, tothread
+except (ImportError, SyntaxError):
+    asyncio = None
+
+REPORTS = [
+    {"_id": 1, "serious": 1,
+     "patient": {"reaction": [{"reactionmeddrapt": "Nausea"}]}},
+    {"_id": 2, "serious": 2,
+     "patient": {"reaction": [{"reactionmeddrapt": "Nausea"},
+                              {"reactionmeddrapt": "Rash"}]}}
+]
+
+
+@unittest.skipIf(asyncio is None, "asyncio is not available")
+class TestAsyncQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpd = tempfile.mkdtemp()
+        os.chdir(self.tmpd)
+        dbc = DBconnection("SQLite", "biosets", mdbcollection="faers")
+        with dbc.bulkwriter() as writer:
+            for doc in REPORTS:
+                writer.add(dict(doc))
+
+    def tearDown(self):
+        closeclients()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpd)
+
+    def test_queries(self):
+        qry = AsyncQuery("SQLite", "biosets", "faers")
+        aggq = [{"$unwind": "$patient.reaction"},
+                {"$group": {"_id": "$patient.reaction.reactionmeddrapt",
+                            "n": {"$sum": 1}}},
+                {"$sort": {"n": -1}}]
+        r = runall(
+            qry.count({}), qry.query({"serious": 2}),
+            qry.distinct("patient.reaction.reactionmeddrapt"),
+            qry.aggregate_query(aggq))
+        self.assertEqual(2, r[0])
+        self.assertEqual([2], [doc['_id'] for doc in r[1]])
+        self.assertEqual(["Nausea", "Rash"], r[2])
+        self.assertEqual([{"_id": "Nausea", "n": 2}, {"_id": "Rash", "n": 1}],
+                         r[3])
+        # database files are shared with the other connections,
+        # and are not closed with the async connections
+        self.assertIs(DBconnection("SQLite", "biosets").mdbi, qry.dbc.mdbi)
+        runall(qry.close())
+        self.assertEqual(2, qry.dbc.mdbi["faers"].count())
+
+    def test_tothread(self):
+        # methods of the synchronous query classes run concurrently
+        qry = QueryFaers("SQLite", "biosets", "faers")
+        lock = threading.Lock()
+
+        def slowcount(qc):
+            with lock:  # SQLite calls are serialized
+                n = qry.count(qc)
+            time.sleep(0.2)
+            return n
+
+        t = time.time()
+        r = runall(
+            tothread(slowcount, {}), tothread(slowcount, {"serious": 1}),
+            tothread(slowcount, {"serious": 2}))
+        self.assertEqual([2, 1, 1], r)
+        self.assertLess(time.time() - t, 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+""" Tests with the offline reader benchmarks, with small synthetic files """
+import shutil
+import tempfile
+import unittest
+
+from benchmarks.run import BENCHMARKS, runbenchmark
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_benchmarks(self):
+        d = tempfile.mkdtemp()
+        try:
+            for name in sorted(BENCHMARKS):
+                r = runbenchmark(name, d, 20, 1)
+                self.assertEqual(r['records'], 20, name)
+                self.assertGreater(r['peak_rss_kb'], 0)
+        finally:
+            shutil.rmtree(d)
+
+
+if __name__ == '__main__':
+    unittest.main()
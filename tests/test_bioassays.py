@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+""" Tests with the PubChem bioassays indexer, with a small bioassay file
+ and SQLite database files """
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from zipfile import ZipFile
+
+from nosqlbiosets.pubchem.index_bioassays import DATA_DOCTYPE, DOCTYPE, \
+    Indexer, iter_bioassay, read_and_index_pubchem_bioassays
+
+BIOASSAY = {"PC_AssaySubmit": {
+    "assay": {"descr": {
+        "aid": {"id": 1000, "version": 1},
+        "aid_source": {"db": {"name": "DTP/NCI", "date": {
+            "std": {"year": 2006, "month": 7, "day": 21}}}},
+        "name": "NCI human tumor cell line growth inhibition assay"}},
+    "data": [
+        {"sid": 11, "outcome": 2, "data": [{"tid": 1, "value": {"fval": 4.1}}]},
+        {"sid": 12, "outcome": 1, "date": {
+            "std": {"year": 2007, "month": 1, "day": 2}}}
+    ],
+    "revoke": [13]
+}}
+
+
+def gzipped(data):
+    f = io.BytesIO()
+    with gzip.GzipFile(fileobj=f, mode='wb') as gzf:
+        gzf.write(data)
+    return f.getvalue()
+
+
+class TestBioassays(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpd = tempfile.mkdtemp()
+        os.chdir(self.tmpd)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpd)
+
+    def test_iter_bioassay(self):
+        f = io.BytesIO(json.dumps(BIOASSAY).encode('utf-8'))
+        r = list(iter_bioassay(f))
+        self.assertEqual(["assay", "data", "data", "revoke"],
+                         [key for key, _ in r])
+        self.assertEqual(BIOASSAY["PC_AssaySubmit"]["data"][0], r[1][1])
+        self.assertEqual([13], r[3][1])
+
+    def test_index_bioassay(self):
+        with ZipFile("0000001_0001000.zip", "w") as z:
+            z.writestr("0000001_0001000/", b"")  # folder entry
+            z.writestr("0000001_0001000/1000.json.gz",
+                       gzipped(json.dumps(BIOASSAY).encode('utf-8')))
+            z.writestr("0000001_0001000/readme.json.gz",
+                       gzipped(b"{}"))
+        indxr = Indexer("SQLite", "pubchem")
+        read_and_index_pubchem_bioassays("0000001_0001000.zip", indxr)
+        indxr.assays.close()
+        indxr.data.close()
+        assay = indxr.mdbi[DOCTYPE].find_one({"_id": 1000})
+        self.assertEqual("2006-07-21",
+                         assay["assay"]["descr"]["aid_source"]["db"]["date"])
+        self.assertNotIn("data", assay)
+        self.assertEqual([13], assay["revoke"])
+        rows = list(indxr.mdbi[DATA_DOCTYPE].find({"aid": 1000}))
+        self.assertEqual(["1000-11", "1000-12"],
+                         sorted(row["_id"] for row in rows))
+        self.assertIn("2007-01-02", [row.get("date") for row in rows])
+        # assays with ids different from the file names are not indexed
+        indxr = Indexer("SQLite", "pubchem2")
+        indxr.index_bioassay(io.BytesIO(json.dumps(BIOASSAY).encode('utf-8')),
+                             "1001")
+        indxr.assays.close()
+        self.assertEqual(0, indxr.mdbi[DOCTYPE].count())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+""" Tests with the indexing progress journal, nosqlbiosets.checkpoint """
+import os
+import shutil
+import tempfile
+import unittest
+
+from nosqlbiosets.checkpoint import Checkpoint, CheckpointError
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpd = tempfile.mkdtemp()
+        self.dbfile = os.path.join(self.tmpd, 'checkpoints.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpd)
+
+    def test_resume(self):
+        cp = Checkpoint('uniprot:MongoDB:biosets', self.dbfile)
+        self.assertEqual(0, cp.offset('uniprot_sprot.xml.gz'))
+        cp.save('uniprot_sprot.xml.gz', 20000)
+        cp.save('pubmed20n0001.xml.gz', 30000, completed=True)
+        cp.close()
+        cp = Checkpoint('uniprot:MongoDB:biosets', self.dbfile, resume=True)
+        self.assertEqual(20000, cp.offset('uniprot_sprot.xml.gz'))
+        self.assertFalse(cp.completed('uniprot_sprot.xml.gz'))
+        self.assertTrue(cp.completed('pubmed20n0001.xml.gz'))
+        # progress of other jobs should not be visible
+        other = Checkpoint('clinvar:MongoDB:biosets', self.dbfile, resume=True)
+        self.assertEqual(0, other.offset('uniprot_sprot.xml.gz'))
+        other.close()
+        cp.close()
+        # new jobs, without the resume option, start from scratch
+        cp = Checkpoint('uniprot:MongoDB:biosets', self.dbfile)
+        self.assertEqual(0, cp.offset('uniprot_sprot.xml.gz'))
+        self.assertFalse(cp.completed('pubmed20n0001.xml.gz'))
+        cp.close()
+
+    def test_commit(self):
+        cp = Checkpoint('clinvar:MongoDB:biosets', self.dbfile)
+        cp.commit('ClinVarVariationRelease.xml.gz', 10000, 0)
+        self.assertRaises(CheckpointError, cp.commit,
+                          'ClinVarVariationRelease.xml.gz', 20000, 3)
+        self.assertEqual(10000, cp.offset('ClinVarVariationRelease.xml.gz'))
+        cp.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+""" Tests with the database clients shared by the DBconnection objects """
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from nosqlbiosets import dbutils
+from nosqlbiosets.dbutils import DBconnection, closeclients, dbconfig, \
+    getclient
+
+
+class TestDBClients(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpd = tempfile.mkdtemp()
+        os.chdir(self.tmpd)
+
+    def tearDown(self):
+        closeclients()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpd)
+
+    def test_dbconfig(self):
+        self.assertEqual(27017, dbconfig()["mongodb_port"])
+        with open("dbservers.json", "w") as f:
+            json.dump({"mongodb_host": "localhost", "mongodb_port": 27018}, f)
+        self.assertEqual(27018, dbconfig()["mongodb_port"])
+        conf = dbconfig()
+        conf["mongodb_port"] = 1  # copies of the settings are returned
+        self.assertEqual(27018, dbconfig()["mongodb_port"])
+        time.sleep(0.01)
+        with open("dbservers.json", "w") as f:
+            json.dump({"mongodb_host": "localhost", "mongodb_port": 27019}, f)
+        os.utime("dbservers.json", (time.time() + 1, time.time() + 1))
+        self.assertEqual(27019, dbconfig()["mongodb_port"])
+
+    def test_shared_mongodb_clients(self):
+        # MongoDB clients connect lazily, no server is needed here
+        c1 = getclient("MongoDB", "localhost", 27017)
+        self.assertIs(c1, getclient("MongoDB", "localhost", 27017))
+        self.assertIsNot(c1, getclient("MongoDB", "localhost", 27018))
+        dbc1 = DBconnection("MongoDB", "biosets")
+        dbc2 = DBconnection("MongoDB", "tests")
+        self.assertIs(dbc1.mdbi.client, dbc2.mdbi.client)
+        self.assertIs(c1, dbc1.mdbi.client)
+        self.assertEqual(2, len(dbutils._clients))
+        closeclients()
+        self.assertEqual(0, len(dbutils._clients))
+        self.assertIsNot(c1, getclient("MongoDB", "localhost", 27017))
+        # port is not required in the configuration file
+        with open("dbservers.json", "w") as f:
+            json.dump({"mongodb_host": "localhost"}, f)
+        self.assertIsNone(DBconnection("MongoDB", "biosets").port)
+
+    def test_shared_sqlite_databases(self):
+        dbc1 = DBconnection("SQLite", "biosets")
+        dbc2 = DBconnection("SQLite", "biosets")
+        self.assertIs(dbc1.mdbi, dbc2.mdbi)
+        self.assertIsNot(dbc1.mdbi, DBconnection("SQLite", "tests").mdbi)
+        dbc1.mdbi["tests"].insert_many([{"_id": 1}])
+        closeclients()  # database files are closed
+        self.assertRaises(Exception, dbc1.mdbi["tests"].count)
+        dbc = DBconnection("SQLite", "biosets")
+        self.assertIsNot(dbc1.mdbi, dbc.mdbi)
+        self.assertEqual(1, dbc.mdbi["tests"].count())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+""" Tests with the FAERS indexer, with small generated report files
+ and SQLite database files """
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from nosqlbiosets.fda import faers
+from nosqlbiosets.qryutils import Query
+
+
+# Write FAERS report file with n reports
+def faers_zip(outfile, n):
+    reports = [{"safetyreportid": str(10**7 + i),
+                "receivedate": "201901%02d" % (i % 28 + 1),
+                "receivedateformat": "102",
+                "serious": str(i % 2 + 1),
+                "patient": {
+                    "reaction": [{"reactionmeddrapt": "Reaction %d" % i}],
+                    "drug": [{"medicinalproduct": "DRUG%d" % (i % 7),
+                              "drugstartdate": "201812",
+                              "drugstartdateformat": "610"}]}}
+               for i in range(n)]
+    with zipfile.ZipFile(outfile, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr(os.path.basename(outfile)[:-4],
+                   json.dumps({"meta": {}, "results": reports}))
+
+
+class TestFaers(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpd = tempfile.mkdtemp()
+        os.chdir(self.tmpd)
+        os.makedirs(os.path.join("reports", "2019q1"))
+        for i in range(3):
+            faers_zip(os.path.join("reports", "2019q1",
+                                   "drug-event-%04d-of-0003.json.zip"
+                                   % (i + 1)), 50 + i)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpd)
+
+    def test_workers(self):
+        faers.main("SQLite", "reports", "biosets", "faers", None,
+                   workers=2)
+        faers.main("SQLite", "reports", "biosets", "faers1", None)
+        qry = Query("SQLite", "biosets", "faers")
+        self.assertEqual(153, qry.count({}))
+        self.assertEqual(51, qry.count({"_id": {"$in": [
+            "2019q1-drug-event-0002-%d" % i for i in range(60)]}}))
+        docs = sorted(qry.query({}), key=lambda doc: doc["_id"])
+        self.assertEqual(docs, sorted(Query("SQLite", "biosets", "faers1").
+                                      query({}), key=lambda doc: doc["_id"]))
+
+    def test_worker_failures(self):
+        dbc = faers.DBconnection("SQLite", "biosets")
+        with open(os.path.join("reports", "2019q1",
+                               "drug-event-0004-of-0004.json.zip"), "w") as f:
+            f.write("not a zip file")
+        files = list(faers.faers_files("reports"))
+        with dbc.bulkwriter(collection="faers") as writer:
+            self.assertRaises(Exception, faers.read_and_index_faers_files,
+                              files, writer, 2)
+        # workers failing before they signal completion of their files
+        timeout = faers.QUEUE_TIMEOUT
+        faers.QUEUE_TIMEOUT = 0.1
+        try:
+            with dbc.bulkwriter(collection="faers") as writer:
+                self.assertRaises(ValueError,
+                                  faers.read_and_index_faers_files,
+                                  files[:1] + [("2019q1",)], writer, 2)
+        finally:
+            faers.QUEUE_TIMEOUT = timeout
+
+    def test_killed_workers(self):
+        # workers exiting while reading a file, tasks of the workers
+        # never complete; workers are forked with the patched reader
+        read_faers_file = faers.read_faers_file
+
+        def exitingreader(rfolder, infile):
+            if infile == "exit":
+                os._exit(1)
+            return read_faers_file(rfolder, infile)
+        files = list(faers.faers_files("reports"))
+        timeout = faers.QUEUE_TIMEOUT
+        faers.QUEUE_TIMEOUT = 0.1
+        faers.read_faers_file = exitingreader
+        try:
+            dbc = faers.DBconnection("SQLite", "biosets")
+            with dbc.bulkwriter(collection="faers") as writer:
+                self.assertRaises(RuntimeError,
+                                  faers.read_and_index_faers_files,
+                                  files + [("2019q1", "exit")], writer, 2)
+        finally:
+            faers.QUEUE_TIMEOUT = timeout
+            faers.read_faers_file = read_faers_file
+
+
+if __name__ == '__main__':
+    unittest.main()
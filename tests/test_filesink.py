@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+""" Tests with the File option of DBconnection, writing NDJSON files """
+import datetime
+import glob
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from nosqlbiosets.dbutils import DBconnection
+from nosqlbiosets.modelseed import index as modelseed
+
+MODELSEED_COMPOUNDS = (
+    "id\tabbreviation\tname\tformula\tmass\tsource\tinchikey\tcharge\t"
+    "is_core\tis_obsolete\tis_cofactor\tdeltag\tdeltagerr\n"
+    "cpd00001\th2o\tH2O\tH2O\t18.0\tPrimary\tnull\t0\t1\t0\t0\t"
+    "-56.69\t0.5\n"
+    "cpd00067\th+\tH+\tH\t1.0\tPrimary\tnull\t1\t1\t0\t0\t"
+    "null\tnull\n")
+
+
+class TestFileSink(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpd = tempfile.mkdtemp()
+        os.chdir(self.tmpd)  # files are written relative to the folder
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpd)
+
+    @staticmethod
+    def readlines(pattern):
+        lines = []
+        for f in sorted(glob.glob(pattern)):
+            with gzip.open(f, 'rt') as inf:
+                lines += [json.loads(line) for line in inf]
+        return lines
+
+    def test_mongoimport_format(self):
+        dbc = DBconnection("File", "biosets", mdbcollection="tests")
+        dbc.shardsize = 3
+        d = datetime.datetime(2019, 1, 5)
+        with dbc.bulkwriter(chunksize=2, threads=2) as writer:
+            for i in range(7):
+                writer.add({"n": i, "date": d}, docid="d%d" % i)
+        files = glob.glob("biosets/tests-*.ndjson.gz")
+        self.assertEqual(len(files), 3)
+        docs = self.readlines("biosets/tests-*.ndjson.gz")
+        self.assertEqual(sorted(doc['_id'] for doc in docs),
+                         ["d%d" % i for i in range(7)])
+        self.assertEqual(docs[0]['date'], {"$date": "2019-01-05T00:00:00Z"})
+        # new files are numbered after the existing files
+        with dbc.bulkwriter() as writer:
+            writer.add({"n": 7}, docid="d7")
+        self.assertTrue(os.path.exists("biosets/tests-00003.ndjson.gz"))
+        dbc = DBconnection("File", "biosets", mdbcollection="tests",
+                           recreateindex=True)
+        self.assertEqual(glob.glob("biosets/tests-*.ndjson.gz"), [])
+
+    def test_elasticsearch_format(self):
+        dbc = DBconnection("File", "tests")
+        dbc.fileformat = 'Elasticsearch'
+        with dbc.bulkwriter(optype='create') as writer:
+            writer.add({"n": 1, "date": datetime.date(2019, 1, 5)}, docid=1)
+            writer.add({"n": 2})
+        lines = self.readlines("tests/tests-*.ndjson.gz")
+        self.assertEqual(lines, [{"create": {"_id": 1}},
+                                 {"n": 1, "date": "2019-01-05"},
+                                 {"create": {}}, {"n": 2}])
+
+    def test_indexer(self):
+        with open("compounds.tsv", "w") as f:
+            f.write(MODELSEED_COMPOUNDS)
+        # files of earlier runs are replaced, not appended to
+        for _ in range(2):
+            modelseed.main("compounds.tsv", "biosets",
+                           modelseed.TYPE_COMPOUND, "File")
+        docs = self.readlines("biosets/%s-*.ndjson.gz"
+                              % modelseed.TYPE_COMPOUND)
+        self.assertEqual(["cpd00001", "cpd00067"],
+                         [doc['_id'] for doc in docs])
+        self.assertNotIn('_type', docs[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+""" Tests with Query.iterquery() and the Elasticsearch aggregation
+ queries, with mock Elasticsearch clients """
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:  # Python 2
+    import mock
+
+from nosqlbiosets.qryutils import Query
+from nosqlbiosets.uniprot.query import QueryUniProt
+
+
+def hits(i, j):
+    return [{"_id": str(k), "_source": {"n": k}, "sort": [k]}
+            for k in range(i, j)]
+
+
+class TestIterQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpd = tempfile.mkdtemp()
+        os.chdir(self.tmpd)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpd)
+
+    @staticmethod
+    def esquery(qryclass, es, *args):
+        qry = qryclass("SQLite", "tests", *args)
+        qry.dbc.db = 'Elasticsearch'
+        qry.dbc.es = es
+        return qry
+
+    def test_point_in_time(self):
+        es = mock.Mock()
+        es.open_point_in_time.return_value = {"id": "pit1"}
+        bodies = []
+
+        def search(body):
+            bodies.append(dict(body))
+            i = len(bodies) - 1
+            return {"pit_id": "pit%d" % (i + 2),
+                    "hits": {"hits": hits(i * 2, min(i * 2 + 2, 5))}}
+        es.search.side_effect = search
+        qry = self.esquery(Query, es, None)
+        r = qry.iterquery({"query": {"match_all": {}}, "from": 10},
+                          batchsize=2)
+        self.assertFalse(es.open_point_in_time.called)  # generator
+        self.assertEqual(list(range(5)), [hit["_source"]["n"] for hit in r])
+        es.open_point_in_time.assert_called_once_with(index="tests",
+                                                      keep_alive="2m")
+        self.assertEqual(3, len(bodies))
+        self.assertEqual({"id": "pit1", "keep_alive": "2m"}, bodies[0]["pit"])
+        self.assertNotIn("search_after", bodies[0])
+        self.assertNotIn("from", bodies[0])
+        self.assertEqual([{"_shard_doc": "asc"}], bodies[0]["sort"])
+        # search_after requests with the last sort values,
+        # and the point in time ids returned by the previous requests
+        self.assertEqual([1], bodies[1]["search_after"])
+        self.assertEqual("pit2", bodies[1]["pit"]["id"])
+        self.assertEqual([3], bodies[2]["search_after"])
+        es.close_point_in_time.assert_called_once_with(body={"id": "pit3"})
+
+    def test_projection_and_sort(self):
+        es = mock.Mock()
+        es.open_point_in_time.return_value = {"id": "pit1"}
+        es.search.return_value = {"hits": {"hits": hits(0, 1)}}
+        qry = self.esquery(Query, es, None)
+        qc = {"query": {"match_all": {}}, "sort": {"n": "desc"}}
+        list(qry.iterquery(qc, projection=["n"], batchsize=2))
+        body = es.search.call_args[1]["body"]
+        self.assertEqual(["n"], body["_source"])
+        # _shard_doc is added as tiebreaker to the sort of the query
+        self.assertEqual([{"n": "desc"}, {"_shard_doc": "asc"}],
+                         body["sort"])
+        self.assertEqual({"n": "desc"}, qc["sort"])
+        list(qry.iterquery(dict(qc, sort=["n", "_shard_doc"]),
+                           projection={"n": 0}, batchsize=2))
+        body = es.search.call_args[1]["body"]
+        self.assertEqual(["n", "_shard_doc"], body["sort"])
+        self.assertEqual({"includes": [], "excludes": ["n"]}, body["_source"])
+
+    def test_close_point_in_time(self):
+        es = mock.Mock()
+        es.open_point_in_time.return_value = {"id": "pit1"}
+        es.search.return_value = {"hits": {"hits": hits(0, 2)}}
+        qry = self.esquery(Query, es, None)
+        r = qry.iterquery({"query": {"match_all": {}}}, batchsize=2)
+        next(r)
+        r.close()  # point in time is closed when the generator is discarded
+        es.close_point_in_time.assert_called_once_with(body={"id": "pit1"})
+
+    def test_scroll(self):
+        # clients older than 7.10 do not have open_point_in_time method
+        es = mock.Mock(spec=["search", "scroll", "clear_scroll"])
+        qry = self.esquery(Query, es, None)
+        with mock.patch("nosqlbiosets.qryutils.scan",
+                        return_value=iter(hits(0, 3))) as scan:
+            r = list(qry.iterquery({"query": {"match_all": {}}},
+                                   batchsize=2))
+        self.assertEqual(3, len(r))
+        scan.assert_called_once_with(es, query={"query": {"match_all": {}}},
+                                     index="tests", size=2)
+
+    def test_getorganisms(self):
+        es = mock.Mock()
+        es.search.return_value = {"hits": {"hits": [], "total": 5},
+                                  "aggregations": {"organisms": {"buckets": [
+                                      {"key": "scientific", "name": {
+                                          "buckets": [
+                                              {"key": "Homo sapiens",
+                                               "doc_count": 3},
+                                              {"key": "Mus musculus",
+                                               "doc_count": 1}]}},
+                                      {"key": "common", "name": {
+                                          "buckets": [
+                                              {"key": "Human",
+                                               "doc_count": 2}]}}]}}}
+        qry = self.esquery(QueryUniProt, es, "uniprot")
+        r = qry.getorganisms("1.1.1.1", limit=2)
+        self.assertEqual({"scientific": {"Homo sapiens": 3},
+                          "common": {"Human": 2}}, r)
+        body = es.search.call_args[1]["body"]
+        self.assertEqual(0, es.search.call_args[1]["size"])
+        self.assertEqual("organism.name.#text.keyword",
+                         body["aggs"]["organisms"]["aggs"]["name"]["terms"]
+                         ["field"])
+        self.assertFalse(es.open_point_in_time.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
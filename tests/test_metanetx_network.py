@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+""" Tests with the in-memory MetaNetX network, with SQLite database files """
+import os
+import shutil
+import tempfile
+import unittest
+
+from nosqlbiosets.dbutils import DBconnection
+from nosqlbiosets.metanetx.index import TYPE_COMPOUND, TYPE_REACTION, \
+    Indexer, getreactionrecord, read_metanetx_mappings
+from nosqlbiosets.metanetx.network import MetaNetXNetwork
+from nosqlbiosets.metanetx.query import QueryMetaNetX
+
+COMPOUNDS = [("MNXM1", "H(+)"), ("MNXM2", "H2O"), ("MNXM3", "ATP"),
+             ("MNXM7", "ADP"), ("MNXM9", "phosphate"), ("MNXM10", "NADH")]
+REACTIONS = [
+    ("MNXR1", "1 MNXM3@MNXD1 + 1 MNXM2@MNXD1 = 1 MNXM7@MNXD1 +"
+              " 1 MNXM9@MNXD1 + 1 MNXM1@MNXD1", "rhea", ["3.6.1.3"]),
+    ("MNXR2", "1 MNXM1@MNXD1 = 1 MNXM1@MNXD2", "bigg", [""]),
+    ("MNXR3", "2 MNXM7@MNXD1 = 1 MNXM3@MNXD1 + 1 MNXM10@MNXD1", "rhea",
+     ["2.7.4.3"])
+]
+
+
+class TestMetaNetXNetwork(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpd = tempfile.mkdtemp()
+        os.chdir(self.tmpd)
+        self.dbc = DBconnection("SQLite", "biosets")
+        with self.dbc.bulkwriter(collection=TYPE_COMPOUND) as writer:
+            for mid, desc in COMPOUNDS:
+                writer.add({"_id": mid, "desc": desc})
+        self.addreactions(REACTIONS)
+
+    def addreactions(self, reactions):
+        with self.dbc.bulkwriter(collection=TYPE_REACTION) as writer:
+            for rid, eq, lib, ecno in reactions:
+                writer.add({"_id": rid, "equation": eq, "ecno": ecno,
+                            "source": {"lib": lib, "id": rid}})
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpd)
+
+    def test_csr(self):
+        net = MetaNetXNetwork()
+        net.addreaction("R1", [("A", -1), ("B", 1), ("C", 2)])
+        net.addreaction("R2", [("C", -1), ("A", 1)])
+        self.assertEqual([0, 3, 5], list(net.indptr))
+        self.assertEqual([0, 1, 2, 2, 0], list(net.indices))
+        self.assertEqual(({0}, {1, 2}), net.sides(0))
+        self.assertEqual([1], net.rows(["R2", "R3"]))
+
+    def test_metabolite_network(self):
+        qry = QueryMetaNetX("SQLite", "biosets")
+        mn = qry.get_metabolite_network({"source.lib": "rhea"})
+        self.assertEqual(8, mn.number_of_edges())
+        self.assertEqual(["MNXR1"],
+                         mn.get_edge_data("ATP", "ADP")["reactions"])
+        self.assertEqual(["MNXR3"],
+                         mn.get_edge_data("ADP", "ATP")["reactions"])
+        self.assertEqual("rhea", mn.get_edge_data("ADP", "NADH")["sourcelib"])
+        mn = qry.get_metabolite_network({}, sidec=["MNXM2"], selfloops=True)
+        self.assertTrue(mn.has_edge("H(+)", "H(+)"))
+        self.assertNotIn("H2O", mn.nodes())
+        # network is built once for each version of the reactions
+        net = qry.network()
+        self.assertEqual(3, len(net))
+        self.assertIs(net, QueryMetaNetX("SQLite", "biosets").network())
+        self.addreactions([("MNXR4", "1 MNXM10@MNXD1 = 1 MNXM9@MNXD1",
+                            "rhea", [""])])
+        net.tversion = 0  # version is checked in regular intervals
+        self.assertEqual(4, len(qry.network()))
+        mn = qry.get_metabolite_network({"source.lib": "rhea"})
+        self.assertTrue(mn.has_edge("NADH", "phosphate"))
+
+    def test_indexed_stoichiometry(self):
+        with open("reac_prop.tsv", "w") as f:
+            f.write("#MNX_ID\tEquation\tDescription\tBalance\tEC\tSource\n")
+            for rid, eq, lib, ecno in REACTIONS:
+                f.write("%s\t%s\t\ttrue\t%s\t%s:%s\n"
+                        % (rid, eq, ecno[0], lib, rid))
+        indxr = Indexer("SQLite", "biosets", None, None, TYPE_REACTION)
+        indxr.indexall(read_metanetx_mappings("reac_prop.tsv",
+                                              getreactionrecord, {}))
+        qry = QueryMetaNetX("SQLite", "biosets")
+        r = qry.query_reactions({"_id": "MNXR3"})[0]
+        self.assertEqual([{"mnx_id": "MNXM7", "compartment": "MNXD1",
+                           "coefficient": 2.0}], r["reactants"])
+        self.assertEqual(2, len(r["products"]))
+        self.assertEqual(["MNXR1", "MNXR3"],
+                         sorted(qry.metabolite_reactions("MNXM3")))
+        self.assertEqual(["MNXR1"],
+                         qry.metabolite_reactions("MNXM3", "reactants"))
+        self.assertEqual(["MNXR2"], qry.metabolite_reactions(
+            "MNXM1", "products", "MNXD2"))
+        self.assertEqual([], qry.metabolite_reactions("MNXM10", "reactants"))
+        mn = qry.get_metabolite_network({"source.lib": "rhea"})
+        self.assertEqual(8, mn.number_of_edges())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+""" Tests with the ingestion metrics, nosqlbiosets.metrics """
+import io
+import json
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+from nosqlbiosets.metrics import Metrics, profile
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpd = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpd)
+
+    def test_metrics(self):
+        m = Metrics('test', loginterval=3600)
+        inf = m.reader(io.BytesIO(b'x' * 100))
+        self.assertEqual(len(inf.read(60)), 60)
+        inf.read()
+        m.lap()
+        for _ in range(3):
+            m.lap('parse')
+            with m.timer('transform'):
+                m.record()
+            m.lap()
+        m.batch(0.02, 10)
+        m.batch(0.5, 8, 2)
+        m.batch(100, 0, 10)
+        outfile = os.path.join(self.tmpd, 'metrics.json')
+        s = m.summary(outfile)
+        with open(outfile) as f:
+            self.assertEqual(json.load(f), s)
+        self.assertEqual(s['records'], 3)
+        self.assertEqual(s['bytes'], 100)
+        self.assertEqual(s['stages']['parse']['calls'], 3)
+        self.assertEqual(s['stages']['transform']['calls'], 3)
+        self.assertEqual(s['stages']['write']['calls'], 3)
+        self.assertEqual(s['documents'], 18)
+        self.assertEqual(s['rejected'], 12)
+        self.assertEqual(s['batch_latency']['<=0.05'], 1)
+        self.assertEqual(s['batch_latency']['<=0.5'], 1)
+        self.assertEqual(s['batch_latency']['>60'], 1)
+
+    @unittest.skipIf(sys.version_info < (3, 4),
+                     "assertLogs requires Python 3.4 or later")
+    def test_log(self):
+        m = Metrics('test', loginterval=3600)
+        m.tlog -= 3600
+        with self.assertLogs('nosqlbiosets.metrics') as logs:
+            threads = [threading.Thread(target=m.log) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            m.log()
+        self.assertEqual(len(logs.output), 1)
+
+    def test_profile(self):
+        outfile = os.path.join(self.tmpd, 'profile.stats')
+        r = profile(outfile, sorted, [3, 1, 2], reverse=True)
+        self.assertEqual(r, [3, 2, 1])
+        pstats.Stats(outfile)
+        # tracemalloc is available with Python 3.4 and later
+        self.assertEqual(sys.version_info >= (3, 4),
+                         os.path.exists(outfile + '.tracemalloc.txt'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+""" Tests with exporting tabular datasets to Parquet files """
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmarks import generators
+from nosqlbiosets.export_parquet import main, write_parquet
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+d = os.path.dirname(os.path.abspath(__file__))
+
+
+@unittest.skipIf(pq is None, "pyarrow is not installed")
+class TestParquetExport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpd = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpd)
+
+    def test_rnacentral(self):
+        infile = os.path.join(d, "data", "rnacentral-id-mappings-first100.tsv")
+        n = main('rnacentral', infile, self.tmpd, batchsize=8)
+        self.assertEqual(30, n)
+        files = os.listdir(self.tmpd)
+        self.assertEqual(4, len(files))
+        t = pq.read_table(self.tmpd)
+        self.assertEqual(n, t.num_rows)
+        self.assertIn('_id', t.column_names)
+
+    def test_pubtator(self):
+        infile = os.path.join(d, "data", "gene2pubtator.sample")
+        n = main('pubtator_gene2pub', infile, self.tmpd)
+        self.assertEqual(1916, n)
+        t = pq.read_table(self.tmpd)
+        self.assertEqual(n, t.num_rows)
+        self.assertTrue(pa.types.is_dictionary(t.schema.field('pmid').type))
+
+    def test_modelseed_partitioned(self):
+        infile = os.path.join(self.tmpd, "compounds.tsv")
+        generators.modelseed_compounds(infile, 100)
+        outfolder = os.path.join(self.tmpd, "compounds")
+        n = main('modelseed_compounds', infile, outfolder,
+                 partitioncols=['charge'], batchsize=40)
+        self.assertEqual(100, n)
+        self.assertEqual(5, len(os.listdir(outfolder)))
+        t = pq.read_table(outfolder, filters=[('charge', '=', 0)])
+        self.assertLess(0, t.num_rows)
+        self.assertGreater(n, t.num_rows)
+        self.assertNotIn('_type', t.column_names)
+
+    def test_schema_changes(self):
+        records = [{"_id": "MNXM1", "charge": None, "mass": 1},
+                   {"_id": "MNXM2", "charge": None, "mass": 2},
+                   {"_id": "MNXM3", "charge": 1, "mass": 3.5,
+                    "source": {"lib": "chebi"}},
+                   {"_id": "MNXM4", "charge": -1, "mass": None,
+                    "formula": "H2O"}]
+        n = write_parquet(iter(records), self.tmpd, batchsize=2)
+        self.assertEqual(4, n)
+        t = pq.read_table(self.tmpd)
+        self.assertTrue(pa.types.is_integer(t.schema.field('charge').type))
+        rows = sorted(t.to_pylist(), key=lambda r: r["_id"])
+        self.assertEqual([None, None, 1, -1], [r['charge'] for r in rows])
+        self.assertEqual([1.0, 2.0, 3.5, None], [r['mass'] for r in rows])
+        self.assertEqual([None, None, {"lib": "chebi"}, None],
+                         [r['source'] for r in rows])
+        self.assertEqual([None, None, None, "H2O"],
+                         [r['formula'] for r in rows])
+        for f in os.listdir(self.tmpd):
+            self.assertEqual(t.schema, pq.read_schema(
+                os.path.join(self.tmpd, f)).remove_metadata())
+
+
+if __name__ == '__main__':
+    unittest.main()
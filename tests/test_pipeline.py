@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+""" Tests with the bounded-queue executor, nosqlbiosets.pipeline """
+import threading
+import unittest
+
+from nosqlbiosets.pipeline import Pipeline
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test_calls(self):
+        r = []
+        lock = threading.Lock()
+
+        def add(i, j=0):
+            with lock:
+                r.append(i + j)
+        with Pipeline(4, 2) as pipeline:
+            for i in range(100):
+                pipeline.submit(add, i, j=1)
+            pipeline.wait()
+            self.assertEqual(len(r), 100)
+        self.assertEqual(sorted(r), list(range(1, 101)))
+        self.assertEqual(pipeline.nsubmitted, 100)
+        self.assertEqual(pipeline.ncompleted, 100)
+        self.assertEqual(pipeline.nfailed, 0)
+
+    def test_blocking_submit(self):
+        pipeline = Pipeline(1, 2)
+        release = threading.Event()
+        for _ in range(3):  # one running, two queued
+            pipeline.submit(release.wait)
+        t = threading.Thread(target=pipeline.submit, args=(release.wait,))
+        t.start()
+        t.join(0.2)
+        self.assertTrue(t.is_alive())  # blocked on the full queue
+        release.set()
+        t.join()
+        pipeline.close()
+        self.assertEqual(pipeline.ncompleted, 4)
+        self.assertGreater(pipeline.tblocked, 0)
+
+    def test_error_propagation(self):
+        def fail(i):
+            if i == 3:
+                raise ValueError("record %d" % i)
+        pipeline = Pipeline(2, 4)
+        with self.assertRaises(ValueError):
+            for i in range(1000):
+                pipeline.submit(fail, i)
+            pipeline.wait()
+        self.assertEqual(pipeline.nfailed, 1)
+        self.assertRaises(ValueError, pipeline.close)
+        self.assertEqual(pipeline.workers, [])
+
+    def test_with_block_errors(self):
+        def fail():
+            raise ValueError("record")
+        # exceptions of the with block are not replaced by the call errors
+        with self.assertRaises(KeyError):
+            with Pipeline(2, 4) as pipeline:
+                pipeline.submit(fail)
+                pipeline.queue.join()
+                raise KeyError("parser")
+        self.assertEqual(pipeline.nfailed, 1)
+        self.assertEqual(pipeline.workers, [])
+        with self.assertRaises(ValueError):
+            with Pipeline(2, 4) as pipeline:
+                pipeline.submit(fail)
+
+
+if __name__ == '__main__':
+    unittest.main()
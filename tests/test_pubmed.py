@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+""" Tests with the ingest manifest of the PubMed indexer,
+    with SQLite database files """
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from nosqlbiosets.pubmed.query import QueryPubMed, filechecksum, \
+    publishedchecksum
+
+
+class TestPubMedManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpd = tempfile.mkdtemp()
+        os.chdir(self.tmpd)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpd)
+
+    def test_filemanifest(self):
+        data = b"<PubmedArticleSet/>\n" * 100000
+        with open("pubmed21n0001.xml", "wb") as f:
+            f.write(data)
+        checksum = filechecksum("pubmed21n0001.xml")
+        self.assertEqual(hashlib.md5(data).hexdigest(), checksum)
+        qry = QueryPubMed("SQLite", "biosets", "pubmed")
+        self.assertIsNone(qry.getfilemanifest("pubmed21n0001.xml"))
+        self.assertFalse(qry.isfileindexed("pubmed21n0001.xml", checksum))
+        qry.savefilemanifest(os.path.abspath("pubmed21n0001.xml"), checksum,
+                             30000, 2)
+        # files are identified by their names
+        self.assertTrue(qry.isfileindexed("pubmed21n0001.xml", checksum))
+        self.assertFalse(qry.isfileindexed("pubmed21n0001.xml", "0" * 32))
+        self.assertFalse(qry.isfileindexed("pubmed21n0002.xml", checksum))
+        r = qry.getfilemanifest("pubmed21n0001.xml")
+        self.assertEqual((30000, 2), (r['records'], r['deleted']))
+        # manifest records are replaced when the files are indexed again
+        qry.savefilemanifest("pubmed21n0001.xml", "0" * 32, 30001)
+        self.assertTrue(qry.isfileindexed("pubmed21n0001.xml", "0" * 32))
+        self.assertEqual(1, qry.dbc.mdbi[qry.manifestname()].count())
+        # files with the recorded sizes and modification times are
+        # recognized without calculating their checksums
+        r = qry.getfilemanifest("pubmed21n0001.xml")
+        self.assertTrue(qry.isfileunchanged(r, "pubmed21n0001.xml"))
+        self.assertFalse(qry.isfileunchanged(None, "pubmed21n0001.xml"))
+        os.utime("pubmed21n0001.xml", (r['mtime'] + 10, r['mtime'] + 10))
+        self.assertFalse(qry.isfileunchanged(r, "pubmed21n0001.xml"))
+
+    def test_publishedchecksum(self):
+        self.assertIsNone(publishedchecksum("pubmed21n0001.xml.gz"))
+        with open("pubmed21n0001.xml.gz.md5", "w") as f:
+            f.write("MD5(pubmed21n0001.xml.gz)= "
+                    "0123456789abcdef0123456789abcdef\n")
+        self.assertEqual("0123456789abcdef0123456789abcdef",
+                         publishedchecksum("pubmed21n0001.xml.gz"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+""" Tests with the query results cache """
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from nosqlbiosets.dbutils import DBconnection
+from nosqlbiosets.fda.query import QueryFaers
+from nosqlbiosets.qryutils import DatasetObjects
+from nosqlbiosets.querycache import QueryCache
+
+REPORTS = [
+    {"_id": 1, "serious": 1,
+     "patient": {"reaction": [{"reactionmeddrapt": "Nausea"}],
+                 "drug": [{"medicinalproduct": "ASPIRIN"}]}},
+    {"_id": 2, "serious": 2,
+     "patient": {"reaction": [{"reactionmeddrapt": "Nausea"},
+                              {"reactionmeddrapt": "Rash"}],
+                 "drug": [{"medicinalproduct": "IBUPROFEN"}]}}
+]
+
+
+class Obj(object):
+    """ Objects built from the datasets, in the DatasetObjects tests """
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpd = tempfile.mkdtemp()
+        os.chdir(self.tmpd)
+        self.dbc = DBconnection("SQLite", "biosets", mdbcollection="faers")
+        with self.dbc.bulkwriter() as writer:
+            for doc in REPORTS:
+                writer.add(dict(doc))
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpd)
+
+    def test_lru_ttl(self):
+        cache = QueryCache(maxsize=2, ttl=0.5)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(1, cache.get("a"))
+        cache.set("c", 3)  # "b" is the least recently used
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(3, cache.get("c"))
+        time.sleep(0.6)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual({"size": 2, "hits": 2, "misses": 2}, cache.stats())
+        # key order of the query clauses is part of the keys
+        self.assertNotEqual(QueryCache.key({"$sort": {"a": 1, "b": -1}}),
+                            QueryCache.key({"$sort": {"b": -1, "a": 1}}))
+
+    def test_dbfile(self):
+        cache = QueryCache(dbfile="cache.sqlite")
+        cache.set("a", [{"_id": 1}])
+        cache = QueryCache(dbfile="cache.sqlite")
+        self.assertEqual([{"_id": 1}], cache.get("a"))
+        cache.clear()
+        self.assertIsNone(QueryCache(dbfile="cache.sqlite").get("a"))
+
+    def test_cached_queries(self):
+        self.assertIsNotNone(self.dbc.getversion("faers"))
+        cache = QueryCache()
+        qry = QueryFaers("SQLite", "biosets", "faers", cache=cache)
+        r = qry.get_adversereactions({})
+        self.assertEqual(2, r[0]["abundance"])
+        self.assertIs(r, qry.get_adversereactions({}))
+        self.assertEqual(["Nausea", "Rash"],
+                         qry.distinct("patient.reaction.reactionmeddrapt"))
+        self.assertEqual(1, len(qry.query({"serious": 2})))
+        self.assertEqual({"size": 3, "hits": 1, "misses": 3}, cache.stats())
+        # new dataset version after the dataset is updated
+        with self.dbc.bulkwriter() as writer:
+            writer.add({"_id": 3, "patient": {
+                "reaction": [{"reactionmeddrapt": "Rash"}]}})
+        qry.tversion = 0  # version is checked in regular intervals
+        r = qry.get_adversereactions({})
+        self.assertEqual(2, r[1]["abundance"])
+
+    def test_dataset_objects(self):
+        objects = DatasetObjects()
+        started, release = threading.Event(), threading.Event()
+        builds = []
+
+        def slowbuild(version):
+            builds.append(version)
+            started.set()
+            release.wait(5)
+            return Obj()
+        threads = [threading.Thread(target=objects.get,
+                                    args=(self.dbc, "faers", slowbuild))
+                   for _ in range(2)]
+        for t in threads:
+            t.start()
+        started.wait(5)
+        # objects of the other datasets are built while one is being built
+        other = objects.get(self.dbc, "other", lambda version: Obj())
+        self.assertIsNone(other.version)
+        self.assertIs(other, objects.get(self.dbc, "other", None))
+        release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(1, len(builds))  # built once for the version
+        obj = objects.get(self.dbc, "faers", slowbuild)
+        self.assertEqual(self.dbc.getversion("faers"), obj.version)
+        self.assertIsNot(obj, objects.get(self.dbc, "faers", slowbuild,
+                                          refresh=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+""" Tests with the SQLite option of DBconnection, and the Query classes
+ running MongoDB queries with SQLite database files """
+import os
+import shutil
+import tempfile
+import unittest
+
+from nosqlbiosets.dbutils import DBconnection
+from nosqlbiosets.fda.query import QueryFaers
+from nosqlbiosets.modelseed.query import QueryModelSEED
+from nosqlbiosets.qryutils import Query
+from nosqlbiosets.sqlitedb import match
+from nosqlbiosets.uniprot.query import QueryUniProt
+
+REPORTS = [
+    {"_id": 1, "serious": 1, "receivedate": "20190105",
+     "patient": {"patientsex": 1,
+                 "reaction": [{"reactionmeddrapt": "Nausea"},
+                              {"reactionmeddrapt": "Headache"}],
+                 "drug": [{"medicinalproduct": "ASPIRIN"},
+                          {"medicinalproduct": "IBUPROFEN"}]}},
+    {"_id": 2, "serious": 2, "receivedate": "20190211",
+     "patient": {"patientsex": 2,
+                 "reaction": [{"reactionmeddrapt": "Nausea"}],
+                 "drug": [{"medicinalproduct": "ASPIRIN"}]}},
+    {"_id": 3, "serious": 1, "receivedate": "20190301",
+     "patient": {"reaction": [{"reactionmeddrapt": "Rash"},
+                              {"reactionmeddrapt": "Nausea"}],
+                 "drug": [{"medicinalproduct": "IBUPROFEN"}]}}
+]
+
+ENTRIES = [
+    {"_id": "P1_HUMAN", "accession": ["P00001", "Q00001"],
+     "gene": [{"name": [{"type": "primary", "#text": "ABC1"},
+                        {"type": "synonym", "#text": "ABC"}]}],
+     "dbReference": [{"type": "EC", "id": "1.1.1.1"},
+                     {"type": "GeneID", "id": "101"}]},
+    {"_id": "P2_HUMAN", "accession": ["P00002"],
+     "gene": {"name": {"type": "primary", "#text": "ABC1"}},
+     "dbReference": [{"type": "EC", "id": "1.1.1.1"}]},
+    {"_id": "P3_HUMAN", "accession": ["P00003"],
+     "gene": {"name": {"type": "primary", "#text": "XYZ2"}},
+     "dbReference": [{"type": "EC", "id": "2.7.1.1"}]}
+]
+
+
+class TestSQLite(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpd = tempfile.mkdtemp()
+        os.chdir(self.tmpd)  # database files are written in the folder
+        dbc = DBconnection("SQLite", "biosets", mdbcollection="faers")
+        with dbc.bulkwriter(chunksize=2) as writer:
+            for doc in REPORTS:
+                writer.add(dict(doc))
+        with dbc.bulkwriter(collection="uniprot") as writer:
+            for doc in ENTRIES:
+                writer.add(dict(doc))
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpd)
+
+    def test_query_count_distinct(self):
+        qry = Query("SQLite", "biosets", "faers")
+        self.assertTrue(os.path.exists("biosets.sqlite"))
+        self.assertEqual(3, qry.count({}))
+        self.assertEqual(2, qry.count({"serious": 1}))
+        self.assertEqual(1, qry.count({"_id": 2}))
+        self.assertEqual(2, qry.count({"_id": {"$in": [1, 3, 4]}}))
+        self.assertEqual(3, qry.count(
+            {"patient.reaction.reactionmeddrapt": "Nausea"}))
+        self.assertEqual(2, qry.count(
+            {"patient.drug.medicinalproduct": {"$in": ["IBUPROFEN"]}}))
+        self.assertEqual(2, qry.count({"receivedate": {"$gte": "20190201"}}))
+        self.assertEqual(1, qry.count({"patient.patientsex": {
+            "$exists": False}}))
+        self.assertEqual(1, qry.count({"patient.reaction": {"$size": 1}}))
+        self.assertEqual(2, qry.count({"$or": [
+            {"serious": 2}, {"patient.reaction.reactionmeddrapt": "Rash"}]}))
+        self.assertEqual(1, qry.count({"patient.reaction": {"$elemMatch": {
+            "reactionmeddrapt": {"$regex": "^h", "$options": "i"}}}}))
+        self.assertEqual(1, qry.count({"$text": {"$search": "rash"}}))
+        r = list(qry.query({"serious": 1}, projection={"receivedate": 1}))
+        self.assertEqual([{"_id": 1, "receivedate": "20190105"},
+                          {"_id": 3, "receivedate": "20190301"}], r)
+        r = qry.distinct("patient.reaction.reactionmeddrapt", {"serious": 1})
+        self.assertEqual(["Nausea", "Headache", "Rash"], r)
+
+    def test_json_conditions(self):
+        mcl = DBconnection("SQLite", "biosets").mdbi["uniprot"]
+        mcl.insert_many([{"_id": "P4_HUMAN", "accession": "P00004",
+                          "gene": {"name": {"type": "primary", "#text": 1}},
+                          "dbReference": {"type": "EC", "id": "1.1.1.1"}}])
+        docs = list(mcl.find())
+        for qc in [{"accession": "P00002"},
+                   {"accession": {"$in": ["P00004", "Q00001"]}},
+                   {"accession": {"$eq": "P00003"}},
+                   {"gene.name.#text": "ABC1"},
+                   {"gene.name.#text": {"$in": ["XYZ2", 1]}},
+                   {"gene.name.#text": "1"},
+                   {"dbReference.id": "1.1.1.1", "dbReference.type": "EC"},
+                   {"$and": [{"accession": "P00001"},
+                             {"gene.name.type": "synonym"}]},
+                   {"$and": [{"accession": "P00002"},
+                             {"gene.name.type": "synonym"}]},
+                   {"dbReference.0.id": "2.7.1.1"}]:
+            self.assertEqual([doc["_id"] for doc in docs if match(doc, qc)],
+                             [doc["_id"] for doc in mcl.find(qc)], qc)
+        # rows are selected in SQL before the documents are matched
+        sql, params = mcl._select("doc", {"$and": [{"accession": "P00001"}]})
+        self.assertIn("json_each", sql)
+        self.assertEqual(["P00001"], params[:1])
+        sql, params = mcl._select("doc", {"gene.name.#text": "ABC1"})
+        self.assertIn("json_tree", sql)
+        # accession values are arrays, the index is not used
+        mcl.create_index("accession")
+        sql, params = mcl._select("doc", {"accession": "P00001"})
+        self.assertIn("json_each", sql)
+
+    def test_indexed_arrays(self):
+        mcl = DBconnection("SQLite", "biosets").mdbi["reactions"]
+        mcl.create_index("ecno")
+        mcl.create_index("source")
+        mcl.insert_many([{"_id": "R1", "ecno": ["1.1.1.1", "1.1.1.2"],
+                          "source": "seed"},
+                         {"_id": "R2", "ecno": "1.1.1.1", "source": "kegg"},
+                         {"_id": "R3", "source": "seed"}])
+        for qc, ids in [({"ecno": "1.1.1.1"}, ["R1", "R2"]),
+                        ({"ecno": {"$in": ["1.1.1.2", "2.7.1.1"]}}, ["R1"]),
+                        ({"source": "seed"}, ["R1", "R3"]),
+                        ({"ecno": "1.1.1.2", "source": "seed"}, ["R1"])]:
+            self.assertEqual(ids, sorted(doc["_id"] for doc in mcl.find(qc)),
+                             qc)
+        # indexes are used for the fields without array values,
+        # arrays are checked with the indexes
+        sql, params = mcl._select("doc", {"ecno": "1.1.1.2",
+                                          "source": "seed"})
+        self.assertIn("json_each(doc, '$.\"ecno\"')", sql)
+        self.assertNotIn("json_each(doc, '$.\"source\"')", sql)
+        self.assertTrue(mcl._hasarrays("ecno"))
+        self.assertFalse(mcl._hasarrays("source"))
+        f = '''json_extract(doc, '$."ecno"')'''
+        plan = mcl.db.conn.execute(
+            "EXPLAIN QUERY PLAN SELECT 1 FROM reactions WHERE %s >= '['"
+            " AND %s < '\\' LIMIT 1" % (f, f)).fetchall()
+        self.assertIn("reactions$ecno", str(plan))
+        # skip and limit are in the same order as in pymongo find()
+        self.assertEqual(["R3"], [doc["_id"] for doc in
+                                  mcl.find({"source": "seed"}, None, 1, 1)])
+
+    def test_iterquery(self):
+        qry = Query("SQLite", "biosets", "faers")
+        r = qry.iterquery({"serious": 1}, batchsize=1)
+        self.assertFalse(isinstance(r, list))
+        self.assertEqual([1, 3], [doc["_id"] for doc in r])
+
+    def test_upsert(self):
+        dbc = DBconnection("SQLite", "biosets", mdbcollection="faers")
+        with dbc.bulkwriter(upsert=False) as writer:
+            writer.add({"_id": 1, "serious": 2})
+        self.assertEqual(0, writer.nwritten)
+        with dbc.bulkwriter() as writer:
+            writer.add({"_id": 1, "serious": 2})
+        self.assertEqual(1, writer.nwritten)
+        qry = Query("SQLite", "biosets", "faers")
+        self.assertEqual(2, qry.count({"serious": 2}))
+        DBconnection("SQLite", "biosets", mdbcollection="faers",
+                     recreateindex=True)
+        qry = Query("SQLite", "biosets", "faers")
+        self.assertEqual(0, qry.count({}))
+
+    def test_faers_aggregations(self):
+        qry = QueryFaers("SQLite", "biosets", "faers")
+        r = list(qry.get_adversereactions({}))
+        self.assertEqual({"reaction": "Nausea"}, r[0]["_id"])
+        self.assertEqual(3, r[0]["abundance"])
+        self.assertEqual(3, len(r))
+        r = list(qry.get_reaction_medicine_pairs({"serious": 1}, limit=2))
+        self.assertEqual(2, len(r))
+        self.assertEqual({"reaction": "Nausea", "medicine": "IBUPROFEN"},
+                         r[0]["_id"])
+        self.assertEqual(2, r[0]["abundance"])
+        r = list(qry.aggregate_query([
+            {"$group": {"_id": "$serious", "n": {"$sum": 1},
+                        "dates": {"$push": "$receivedate"}}},
+            {"$sort": {"_id": 1}}, {"$skip": 1}]))
+        self.assertEqual([{"_id": 2, "n": 1, "dates": ["20190211"]}], r)
+
+    def test_uniprot_queries(self):
+        qry = QueryUniProt("SQLite", "biosets", "uniprot")
+        r = qry.getgenes("1.1.1.1")
+        self.assertEqual({"primary": {"ABC1": 2}, "synonym": {"ABC": 1}}, r)
+        r = qry.getaccs("1.1.1.1")
+        self.assertEqual(["P00001", "Q00001", "P00002"], r)
+
+    def test_bulkwriter_errors(self):
+        dbc = DBconnection("SQLite", "biosets")
+        writer = dbc.bulkwriter(collection="tests", chunksize=2, threads=2)
+        for i in range(6):  # set ids can't be saved as json
+            writer.add({"n": i}, docid={i} if i == 2 else "d%d" % i)
+        self.assertRaises(TypeError, writer.sync)
+        self.assertEqual(2, writer.nerrors)
+        writer.add({"n": 6}, docid="d6")
+        self.assertEqual(5, writer.close())
+        self.assertEqual(5, dbc.mdbi["tests"].count())
+        with self.assertRaises(TypeError):
+            with dbc.bulkwriter(collection="tests", threads=2) as writer:
+                writer.add({"n": 7}, docid={7})
+
+    def test_resolveids(self):
+        dbc = DBconnection("SQLite", "biosets")
+        with dbc.bulkwriter(collection="uniprot") as writer:
+            for name, gid, gene, taxid in [
+                    ("BLVRB_HUMAN", "645", "BLVRB", "9606"),
+                    ("BIEA_HUMAN", "644", "BLVRA", "9606"),
+                    ("BIEA_MOUSE", "109778", "Blvra", "10090")]:
+                writer.add({"_id": name, "name": name,
+                            "organism": {"dbReference": {
+                                "type": "NCBI Taxonomy", "id": taxid}},
+                            "gene": {"name": {"type": "primary",
+                                              "#text": gene}},
+                            "dbReference": [{"type": "GeneID", "id": gid}]})
+        qry = QueryUniProt("SQLite", "biosets", "uniprot")
+        ids = ["645", "BLVRA", "Blvra", "BIEA_MOUSE", "XYZ"]
+        r = set(qry.resolveids(ids, batchsize=2, threads=2))
+        self.assertEqual({("BLVRB_HUMAN", 645, "BLVRB"),
+                          ("BIEA_HUMAN", 644, "BLVRA")}, r)
+        r = set(qry.resolveids(iter(ids), organism=None, batchsize=2))
+        self.assertEqual(3, len(r))
+        self.assertIn(("BIEA_MOUSE", 109778, "Blvra"), r)
+        # entries matched in more than one batch are yielded once
+        r = list(qry.resolveids(["645", "BLVRA", "BLVRB", "644"],
+                                batchsize=1, threads=3))
+        self.assertEqual([("BLVRB_HUMAN", 645, "BLVRB"),
+                          ("BIEA_HUMAN", 644, "BLVRA")], r)
+        # input ids are read at most `threads` batches ahead
+        nread = []
+
+        def readids():
+            for id_ in ["645"] * 100:
+                nread.append(id_)
+                yield id_
+        r = qry.resolveids(readids(), batchsize=2, threads=2)
+        self.assertEqual(("BLVRB_HUMAN", 645, "BLVRB"), next(r))
+        self.assertEqual(4, len(nread))
+        r.close()
+
+    def test_modelseed_metabolite_network(self):
+        dbc = DBconnection("SQLite", "biosets")
+        with dbc.bulkwriter(collection="modelseed_compound") as writer:
+            for cid, name in [("cpd00001", "H2O"), ("cpd00002", "ATP"),
+                              ("cpd00008", "ADP"), ("cpd00009", "Phosphate")]:
+                writer.add({"_id": cid, "name": name})
+        with dbc.bulkwriter(collection="modelseed_reaction") as writer:
+            writer.add({"_id": "rxn00062", "name": "ATP phosphohydrolase",
+                        "equation": "(1) cpd00001[0] + (1) cpd00002[0] <=>"
+                                    " (1) cpd00008[0] + (1) cpd00009[0]"})
+        qry = QueryModelSEED("SQLite", "biosets")
+        mn = qry.get_metabolite_network({})
+        self.assertEqual(4, mn.number_of_edges())
+        self.assertEqual(["ATP phosphohydrolase"],
+                         mn.get_edge_data("ATP", "ADP")["reactions"])
+        # names are read once for each version of the compounds collection
+        names = qry.compoundnames()
+        self.assertIs(names, QueryModelSEED("SQLite", "biosets").
+                      compoundnames())
+        with dbc.bulkwriter(collection="modelseed_compound") as writer:
+            writer.add({"_id": "cpd00009", "name": "Orthophosphate"})
+        names.tversion = 0  # version is checked in regular intervals
+        mn = qry.get_metabolite_network({})
+        self.assertTrue(mn.has_edge("ATP", "Orthophosphate"))
+
+
+if __name__ == '__main__':
+    unittest.main()
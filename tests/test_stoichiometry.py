@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+""" Tests with the sparse stoichiometric matrices, with SQLite database files """
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import numpy as np
+    import scipy.sparse
+except ImportError:
+    np = None
+
+from nosqlbiosets.dbutils import DBconnection
+from nosqlbiosets.metanetx.index import TYPE_REACTION
+from nosqlbiosets.metanetx.query import QueryMetaNetX
+from nosqlbiosets.modelseed.query import QueryModelSEED, REACTIONSTYPE, \
+    parse_stoichiometry
+from nosqlbiosets.stoichiometry import StoichiometricMatrix, matrixprefix
+
+MODELSEED_REACTIONS = [
+    ("rxn00001", '-1:cpd00001:0:0:"H2O";-1:cpd00012:0:0:"PPi";'
+                 '2:cpd00009:0:0:"Phosphate";1:cpd00067:0:0:"H+"'),
+    ("rxn00002", '-1:cpd00067:0:0:"H+";1:cpd00067:1:0:"H+"'),
+    ("rxn00003", '-2:cpd00008:0:0:"ADP";1:cpd00002:0:0:"ATP";'
+                 '1:cpd00018:0:0:"AMP"')
+]
+
+
+@unittest.skipIf(np is None, "numpy and scipy are required")
+class TestStoichiometry(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpd = tempfile.mkdtemp()
+        os.chdir(self.tmpd)
+        self.dbc = DBconnection("SQLite", "biosets")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpd)
+
+    def test_matrix(self):
+        m = StoichiometricMatrix.build([("R1", [("A", -1), ("B", 1)]),
+                                        ("R2", [("B", -1), ("C", 2)])])
+        s, metabolites, reactions = m.matrix()
+        self.assertTrue(scipy.sparse.isspmatrix_csr(s))
+        self.assertEqual((3, 2), s.shape)
+        self.assertEqual([[-1, 0], [1, -1], [0, 2]], s.toarray().tolist())
+        self.assertEqual([1], list(m.rows(["R2", "R3"])))
+        s, metabolites, reactions = m.matrix(m.rows(["R2"]))
+        self.assertEqual(["B", "C"], list(metabolites))
+        self.assertEqual(["R2"], list(reactions))
+        m.save("matrix")
+        m = StoichiometricMatrix.load("matrix")
+        self.assertIsInstance(m.data, np.memmap)
+        self.assertEqual([[-1], [2]], m.matrix([1])[0].toarray().tolist())
+
+    def test_modelseed(self):
+        self.assertEqual([("cpd00067[0]", -1.0), ("cpd00067[1]", 1.0)],
+                         parse_stoichiometry(MODELSEED_REACTIONS[1][1]))
+        with self.dbc.bulkwriter(collection=REACTIONSTYPE) as writer:
+            for rid, stoichiometry in MODELSEED_REACTIONS:
+                writer.add({"_id": rid, "stoichiometry": stoichiometry})
+        self.dbc.setversion(REACTIONSTYPE, 1)
+        qry = QueryModelSEED("SQLite", "biosets")
+        s, metabolites, reactions = qry.stoichiometric_matrix(
+            cachefolder="matrices")
+        self.assertEqual((8, 3), s.shape)
+        prefix = matrixprefix("matrices", self.dbc.dbid(), REACTIONSTYPE)
+        self.assertTrue(os.path.exists(os.path.join(prefix + "1",
+                                                    "data.npy")))
+        s, metabolites, reactions = qry.stoichiometric_matrix(
+            {"_id": "rxn00003"}, cachefolder="matrices")
+        self.assertEqual(["rxn00003"], list(reactions))
+        self.assertEqual({"cpd00008[0]": -2, "cpd00002[0]": 1,
+                          "cpd00018[0]": 1},
+                         dict(zip(metabolites, s.toarray()[:, 0])))
+        # matrices of the same dataset version in other databases
+        # are saved in separate folders
+        dbc = DBconnection("SQLite", "biosets2")
+        with dbc.bulkwriter(collection=REACTIONSTYPE) as writer:
+            rid, stoichiometry = MODELSEED_REACTIONS[2]
+            writer.add({"_id": rid, "stoichiometry": stoichiometry})
+        dbc.setversion(REACTIONSTYPE, 1)
+        s, metabolites, reactions = QueryModelSEED(
+            "SQLite", "biosets2").stoichiometric_matrix(cachefolder="matrices")
+        self.assertEqual(["rxn00003"], list(reactions))
+        self.assertEqual(2, len(os.listdir("matrices")))
+        # matrices of the earlier versions are removed,
+        # folders of the matrices being saved are kept
+        os.makedirs(prefix + "2.tmp1")
+        self.dbc.setversion(REACTIONSTYPE, 2)
+        s, metabolites, reactions = qry.stoichiometric_matrix(
+            cachefolder="matrices")
+        self.assertEqual(3, len(reactions))
+        self.assertEqual(sorted([os.path.basename(prefix) + "2",
+                                 os.path.basename(prefix) + "2.tmp1",
+                                 os.path.basename(matrixprefix(
+                                     "matrices", dbc.dbid(), REACTIONSTYPE))
+                                 + "1"]),
+                         sorted(os.listdir("matrices")))
+
+    def test_metanetx(self):
+        with self.dbc.bulkwriter(collection=TYPE_REACTION) as writer:
+            writer.add({"_id": "MNXR1", "equation":
+                        "1 MNXM3@MNXD1 + 1 MNXM2@MNXD1 = 1 MNXM7@MNXD1 +"
+                        " 1 MNXM9@MNXD1 + 1 MNXM1@MNXD1"})
+            writer.add({"_id": "MNXR2",
+                        "equation": "1 MNXM1@MNXD1 = 1 MNXM1@MNXD2"})
+        qry = QueryMetaNetX("SQLite", "biosets")
+        s, metabolites, reactions = qry.stoichiometric_matrix(
+            {"_id": "MNXR2"})
+        self.assertEqual([[-1], [1]], s.toarray().tolist())
+        self.assertEqual(["MNXM1@MNXD1", "MNXM1@MNXD2"], list(metabolites))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+""" Tests with the xml parsing methods in nosqlbiosets.xmlutils """
+import io
+import unittest
+from functools import partial
+
+import xmltodict
+
+from nosqlbiosets.objutils import unifylistattributes
+from nosqlbiosets.xmlutils import ListChildren, iter_xmlrecords, \
+    lxml_parse, parse_xmlrecords
+
+try:
+    import lxml
+except ImportError:
+    lxml = None
+
+# DrugBank like records, with nested records of the same name
+XML = b'''<?xml version="1.0" encoding="UTF-8"?>
+<drugbank xmlns="http://www.drugbank.ca" version="5.1">
+<drug type="small molecule"><name>A &amp; B</name>
+ <pathways><pathway><drugs><drug><name>x</name></drug><drug/></drugs>
+ </pathway></pathways>
+</drug>
+<drug type="biotech"><name>C</name>
+ <drug-interactions><drug-interaction>y</drug-interaction>
+ </drug-interactions>
+</drug>
+<drug/>
+<drug  type="x" ><![CDATA[ a > b ]]></drug>
+</drugbank>'''
+
+# Element names reused at other depths, such as DrugBank categories
+NESTED_XML = b'''<drugbank><drug>
+ <categories><category><category>Amino Acids</category></category>
+ </categories>
+ <polypeptide><go-classifiers><go-classifier><category>process</category>
+ </go-classifier></go-classifiers></polypeptide>
+</drug></drugbank>'''
+FORCE_LIST = ListChildren([('categories', 'category'),
+                           ('go-classifiers', 'go-classifier')])
+
+
+class TestXmlUtils(unittest.TestCase):
+
+    @staticmethod
+    def collect(items, path, item):
+        items.append((list(path), item))
+        return True
+
+    def test_iter_xmlrecords(self):
+        for blocksize in [1, 7, 64, 4096]:
+            records = list(iter_xmlrecords(io.BytesIO(XML),
+                                           blocksize=blocksize))
+            self.assertEqual(len(records), 5)
+            self.assertTrue(records[0].endswith(b'version="5.1">\n'))
+            self.assertTrue(records[1].startswith(b'<drug type='))
+            self.assertTrue(records[1].endswith(b'</drug>'))
+            self.assertEqual(records[3], b'<drug/>')
+
+    def test_parse_xmlrecords(self):
+        expected = []
+        xmltodict.parse(XML, item_depth=2, attr_prefix='',
+                        item_callback=partial(self.collect, expected))
+        r = []
+        parse_xmlrecords(io.BytesIO(XML), partial(self.collect, r),
+                         processes=2, batchsize=3, attr_prefix='')
+        self.assertEqual(expected, r)
+
+    def test_parse_xmlrecords_tuner(self):
+        r = []
+        tuner = partial(unifylistattributes, list_attrs=['drug-interactions'])
+        parse_xmlrecords(io.BytesIO(XML), partial(self.collect, r), 'drug',
+                         processes=2, tuner=tuner, attr_prefix='')
+        self.assertEqual(r[1][1]['drug-interactions'], ['y'])
+
+    @unittest.skipIf(lxml is None, "lxml is not installed")
+    def test_lxml_parse(self):
+        for depth in [1, 2, 3]:
+            for kwargs in [{}, {'attr_prefix': ''},
+                           {'force_list': ['drug', 'name']},
+                           {'process_namespaces': True, 'namespaces': {
+                               'http://www.drugbank.ca': None}}]:
+                expected, r = [], []
+                xmltodict.parse(XML, item_depth=depth,
+                                item_callback=partial(self.collect, expected),
+                                **kwargs)
+                lxml_parse(io.BytesIO(XML), depth, partial(self.collect, r),
+                           **kwargs)
+                self.assertEqual(expected, r)
+        expected, r = [], []
+        xmltodict.parse(XML, item_depth=2,
+                        item_callback=partial(self.collect, expected))
+        lxml_parse(io.BytesIO(XML), 2, partial(self.collect, r), 'drug')
+        self.assertEqual(expected, r)
+
+    def test_force_list_children(self):
+        expected = []
+        xmltodict.parse(NESTED_XML, item_depth=2, force_list=FORCE_LIST,
+                        item_callback=partial(self.collect, expected))
+        drug = expected[0][1]
+        self.assertEqual([{'category': 'Amino Acids'}],
+                         drug['categories']['category'])
+        self.assertEqual('process', drug['polypeptide']['go-classifiers']
+                         ['go-classifier'][0]['category'])
+        r = []
+        parse_xmlrecords(io.BytesIO(NESTED_XML), partial(self.collect, r),
+                         processes=2, force_list=FORCE_LIST)
+        self.assertEqual(expected, r)
+        if lxml is not None:
+            r = []
+            lxml_parse(io.BytesIO(NESTED_XML), 2, partial(self.collect, r),
+                       force_list=FORCE_LIST)
+            self.assertEqual(expected, r)
+            r = []
+            lxml_parse(io.BytesIO(NESTED_XML), 2, partial(self.collect, r),
+                       'drug', force_list=FORCE_LIST)
+            self.assertEqual(expected, r)
+
+    @unittest.skipIf(lxml is None, "lxml is not installed")
+    def test_parse_xmlrecords_lxml(self):
+        expected = []
+        xmltodict.parse(XML, item_depth=2, attr_prefix='',
+                        item_callback=partial(self.collect, expected))
+        r = []
+        parse_xmlrecords(io.BytesIO(XML), partial(self.collect, r),
+                         processes=2, batchsize=3, uselxml=True,
+                         attr_prefix='')
+        self.assertEqual(expected, r)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+""" Tests with the cross-reference lookup tables, with SQLite database files """
+import os
+import shutil
+import tempfile
+import unittest
+
+from nosqlbiosets.dbutils import DBconnection
+from nosqlbiosets.metanetx.index import Indexer, getcompoundrecord, \
+    getcompoundxrefrecord, getxrefs, read_metanetx_mappings, \
+    _mergecompoundxrefs, TYPE_COMPOUND
+from nosqlbiosets.metanetx.query import QueryMetaNetX
+from nosqlbiosets.uniprot.qryinterpro import QueryInterPro
+from nosqlbiosets.uniprot.query import QueryUniProt
+from nosqlbiosets.xrefs import XREF, XrefWriter, hasxrefs, removexrefs, \
+    resolve_xrefs
+
+CHEM_PROP = """#MNX_ID\tDescription\tFormula\tCharge\tMass\tInChI\tSMILES\tSource\tInChIKey
+MNXM244\t3-oxopropanoate\tC3H3O3\t-1\t87.05\t\t\tchebi:33190\t
+MNXM39\tformate\tCHO2\t-1\t45.01\t\t\tchebi:15740\t
+"""
+CHEM_XREF = """#XREF\tMNX_ID\tEvidence\tDescription
+kegg:C00222\tMNXM244\tidentity\t3-oxopropanoate
+chebi:17960\tMNXM244\tidentity\t3-oxopropanoate
+chebi:33190\tMNXM244\tidentity\t3-oxopropanoate
+kegg:C00058\tMNXM39\tidentity\tformate
+seed:cpd00047\tMNXM39\tidentity\tformate
+"""
+
+
+class TestXrefs(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpd = tempfile.mkdtemp()
+        os.chdir(self.tmpd)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpd)
+
+    def test_resolve_xrefs(self):
+        dbc = DBconnection("SQLite", "biosets")
+        self.assertFalse(hasxrefs(dbc, "uniprot"))
+        with XrefWriter(dbc, "uniprot") as writer:
+            writer.add("KEGG", "hsa:7157", "P53_HUMAN")
+            writer.add("KEGG", ["hsa:121504", "hsa:8294"], "H4_HUMAN")
+            writer.add("GeneID", 7157, "P53_HUMAN")
+        self.assertTrue(hasxrefs(dbc, "uniprot"))
+        self.assertEqual({"hsa:7157": ["P53_HUMAN"]},
+                         resolve_xrefs(dbc, ["hsa:7157", "7157", "x"],
+                                       "KEGG", "uniprot"))
+        self.assertEqual({"hsa:7157": ["P53_HUMAN"], "7157": ["P53_HUMAN"]},
+                         resolve_xrefs(dbc, ["hsa:7157", "7157"],
+                                       None, "uniprot"))
+        self.assertEqual({"H4_HUMAN": ["hsa:121504", "hsa:8294"]},
+                         resolve_xrefs(dbc, ["H4_HUMAN"], "uniprot", "KEGG"))
+        # rows are selected with the compound index
+        sql, params = dbc.mdbi[XREF]._select(
+            "doc", {"id": {"$in": ["7157"]}, "tolib": "uniprot"})
+        plan = dbc.mdbi.conn.execute("EXPLAIN QUERY PLAN " + sql,
+                                     params).fetchall()
+        self.assertIn("USING INDEX", str(plan))
+        # rows saved before are removed when the rows are saved again
+        with XrefWriter(dbc, "uniprot") as writer:
+            writer.add("KEGG", "hsa:7157", "P53_HUMAN")
+        self.assertEqual(2, dbc.mdbi[XREF].count())
+        # rows of the other datasets are not removed,
+        # rows are removed with the (lib, tolib) index
+        with XrefWriter(dbc, "interpro") as writer:
+            writer.add("PFAM", "PF00870", "IPR002117")
+        removexrefs(dbc, "uniprot")
+        self.assertEqual(["PF00870"], sorted(
+            row["id"] for row in dbc.mdbi[XREF].find({"tolib": "interpro"})))
+        self.assertEqual(2, dbc.mdbi[XREF].count())
+        for qc in [{"lib": "uniprot"},
+                   {"lib": {"$in": ["KEGG"]}, "tolib": "uniprot"}]:
+            sql, params = dbc.mdbi[XREF]._select("_id", qc)
+            plan = dbc.mdbi.conn.execute("EXPLAIN QUERY PLAN " + sql,
+                                         params).fetchall()
+            self.assertIn("xref$lib$tolib", str(plan))
+
+    def test_queries(self):
+        with XrefWriter(DBconnection("SQLite", "biosets"),
+                        "uniprot") as writer:
+            writer.add("KEGG", "hsa:7157", "P53_HUMAN")
+            writer.add("KEGG", "hsa:121504", "H4_HUMAN")
+        qry = QueryUniProt("SQLite", "biosets", "uniprot")
+        self.assertEqual({"P53_HUMAN", "H4_HUMAN"}, set(
+            qry.getnamesforkegg_geneids(["hsa:7157", "hsa:121504"])))
+
+    def test_xrefsmap(self):
+        with open("chem_xref.tsv", "w") as f:
+            f.write(CHEM_XREF)
+        xrefsmap = getxrefs("chem_xref.tsv", getcompoundxrefrecord)
+        self.assertEqual(["MNXM244", "MNXM39"], sorted(xrefsmap))
+        self.assertNotIn("MNXM1", xrefsmap)
+        self.assertEqual([{"lib": "kegg", "id": "C00058",
+                           "evidence": "identity", "desc": "formate"},
+                          {"lib": "seed", "id": "cpd00047",
+                           "evidence": "identity", "desc": "formate"}],
+                         xrefsmap["MNXM39"])
+        self.assertEqual(["17960", "33190"],
+                         [xref["id"] for xref in xrefsmap["MNXM244"]
+                          if xref["lib"] == "chebi"])
+        xrefsmap = getxrefs("chem_xref.tsv", getcompoundxrefrecord,
+                            _mergecompoundxrefs)
+        self.assertEqual(["17960", "33190"],
+                         [xref["id"] for xref in xrefsmap["MNXM244"]
+                          if xref["lib"] == "chebi"][0])
+        xrefsmap["MNXM39"] = None
+        self.assertIsNone(xrefsmap["MNXM39"])
+
+    def test_metanetx_xrefs(self):
+        with open("chem_prop.tsv", "w") as f:
+            f.write(CHEM_PROP)
+        with open("chem_xref.tsv", "w") as f:
+            f.write(CHEM_XREF)
+        xrefsmap = getxrefs("chem_xref.tsv", getcompoundxrefrecord,
+                            _mergecompoundxrefs)
+        indxr = Indexer("SQLite", "biosets", None, None, TYPE_COMPOUND,
+                        xrefs=True)
+        indxr.indexall(read_metanetx_mappings("chem_prop.tsv",
+                                              getcompoundrecord, xrefsmap))
+        qry = QueryMetaNetX("SQLite", "biosets")
+        self.assertEqual(["MNXM244", "MNXM39"],
+                         qry.keggcompoundids2otherids(["C00222", "C00058"]))
+        self.assertEqual(["17960"],
+                         qry.keggcompoundids2otherids(["C00222"], "chebi"))
+        self.assertEqual(["cpd00047", None],
+                         qry.keggcompoundids2otherids(["C00058", "C00222"],
+                                                      "seed"))
+        # None for the KEGG ids without MetaNetX compounds
+        self.assertEqual([None, "MNXM39"],
+                         qry.keggcompoundids2otherids(["C99999", "C00058"]))
+        self.assertEqual([None, "cpd00047"],
+                         qry.keggcompoundids2otherids(["C99999", "C00058"],
+                                                      "seed"))
+
+    def test_interpro_names(self):
+        dbc = DBconnection("SQLite", "biosets")
+        with dbc.bulkwriter(collection="interpro") as writer:
+            writer.add({"_id": "IPR002117", "name": "p53 tumour suppressor"})
+            writer.add({"_id": "IPR011615", "name": "p53 DNA-binding domain"})
+        with XrefWriter(dbc, "interpro") as writer:
+            writer.add("PFAM", "PF00870", "IPR011615")
+            writer.add("PFAM", "PF00870", "IPR002117")
+            writer.add("PFAM", "PF08563", "IPR099999")  # entry not saved
+            writer.add("PRINTS", "PR00386", "IPR002117")
+        qry = QueryInterPro("SQLite", "biosets", "interpro")
+        self.assertEqual({"PF00870": "p53 tumour suppressor",
+                          "PR00386": "p53 tumour suppressor"},
+                         qry.id2names(["PF00870", "PF08563", "PR00386",
+                                       "PF99999"]))
+
+
+if __name__ == '__main__':
+    unittest.main()